@@ -5,16 +5,18 @@ from sqlalchemy import func
 import os
 
 # 导入数据库和模型
-from app.utils.db_manager import db, User, get_config, set_config
+from app.utils.db_manager import db, User, get_config, set_config, ensure_indexes
 # 导入 LoginManager
 from app.utils.login_manager import login_manager
 # 导入 APScheduler
 from app.utils.scheduler import scheduler
+# 导入公开接口限流器
+from app.utils.rate_limiter import init_rate_limiter
 
 # 导入定时任务函数
 # [修改说明] 这里导入的函数现在已经不再需要 app 参数了
 from app.modules.data_core.komari_api import run_periodic_static_sync, run_periodic_snapshot_sync
-from app.modules.subscription.routes import auto_sync_subscriptions_job
+from app.modules.subscription.routes import auto_sync_subscriptions_job, probe_nodes_job, mirror_resources_job
 
 def create_app(config_class=Config):
     # 初始化 Flask 应用
@@ -30,6 +32,9 @@ def create_app(config_class=Config):
     login_manager.login_message = '请先登录以访问此页面'
     login_manager.login_message_category = 'info'
 
+    # 公开订阅接口限流 (内存计数)
+    init_rate_limiter(app)
+
     # 2. 注册蓝图
     register_blueprints(app)
     
@@ -50,6 +55,7 @@ def create_app(config_class=Config):
     with app.app_context():
         # 创建表结构
         db.create_all()
+        ensure_indexes()
         
         # 检查并创建默认管理员
         init_admin_user()
@@ -110,6 +116,30 @@ def create_app(config_class=Config):
             )
             print(f">>> [Scheduler] 静态信息同步任务已启动 (每 {static_sync_interval} 分钟)")
 
+        # 注册任务 3: 节点连通性探测 (每分钟检查一次，开关与间隔由系统设置控制)
+        if not scheduler.get_job('subscription_node_probe'):
+            scheduler.add_job(
+                id='subscription_node_probe',
+                func=probe_nodes_job,
+                trigger='interval',
+                minutes=1,
+                max_instances=1,
+                replace_existing=True,
+                args=[]
+            )
+
+        # 注册任务 4: 远程规则集 / geodata 镜像 (每分钟检查一次，开关与间隔由系统设置控制)
+        if not scheduler.get_job('subscription_resource_mirror'):
+            scheduler.add_job(
+                id='subscription_resource_mirror',
+                func=mirror_resources_job,
+                trigger='interval',
+                minutes=1,
+                max_instances=1,
+                replace_existing=True,
+                args=[]
+            )
+
         if sub_sync_enabled:
             if not scheduler.get_job('subscription_auto_sync'):
                 scheduler.add_job(
@@ -170,7 +200,24 @@ def init_default_settings():
         'ACQUISITION_INTERVAL_MINUTES': {'value': 5, 'desc': '节点流量同步间隔(分)'},
         'STATIC_SYNC_INTERVAL_MINUTES': {'value': 60, 'desc': '节点列表同步间隔(分)'},
         'SUBSCRIPTION_AUTO_SYNC_INTERVAL_MINUTES': {'value': 30, 'desc': '订阅自动同步间隔(分)'},
-        'SUBSCRIPTION_AUTO_SYNC_ENABLED': {'value': 0, 'desc': '订阅自动同步开关(0/1)'}
+        'SUBSCRIPTION_AUTO_SYNC_ENABLED': {'value': 0, 'desc': '订阅自动同步开关(0/1)'},
+        'SUBSCRIPTION_MAX_SIZE_MB': {'value': 20, 'desc': '单个订阅下载大小上限(MB)'},
+        'SUB_DEDUP_POLICY': {'value': 'first', 'desc': '订阅节点去重策略(first=排序靠前的订阅优先/last=靠后优先/off=不去重)'},
+        'SUB_PROBE_ENABLED': {'value': 0, 'desc': '节点连通性定时探测开关(0/1)'},
+        'SUB_PROBE_INTERVAL_MINUTES': {'value': 10, 'desc': '节点连通性探测间隔(分)'},
+        'SUB_PROBE_TLS': {'value': 1, 'desc': '探测时是否进行 TLS 握手(0/1)'},
+        'SUB_PROBE_EXCLUDE_DEAD': {'value': 0, 'desc': '订阅输出剔除不可达节点(0/1)'},
+        'SUB_PROBE_SORT_BY_LATENCY': {'value': 0, 'desc': '订阅输出按延迟排序(0/1)'},
+        'SUB_MIRROR_ENABLED': {'value': 0, 'desc': '镜像模板中的远程规则集与 geodata 并改写下发地址(0/1)'},
+        'SUB_MIRROR_INTERVAL_HOURS': {'value': 24, 'desc': '远程资源镜像更新间隔(小时)'},
+        'SUB_MIRROR_FILTER': {'value': '', 'desc': '只镜像匹配该正则的 URL(留空为全部)'},
+        'SUB_MIRROR_MAX_SIZE_MB': {'value': 64, 'desc': '单个镜像文件大小上限(MB)'},
+        'SUB_USERINFO_ENABLED': {'value': 1, 'desc': '订阅响应附带 subscription-userinfo 流量/到期信息(0/1)'},
+        'SUB_RATE_LIMIT_ENABLED': {'value': 1, 'desc': '公开订阅接口限流开关(0/1)'},
+        'SUB_RATE_LIMIT_PER_TOKEN': {'value': '10/second;300/minute', 'desc': '公开订阅接口每个 Token 限额'},
+        'SUB_RATE_LIMIT_PER_IP': {'value': '20/second;120/minute', 'desc': '公开订阅接口每个 IP 限额'},
+        'SUB_RATE_LIMIT_MIRROR': {'value': '60/second;600/minute', 'desc': '镜像资源下载限额(每个 Token / IP，独立于订阅接口)'},
+        'TRAFFIC_RESET_DAY': {'value': 1, 'desc': '流量账期默认重置日(1-28)'}
     }
     
     for key, data in default_settings.items():
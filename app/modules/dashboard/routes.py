@@ -1,15 +1,32 @@
-from flask import Blueprint, render_template, current_app, request, jsonify
+from flask import Blueprint, render_template, current_app, request, jsonify, Response
 from flask_login import login_required
 from datetime import datetime
+import queue
 
 # 导入 db_manager 中封装的函数
 from app.utils.db_manager import (
-    get_nodes_with_latest_traffic,
-    get_total_consumed_traffic_summary,
     update_node_details,
     delete_node_by_uuid, 
+    query_nodes_page,
     get_config
 )
+from app.modules.data_core.traffic_accounting import set_node_reset_day, get_default_reset_day
+from app.modules.data_core.dashboard_summary import dashboard_summary, build_node_row, node_metrics, summary_totals
+from app.modules.data_core.sparklines import sparkline_cache, SPARKLINE_BUCKETS, MAX_BUCKETS
+from app.utils.event_bus import dashboard_events, format_sse
+
+# SSE 心跳间隔 (秒)，防止反向代理断开空闲连接
+STREAM_HEARTBEAT_SECONDS = 25
+
+# 节点列表分页
+NODES_PER_PAGE_DEFAULT = 24
+NODES_PER_PAGE_MAX = 200
+
+def get_emoji_flag(region_code):
+    # 数据库直接存储 Emoji 图标，为空时返回地球图标
+    if region_code and region_code.strip():
+        return region_code.strip()
+    return '🌐'
 
 bp = Blueprint('dashboard', __name__, url_prefix='/dashboard', template_folder='templates')
 
@@ -18,34 +35,156 @@ bp = Blueprint('dashboard', __name__, url_prefix='/dashboard', template_folder='
 def index():
     """仪表盘主页"""
     
-    # 🚨 修正逻辑：
-    # 因为数据库直接存储了 Emoji 图标，不需要再进行代码转图标的映射。
-    # 直接返回 region_code 即可。
-    def get_emoji_flag(region_code):
-        if region_code and region_code.strip():
-            return region_code.strip()
-        # 如果数据库该字段为空，返回默认地球图标
-        return '🌐'
-        
     current_app.jinja_env.filters['flag'] = get_emoji_flag
     
-    nodes_with_history = get_nodes_with_latest_traffic()
-    
-    total_limit_bytes = 0
-    for node, _ in nodes_with_history:
-        total_limit_bytes += node.traffic_limit
-        
-    summary = get_total_consumed_traffic_summary(top_limit=5)
-    summary['total_traffic_limit'] = total_limit_bytes
+    # 摘要 (总量/Top5/限额) 由采集任务预先构建，这里只读内存；节点卡片由分页 API 加载
+    summary = dashboard_summary.get()
     
     komari_url = get_config('KOMARI_BASE_URL', '#')
     
     return render_template('dashboard.html', 
-                           nodes=nodes_with_history, 
                            summary=summary,
+                           summary_version=dashboard_summary.version,
+                           regions=sorted({r['region'] for r in summary['nodes'] if r['region']}),
+                           per_page=NODES_PER_PAGE_DEFAULT,
                            komari_url=komari_url,
                            now=datetime.now())
 
+# API: 仪表盘摘要 (内存读取)
+@bp.route('/api/summary')
+@login_required
+def summary_api():
+    summary = dashboard_summary.get()
+    return jsonify({
+        'status': 'success',
+        'version': dashboard_summary.version,
+        'built_at': dashboard_summary.built_at.isoformat() if dashboard_summary.built_at else None,
+        'stale': dashboard_summary.stale,
+        'data': summary_totals(summary)
+    })
+
+def _serialize_node_card(node, now, default_reset_day):
+    """
+    节点卡片所需字段 (计数器/账期取自摘要缓存，避免逐个查询历史表)
+    default_reset_day 由调用方读取一次，尚无账期记录的节点共用
+    """
+    row = dashboard_summary.get_node_row(node.uuid) or build_node_row(node)
+    remaining_days = (node.expired_at - now).days if node.expired_at else None
+    links = row['links']
+    billing = row['billing']
+    return {
+        'uuid': node.uuid,
+        'name': node.name,
+        'custom_name': node.custom_name,
+        'display_name': node.custom_name or node.name,
+        'flag': get_emoji_flag(node.region),
+        'expired_at': node.expired_at.strftime('%Y-%m-%d %H:%M') if node.expired_at else None,
+        'remaining_days': remaining_days,
+        'weight': node.weight or 0,
+        'routing_type': node.routing_type if node.routing_type is not None else 0,
+        'links': links,
+        'link_count': len([v for v in links.values() if v]),
+        'traffic_limit': node.traffic_limit or 0,
+        'reset_day': billing['reset_day'] if billing else default_reset_day,
+        'metrics': node_metrics(row)
+    }
+
+# API: 节点列表 (服务端分页/排序/过滤)
+@bp.route('/api/nodes')
+@login_required
+def nodes_page_api():
+    """
+    参数: page, per_page, sort(traffic|expiry|weight|region|name), order(asc|desc),
+          q(名称关键字), region, routing(-1|0|1)
+    """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', NODES_PER_PAGE_DEFAULT)), 1), NODES_PER_PAGE_MAX)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '分页参数错误'}), 400
+
+    sort = request.args.get('sort', 'weight')
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    keyword = (request.args.get('q') or '').strip() or None
+    region = (request.args.get('region') or '').strip() or None
+    routing = request.args.get('routing')
+    try:
+        routing_type = int(routing) if routing not in (None, '') else None
+    except ValueError:
+        routing_type = None
+
+    total, nodes = query_nodes_page(page, per_page, sort, order, keyword, region, routing_type)
+    now = datetime.now()
+    default_reset_day = get_default_reset_day()
+    return jsonify({
+        'status': 'success',
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+        'version': dashboard_summary.version,
+        'nodes': [_serialize_node_card(n, now, default_reset_day) for n in nodes]
+    })
+
+# API: 批量获取节点 24h 流量趋势
+@bp.route('/api/sparklines')
+@login_required
+def sparklines_api():
+    """
+    参数: uuids(逗号分隔，当前页可见节点), buckets(默认 48)
+    一次分组查询返回所有节点的分桶用量，结果缓存到下一轮采集
+    """
+    uuids = [u for u in (request.args.get('uuids') or '').split(',') if u][:NODES_PER_PAGE_MAX]
+    try:
+        buckets = min(max(int(request.args.get('buckets', SPARKLINE_BUCKETS)), 1), MAX_BUCKETS)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '分桶参数错误'}), 400
+
+    start, width, series = sparkline_cache.get(uuids, buckets)
+    return jsonify({
+        'status': 'success',
+        'start': start.isoformat(),
+        'buckets': buckets,
+        'width': width,
+        'unit': 'MB',
+        'version': dashboard_summary.version,
+        'series': series
+    })
+
+# API: 实时推送 (Server-Sent Events)
+@bp.route('/api/stream')
+@login_required
+def stream_api():
+    """
+    每次摘要重建后推送变化的节点指标 (event: delta)
+    客户端通过 ?v= 或 Last-Event-ID 告知已有版本，落后时先补发一次全量
+    """
+    try:
+        client_version = int(request.headers.get('Last-Event-ID') or request.args.get('v') or 0)
+    except ValueError:
+        client_version = 0
+
+    subscription = dashboard_events.subscribe()
+    catch_up = dashboard_summary.full_delta() if client_version < dashboard_summary.version else None
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            if catch_up:
+                yield format_sse('delta', catch_up, event_id=catch_up['v'])
+            while dashboard_events.is_subscribed(subscription):
+                try:
+                    yield subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            dashboard_events.unsubscribe(subscription)
+
+    resp = Response(generate(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
 # API: 删除节点
 @bp.route('/api/delete_node', methods=['POST'])
 @login_required
@@ -60,6 +199,7 @@ def delete_node_api():
         success = delete_node_by_uuid(uuid)
         
         if success:
+            dashboard_summary.refresh()
             return jsonify({'status': 'success', 'message': '节点及历史数据已删除'})
         else:
             return jsonify({'status': 'error', 'message': '删除失败或节点不存在'}), 500
@@ -84,7 +224,12 @@ def update_node_api():
             
         success = update_node_details(uuid, links, routing_type, custom_name)
         
+        # 可选：修改账期重置日
+        if success and data.get('reset_day') not in (None, ''):
+            success = set_node_reset_day(uuid, data.get('reset_day'))
+        
         if success:
+            dashboard_summary.refresh()
             return jsonify({'status': 'success', 'message': '节点更新成功'})
         else:
             return jsonify({'status': 'error', 'message': '数据库更新失败'}), 500
@@ -0,0 +1,256 @@
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from app.utils.db_manager import get_nodes_with_latest_traffic, get_node_billing_map
+from app.utils.scheduler import scheduler
+from app.utils.event_bus import dashboard_events
+
+# =========================================================
+# 仪表盘摘要缓存 (物化视图)
+# 快照任务提交后重建一次，页面与 API 直接读取内存中的结果。
+# 重建失败时继续返回旧数据 (stale-while-revalidate)，并在下一次
+# 读取时于后台重试。
+# =========================================================
+
+TOP_LIMIT = 5
+
+
+def build_node_row(node, history=None, billing=None):
+    """将 ORM 对象压平为普通 dict，避免模板访问已脱离会话的对象"""
+    total_up = (history.total_up or 0) if history else 0
+    total_down = (history.total_down or 0) if history else 0
+    return {
+        'uuid': node.uuid,
+        'name': node.name,
+        'custom_name': node.custom_name,
+        'display_name': node.custom_name or node.name,
+        'region': node.region,
+        'expired_at': node.expired_at,
+        'weight': node.weight or 0,
+        'traffic_limit': node.traffic_limit or 0,
+        'routing_type': node.routing_type if node.routing_type is not None else 0,
+        'links': node.get_links_dict(),
+        'total_up': total_up,
+        'total_down': total_down,
+        'total_usage': total_up + total_down,
+        'cpu_usage': (history.cpu_usage or 0) if history else 0,
+        'sampled_at': history.timestamp if history else None,
+        'billing': {
+            'reset_day': billing.reset_day,
+            'cycle_used': billing.cycle_used,
+            'cycle_up': billing.cycle_up or 0,
+            'cycle_down': billing.cycle_down or 0,
+            'cycle_start': billing.cycle_start,
+            'cycle_end': billing.cycle_end,
+            'exhaust_at': billing.exhaust_at
+        } if billing else None
+    }
+
+
+def build_dashboard_summary(top_limit=TOP_LIMIT):
+    """
+    [读] 一次查询得到所有节点的最新计数器，在内存中汇总总量、Top-N 与限额
+    查询失败时抛出异常，由调用方决定是否保留旧数据
+    """
+    billing_map = get_node_billing_map()
+    rows = [
+        build_node_row(node, history, billing_map.get(node.uuid))
+        for node, history in get_nodes_with_latest_traffic(strict=True)
+    ]
+
+    ranked = sorted((r for r in rows if r['sampled_at']), key=lambda r: r['total_usage'], reverse=True)
+    return {
+        'total_nodes': len(rows),
+        'total_consumed_traffic': sum(r['total_usage'] for r in rows),
+        'total_traffic_limit': sum(r['traffic_limit'] for r in rows),
+        'top_traffic_nodes': [
+            {'name': r['display_name'], 'traffic': r['total_usage']}
+            for r in ranked[:top_limit]
+        ],
+        'nodes': rows
+    }
+
+
+def build_subscription_userinfo(rows, now=None):
+    """
+    订阅客户端 (Clash / mihomo) 使用的 subscription-userinfo 响应头
+    upload / download: 有账期统计时取本账期用量，否则取最新计数器
+    total: 各节点流量限额之和；任一节点不限流量 (traffic_limit 为 0) 时整体为 0 (不限)，
+           避免用量包含不限量节点而超过总量，客户端误显示超额
+    expire: 最早的未过期节点到期时间 (unix 秒)，没有到期时间则省略
+    """
+    now = now or datetime.now()
+    upload = download = total = 0
+    unlimited = False
+    expire = None
+    for row in rows:
+        billing = row['billing']
+        upload += billing['cycle_up'] if billing else row['total_up']
+        download += billing['cycle_down'] if billing else row['total_down']
+        total += row['traffic_limit']
+        unlimited = unlimited or row['traffic_limit'] <= 0
+        expired_at = row['expired_at']
+        if expired_at and expired_at > now and (expire is None or expired_at < expire):
+            expire = expired_at
+
+    parts = [f'upload={upload}', f'download={download}', f'total={0 if unlimited else total}']
+    if expire is not None:
+        parts.append(f'expire={int(expire.timestamp())}')
+    return '; '.join(parts)
+
+
+def node_metrics(row):
+    """单个节点推送给前端的紧凑指标"""
+    billing = row['billing']
+    used = billing['cycle_used'] if billing else row['total_usage']
+    limit = row['traffic_limit']
+    metrics = {
+        'up': row['total_up'],
+        'down': row['total_down'],
+        'cpu': round(row['cpu_usage'] or 0, 1),
+        'used': used,
+        'pct': min(round(used * 100 / limit, 1), 100) if limit > 0 else 0
+    }
+    if billing and limit > 0:
+        exhaust_at, cycle_end = billing['exhaust_at'], billing['cycle_end']
+        metrics['exhaust'] = exhaust_at.isoformat() if exhaust_at and cycle_end and exhaust_at < cycle_end else None
+        metrics['reset'] = cycle_end.isoformat() if cycle_end else None
+    return metrics
+
+
+def summary_totals(data):
+    return {
+        'total_nodes': data['total_nodes'],
+        'total_consumed_traffic': data['total_consumed_traffic'],
+        'total_traffic_limit': data['total_traffic_limit'],
+        'top_traffic_nodes': data['top_traffic_nodes']
+    }
+
+
+def diff_summaries(old, new):
+    """
+    对比两个版本的摘要，只保留变化的节点指标
+    返回 {'totals', 'nodes': {uuid: metrics}, 'added': [...], 'removed': [...]}
+    """
+    old_map = {r['uuid']: node_metrics(r) for r in (old or {}).get('nodes', [])}
+    new_map = {r['uuid']: node_metrics(r) for r in new.get('nodes', [])}
+    changed = {uuid: m for uuid, m in new_map.items() if uuid in old_map and old_map[uuid] != m}
+    return {
+        'totals': summary_totals(new),
+        'nodes': changed,
+        'added': [uuid for uuid in new_map if uuid not in old_map],
+        'removed': [uuid for uuid in old_map if uuid not in new_map]
+    }
+
+
+class DashboardSummaryCache:
+    """进程内的仪表盘摘要，每次成功重建 version + 1"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.data = None
+        self.userinfo = None
+        self._rows_by_uuid = {}
+        self.version = 0
+        self.built_at = None
+        self.stale = True
+        self.last_error = None
+
+    def refresh(self):
+        """[写] 同步重建摘要 (需在 app 上下文内调用)，失败时保留旧数据"""
+        with self._lock:
+            try:
+                data = build_dashboard_summary()
+            except Exception as e:
+                self.stale = True
+                self.last_error = str(e)
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] 仪表盘摘要重建失败，继续使用旧数据: {e}")
+                return False
+            previous = self.data
+            self.data = data
+            self._rows_by_uuid = {r['uuid']: r for r in data['nodes']}
+            self.userinfo = build_subscription_userinfo(data['nodes'])
+            self.version += 1
+            self.built_at = datetime.now()
+            self.stale = False
+            self.last_error = None
+
+            # 有实时订阅者时才计算差量；在锁内发布，保证并发重建时按版本顺序推送 (publish 不阻塞)
+            if dashboard_events.subscriber_count:
+                delta = diff_summaries(previous, data)
+                delta['v'] = self.version
+                dashboard_events.publish('delta', delta, event_id=self.version)
+        return True
+
+    def full_delta(self):
+        """断线重连且版本落后时，补发全部节点指标"""
+        data = self.get()
+        return {
+            'v': self.version,
+            'totals': summary_totals(data),
+            'nodes': {r['uuid']: node_metrics(r) for r in data['nodes']},
+            'added': [],
+            'removed': []
+        }
+
+    def get_node_row(self, uuid):
+        """[读] 按 uuid 取单个节点的摘要记录，不存在返回 None"""
+        self.get()
+        return self._rows_by_uuid.get(uuid)
+
+    def subscription_userinfo(self):
+        """
+        [读] 预先计算好的 subscription-userinfo 头，不访问数据库
+        尚未构建或已过期时触发后台重建，本次返回当前值 (可能为 None)
+        """
+        if self.data is None or self.stale:
+            self._revalidate_in_background()
+        return self.userinfo
+
+    def invalidate(self):
+        """标记为过期，下一次读取时在后台重建"""
+        self.stale = True
+
+    def _revalidate_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        app = getattr(scheduler, 'app', None) or current_app._get_current_object()
+
+        def _worker():
+            try:
+                with app.app_context():
+                    self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=_worker, name='dashboard-summary-refresh', daemon=True).start()
+
+    def get(self):
+        """
+        [读] 获取摘要
+        尚未构建时同步构建一次；过期时先返回旧数据，再后台重建
+        """
+        if self.data is None:
+            self.refresh()
+        elif self.stale:
+            self._revalidate_in_background()
+
+        if self.data is None:
+            return {
+                'total_nodes': 0,
+                'total_consumed_traffic': 0,
+                'total_traffic_limit': 0,
+                'top_traffic_nodes': [],
+                'nodes': []
+            }
+        return self.data
+
+
+# 全局单例
+dashboard_summary = DashboardSummaryCache()
@@ -15,6 +15,10 @@ from app.utils.db_manager import (
 
 # [新增] 导入全局 scheduler 对象，用于获取绑定的 app 实例
 from app.utils.scheduler import scheduler
+# 账期流量核算 (基于快照增量)
+from app.modules.data_core.traffic_accounting import apply_snapshot_deltas
+# 仪表盘摘要缓存 (每轮采集后重建)
+from app.modules.data_core.dashboard_summary import dashboard_summary
 
 # ----------------------------------------------------
 # 基础配置和辅助函数
@@ -104,6 +108,7 @@ def sync_node_list():
                 node_count += 1
             
             print(f"[{datetime.now().strftime('%H:%M:%S')}] 成功同步 {node_count} 个节点信息。")
+            dashboard_summary.refresh()
             return True
         else:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Komari API 返回错误: {data.get('message')}")
@@ -167,8 +172,12 @@ def fetch_and_save_snapshots():
 
     # 2. 批量写入数据库
     if records_to_save:
-        bulk_add_history(records_to_save) 
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] 成功批量写入 {len(records_to_save)} 条历史快照数据。")
+        if bulk_add_history(records_to_save):
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 成功批量写入 {len(records_to_save)} 条历史快照数据。")
+            # 3. 用本次快照的增量更新账期用量与耗尽预测
+            apply_snapshot_deltas(records_to_save)
+            # 4. 数据已提交，重建仪表盘摘要
+            dashboard_summary.refresh()
 
 # ----------------------------------------------------
 # 定时/手动任务入口 (核心修改部分)
@@ -0,0 +1,80 @@
+import threading
+from datetime import datetime, timedelta
+
+from app.utils.db_manager import get_history_bucket_peaks
+from app.modules.data_core.dashboard_summary import dashboard_summary
+
+# =========================================================
+# 仪表盘迷你趋势图 (24h 流量 sparkline)
+# 一次分组查询得到所有可见节点的分桶数据，结果按节点缓存，
+# 直到下一轮采集 (摘要版本变化) 后失效。
+# =========================================================
+
+SPARKLINE_HOURS = 24
+SPARKLINE_BUCKETS = 48
+MAX_BUCKETS = 288
+
+
+def _bucket_usage(peaks, buckets):
+    """
+    由每个桶内计数器的 (最小, 最大) 得到每个桶的用量
+    相邻桶用最大值差分；出现回落视为节点重启，取当前桶最大值
+    """
+    series = [0] * buckets
+    previous = None
+    for idx in range(buckets):
+        if idx not in peaks:
+            continue
+        low, high = peaks[idx]
+        if previous is None:
+            usage = high - low
+        elif high >= previous:
+            usage = high - previous
+        else:
+            usage = high
+        series[idx] = usage
+        previous = high
+    return series
+
+
+class SparklineCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._buckets = None
+        self._start = None
+        self._series = {}
+
+    def get(self, uuids, buckets=SPARKLINE_BUCKETS):
+        """
+        [读] 获取节点的分桶用量序列 (单位 MB，保留两位小数)
+        返回 (start, bucket_seconds, {uuid: [float, ...]})
+        """
+        buckets = min(max(int(buckets), 1), MAX_BUCKETS)
+        bucket_seconds = SPARKLINE_HOURS * 3600 // buckets
+
+        with self._lock:
+            # 新一轮采集完成或桶数变化：整体失效，时间窗口对齐到新的起点
+            if self._version != dashboard_summary.version or self._buckets != buckets:
+                self._version = dashboard_summary.version
+                self._buckets = buckets
+                self._start = datetime.now().replace(microsecond=0) - timedelta(hours=SPARKLINE_HOURS)
+                self._series = {}
+
+            missing = [u for u in uuids if u not in self._series]
+            if missing:
+                peaks_map = {u: {} for u in missing}
+                for uuid, bucket, low, high in get_history_bucket_peaks(missing, self._start, bucket_seconds):
+                    idx = int(bucket)
+                    if 0 <= idx < buckets:
+                        peaks_map[uuid][idx] = (low or 0, high or 0)
+                for uuid, peaks in peaks_map.items():
+                    self._series[uuid] = [
+                        round(v / 1024 / 1024, 2) for v in _bucket_usage(peaks, buckets)
+                    ]
+
+            return self._start, bucket_seconds, {u: self._series[u] for u in uuids}
+
+
+# 全局单例
+sparkline_cache = SparklineCache()
@@ -0,0 +1,222 @@
+import calendar
+from datetime import datetime, timedelta
+
+from app.utils.db_manager import (
+    db,
+    NodeBilling,
+    get_config,
+    get_all_nodes,
+    get_node,
+    get_node_billing_rows,
+    get_history_since,
+    get_last_history_before
+)
+
+# =========================================================
+# 账期流量核算
+# 快照任务写入历史后调用 apply_snapshot_deltas()，只根据本次快照与
+# 上一次计数器的差值累加本账期用量，不再回查历史表。
+# =========================================================
+
+MIN_RESET_DAY = 1
+MAX_RESET_DAY = 28
+
+
+def normalize_reset_day(value, default=1):
+    """账期重置日限定在 1-28，避免 2 月等短月份出现不存在的日期"""
+    try:
+        day = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(day, MIN_RESET_DAY), MAX_RESET_DAY)
+
+
+def get_default_reset_day():
+    return normalize_reset_day(get_config('TRAFFIC_RESET_DAY', 1))
+
+
+def _shift_month(year, month, offset):
+    month_index = year * 12 + (month - 1) + offset
+    return month_index // 12, month_index % 12 + 1
+
+
+def _reset_point(year, month, reset_day):
+    day = min(reset_day, calendar.monthrange(year, month)[1])
+    return datetime(year, month, day)
+
+
+def get_cycle_bounds(now, reset_day):
+    """
+    计算 now 所在账期的 [开始, 结束)
+    账期从每月 reset_day 的 00:00 开始
+    """
+    start = _reset_point(now.year, now.month, reset_day)
+    if now < start:
+        year, month = _shift_month(now.year, now.month, -1)
+        start = _reset_point(year, month, reset_day)
+    year, month = _shift_month(start.year, start.month, 1)
+    end = _reset_point(year, month, reset_day)
+    return start, end
+
+
+def _counter_delta(current, previous):
+    """计数器增量；当前值小于上次值说明节点重启归零，直接取当前值"""
+    current = current or 0
+    if previous is None:
+        return 0
+    delta = current - previous
+    return current if delta < 0 else delta
+
+
+def _cycle_delta(current, previous, previous_at, now, cycle_start):
+    """
+    计入本账期的增量：上一个样本在账期起点之前时 (跨越重置点)，
+    按时间比例拆分，只计入起点之后的部分，重置前消耗的流量不占用新账期额度
+    """
+    delta = _counter_delta(current, previous)
+    if delta and previous_at is not None and cycle_start is not None and previous_at < cycle_start < now:
+        delta = int(delta * (now - cycle_start).total_seconds() / (now - previous_at).total_seconds())
+    return delta
+
+
+def _update_projection(billing, traffic_limit, now):
+    """按本账期平均速率预测限额耗尽时间"""
+    limit = traffic_limit or 0
+    used = billing.cycle_used
+    if limit <= 0:
+        billing.exhaust_at = None
+        return
+    if used >= limit:
+        # 已超额：保留首次超额的时间
+        if billing.exhaust_at is None or billing.exhaust_at > now:
+            billing.exhaust_at = now
+        return
+
+    since = billing.tracked_since or billing.cycle_start
+    elapsed = (now - since).total_seconds() if since else 0
+    if elapsed <= 0 or used <= 0:
+        billing.exhaust_at = None
+        return
+
+    rate = used / elapsed
+    billing.exhaust_at = now + timedelta(seconds=(limit - used) / rate)
+
+
+def _start_cycle(billing, cycle_start, cycle_end):
+    billing.cycle_start = cycle_start
+    billing.cycle_end = cycle_end
+    billing.cycle_up = 0
+    billing.cycle_down = 0
+    billing.tracked_since = None
+    billing.exhaust_at = None
+
+
+def _rebuild_cycle_from_history(billing, traffic_limit, now):
+    """
+    从历史表重建本账期用量 (仅在新建账期记录或修改重置日时执行一次)
+    与增量核算一致：账期内第一个样本相对账期前最后一个样本的增量按时间比例拆分计入
+    """
+    cycle_start, cycle_end = get_cycle_bounds(now, billing.reset_day)
+    _start_cycle(billing, cycle_start, cycle_end)
+
+    prev_up = prev_down = prev_at = None
+    before = get_last_history_before(billing.uuid, cycle_start)
+    if before is not None:
+        prev_up, prev_down, prev_at = before.total_up or 0, before.total_down or 0, before.timestamp
+
+    for row in get_history_since(billing.uuid, cycle_start):
+        if billing.tracked_since is None:
+            billing.tracked_since = cycle_start if prev_at is not None else row.timestamp
+        billing.cycle_up += _cycle_delta(row.total_up, prev_up, prev_at, row.timestamp, cycle_start)
+        billing.cycle_down += _cycle_delta(row.total_down, prev_down, prev_at, row.timestamp, cycle_start)
+        prev_up, prev_down, prev_at = row.total_up or 0, row.total_down or 0, row.timestamp
+        billing.last_sample_at = row.timestamp
+
+    billing.last_up = prev_up
+    billing.last_down = prev_down
+    billing.last_total = (prev_up or 0) + (prev_down or 0) if prev_up is not None else None
+    _update_projection(billing, traffic_limit, now)
+
+
+def apply_snapshot_deltas(records):
+    """
+    [写] 将一批快照 (bulk_add_history 的入参) 计入各节点账期
+    records: [{'uuid', 'total_up', 'total_down', 'timestamp'}, ...]
+    """
+    if not records:
+        return 0
+
+    try:
+        limits = {n.uuid: n.traffic_limit for n in get_all_nodes()}
+        billing_map = get_node_billing_rows({r['uuid'] for r in records})
+        default_day = get_default_reset_day()
+        updated = 0
+
+        for record in records:
+            uuid = record['uuid']
+            if uuid not in limits:
+                continue
+            now = record.get('timestamp') or datetime.now()
+            billing = billing_map.get(uuid)
+
+            if billing is None:
+                # 首次核算：从历史表补齐本账期 (本次快照已写入历史表)
+                billing = NodeBilling(uuid=uuid, reset_day=default_day)
+                db.session.add(billing)
+                billing_map[uuid] = billing
+                _rebuild_cycle_from_history(billing, limits[uuid], now)
+                updated += 1
+                continue
+
+            if billing.cycle_end is None or now >= billing.cycle_end or now < billing.cycle_start:
+                cycle_start, cycle_end = get_cycle_bounds(now, normalize_reset_day(billing.reset_day))
+                _start_cycle(billing, cycle_start, cycle_end)
+
+            up = record.get('total_up') or 0
+            down = record.get('total_down') or 0
+            prev_at = billing.last_sample_at
+            billing.cycle_up = (billing.cycle_up or 0) + _cycle_delta(
+                up, billing.last_up, prev_at, now, billing.cycle_start)
+            billing.cycle_down = (billing.cycle_down or 0) + _cycle_delta(
+                down, billing.last_down, prev_at, now, billing.cycle_start)
+            if billing.tracked_since is None:
+                # 跨越重置点的样本已按比例计入，统计起点即账期起点
+                crossed = prev_at is not None and billing.last_up is not None and prev_at < billing.cycle_start
+                billing.tracked_since = billing.cycle_start if crossed else now
+            billing.last_up = up
+            billing.last_down = down
+            billing.last_total = up + down
+            billing.last_sample_at = now
+            _update_projection(billing, limits[uuid], now)
+            updated += 1
+
+        db.session.commit()
+        return updated
+    except Exception as e:
+        db.session.rollback()
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 账期流量核算失败: {e}")
+        return 0
+
+
+def set_node_reset_day(uuid, reset_day):
+    """[写] 修改节点账期重置日，并按新账期从历史表重建用量"""
+    try:
+        node = get_node(uuid)
+        if not node:
+            return False
+        reset_day = normalize_reset_day(reset_day)
+        billing = node.billing
+        if billing is None:
+            billing = NodeBilling(uuid=uuid)
+            db.session.add(billing)
+        elif billing.reset_day == reset_day and billing.cycle_start is not None:
+            return True
+
+        billing.reset_day = reset_day
+        _rebuild_cycle_from_history(billing, node.traffic_limit, datetime.now())
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error setting reset day for node {uuid}: {e}")
+        return False
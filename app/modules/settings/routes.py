@@ -4,6 +4,7 @@ from flask import render_template, request, flash, redirect, url_for, current_ap
 from flask_login import login_required, logout_user, current_user
 from app.modules.settings import settings_bp
 from app.utils.db_manager import get_all_configs, set_config, update_user_password, get_total_nodes, get_db_file_size 
+from app.utils.setting_cache import setting_cache
 import os
 import json
 import requests
@@ -130,6 +131,8 @@ def general_settings():
                 if is_text_field or cleaned_value:
                     set_config(key, cleaned_value)
 
+        # 让缓存的开关/限额立即生效
+        setting_cache.clear()
         flash('通用系统设置已保存', 'success')
         return redirect(url_for('settings.general_settings'))
 
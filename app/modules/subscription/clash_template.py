@@ -0,0 +1,145 @@
+import os
+import re
+import threading
+from io import StringIO
+
+from ruamel.yaml import YAML
+
+# =========================================================
+# Clash 模板预编译
+# clash_meta.yaml 只在修改时间变化 (或保存模板) 后重新解析一次，
+# 把 proxy-providers / rule-providers 的 URL 改写为占位符并序列化成骨架文本；
+# 每次请求只需替换 base_url / token / timestamp 三个占位符。
+# 已镜像到本机的远程规则集 / geox-url 同时改写为 /subscription/mirror/<id>。
+# =========================================================
+
+BASE_MARK = '__NODETOOL_BASE_URL__'
+TOKEN_MARK = '__NODETOOL_TOKEN__'
+TS_MARK = '__NODETOOL_TS__'
+
+# 占位符替换不做 YAML 转义，只接受 URL 安全字符；否则回退到完整渲染
+_SAFE_VALUE = re.compile(r'^[A-Za-z0-9:/._\-\[\]%~@+]*$')
+
+
+def _new_yaml():
+    yaml = YAML()
+    yaml.preserve_quotes = True
+    yaml.indent(mapping=2, sequence=4, offset=2)
+    return yaml
+
+
+def _is_local_rule_provider(name, provider):
+    """direct / customize 两个规则集由本机提供 (地址为占位符)"""
+    return 'direct' in name or 'direct' in provider.get('path', '') \
+        or 'customize' in name or 'customize' in provider.get('path', '')
+
+
+def collect_remote_resources(config_data):
+    """模板中可镜像的远程资源 URL：geox-url 与 http 类型的 rule-providers"""
+    urls = []
+    for value in (config_data.get('geox-url') or {}).values():
+        if isinstance(value, str) and value.startswith(('http://', 'https://')):
+            urls.append(value)
+    for name, p in (config_data.get('rule-providers') or {}).items():
+        url = p.get('url') if hasattr(p, 'get') else None
+        if isinstance(url, str) and url.startswith(('http://', 'https://')) and not _is_local_rule_provider(name, p):
+            urls.append(url)
+    return urls
+
+
+def _mirror_url(base_url, token, mid):
+    return f"{base_url}/subscription/mirror/{mid}?token={token}"
+
+
+def rewrite_provider_urls(config_data, base_url, token, timestamp, mirrors=None):
+    """
+    按模板中的 provider 名称/路径改写订阅与规则地址
+    mirrors: {原始 URL: mirror_id}，命中的远程资源改为本机镜像地址
+    """
+    if 'proxy-providers' in config_data:
+        for name, p in config_data['proxy-providers'].items():
+            if '0.yaml' in p.get('path', '') or '/raw/0' in p.get('url', '') or '中转' in name:
+                p['url'] = f"{base_url}/subscription/raw/0?token={token}&t={timestamp}"
+                p['interval'] = 300
+            elif '1.yaml' in p.get('path', '') or '/raw/1' in p.get('url', '') or '落地' in name:
+                p['url'] = f"{base_url}/subscription/raw/1?token={token}&t={timestamp}"
+                p['interval'] = 300
+
+    if 'rule-providers' in config_data:
+        for name, p in config_data['rule-providers'].items():
+            if 'direct' in name or 'direct' in p.get('path', ''):
+                p['url'] = f"{base_url}/subscription/list/direct?token={token}&t={timestamp}"
+            elif 'customize' in name or 'customize' in p.get('path', ''):
+                p['url'] = f"{base_url}/subscription/list/customize?token={token}&t={timestamp}"
+            elif mirrors and p.get('url') in mirrors:
+                p['url'] = _mirror_url(base_url, token, mirrors[p['url']])
+
+    if mirrors and config_data.get('geox-url'):
+        geox = config_data['geox-url']
+        for key, value in geox.items():
+            if isinstance(value, str) and value in mirrors:
+                geox[key] = _mirror_url(base_url, token, mirrors[value])
+    return config_data
+
+
+def render_template_full(path, base_url, token, timestamp, mirrors=None):
+    """完整渲染：ruamel 往返解析 + 改写 + 序列化 (仅在预编译不可用时使用)"""
+    yaml = _new_yaml()
+    with open(path, 'r', encoding='utf-8') as f:
+        config_data = yaml.load(f)
+    rewrite_provider_urls(config_data, base_url, token, timestamp, mirrors)
+    out = StringIO()
+    yaml.dump(config_data, out)
+    return out.getvalue()
+
+
+class CompiledClashTemplate:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._mtime = None
+        self._skeleton = None
+        self._mirrors = None
+        self._resources = None
+        self.compiles = 0
+
+    def _compile(self, path, mtime, mirrors):
+        self._skeleton = render_template_full(path, BASE_MARK, TOKEN_MARK, TS_MARK, mirrors)
+        self._path = path
+        self._mtime = mtime
+        self._mirrors = mirrors
+        self.compiles += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._skeleton = None
+            self._resources = None
+
+    def remote_resources(self, path):
+        """[读] 模板引用的可镜像远程资源 (按模板修改时间缓存)"""
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            if self._resources is None or self._resources[0] != (path, mtime):
+                with open(path, 'r', encoding='utf-8') as f:
+                    config_data = _new_yaml().load(f)
+                self._resources = ((path, mtime), collect_remote_resources(config_data or {}))
+            return list(self._resources[1])
+
+    def render(self, path, base_url, token, timestamp, mirrors=None):
+        """[读] 返回最终配置文本；模板修改时间或镜像列表变化时先重新编译"""
+        mirrors = mirrors or {}
+        if not (_SAFE_VALUE.match(base_url) and _SAFE_VALUE.match(str(token))):
+            return render_template_full(path, base_url, token, timestamp, mirrors)
+
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            if (self._skeleton is None or self._path != path or self._mtime != mtime
+                    or self._mirrors != mirrors):
+                self._compile(path, mtime, mirrors)
+            skeleton = self._skeleton
+
+        return skeleton.replace(BASE_MARK, base_url).replace(TOKEN_MARK, str(token)).replace(TS_MARK, str(timestamp))
+
+
+# 全局单例
+clash_template = CompiledClashTemplate()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+
+from .link_parser import parse_proxy_link
+
+# =========================================================
+# 订阅节点去重
+# 不同订阅常包含同一台服务器 (只是名称不同)，按节点名合并无法识别。
+# 对解析后的 proxy 计算规范化指纹：类型 + 服务器 + 端口 + 凭据 + 传输层，
+# 指纹相同即视为同一节点，同步时只保留按策略选出的一条。
+# =========================================================
+
+POLICY_FIRST = 'first'   # 订阅列表中排序靠前的来源优先
+POLICY_LAST = 'last'     # 排序靠后的来源优先 (后添加的订阅覆盖先前的)
+POLICY_OFF = 'off'       # 不去重
+DEDUP_POLICIES = (POLICY_FIRST, POLICY_LAST, POLICY_OFF)
+
+# 各协议中代表"身份"的字段
+_CREDENTIAL_KEYS = {
+    'vless': ('uuid',),
+    'vmess': ('uuid',),
+    'trojan': ('password',),
+    'hysteria2': ('password', 'obfs-password'),
+    'tuic': ('uuid', 'password'),
+    'ss': ('cipher', 'password'),
+    'socks5': ('username', 'password'),
+}
+
+# 上一次同步的指纹：link -> fingerprint (无法解析为 None)，未变化的链接不再重复解析
+_fingerprints = {}
+
+
+def _transport(proxy):
+    """传输层：network + 路径/服务名/Host，以及 Reality 公钥"""
+    network = str(proxy.get('network') or 'tcp').lower()
+    opts = proxy.get(f'{network}-opts') or {}
+    if network == 'ws':
+        headers = opts.get('headers') or {}
+        detail = [opts.get('path') or '/', headers.get('Host') or '']
+    elif network == 'grpc':
+        detail = [opts.get('grpc-service-name') or '']
+    elif network in ('h2', 'http'):
+        detail = [opts.get('path') or [], opts.get('host') or (opts.get('headers') or {}).get('Host') or []]
+    else:
+        detail = []
+    reality = proxy.get('reality-opts') or {}
+    if reality:
+        detail.append(reality.get('public-key') or '')
+    if proxy.get('plugin'):
+        detail += [proxy['plugin'], proxy.get('plugin-opts') or {}]
+    return [network] + detail
+
+
+def proxy_fingerprint(proxy):
+    """计算 Clash proxy 字典的规范化指纹 (sha1 十六进制)；缺少服务器或端口时返回 None"""
+    p_type = str(proxy.get('type') or '').lower()
+    server = str(proxy.get('server') or '').strip('[]').lower()
+    try:
+        port = int(proxy.get('port'))
+    except (TypeError, ValueError):
+        return None
+    if not p_type or not server:
+        return None
+    credential = [str(proxy.get(k) or '') for k in _CREDENTIAL_KEYS.get(p_type, ('uuid', 'password'))]
+    canonical = json.dumps([p_type, server, port, credential, _transport(proxy)],
+                           ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def link_fingerprint(link, cache=None):
+    """分享链接的指纹 (解析失败返回 None)，cache 为本次同步的 link -> fingerprint 字典"""
+    if cache is not None and link in cache:
+        return cache[link]
+    if link in _fingerprints:
+        fp = _fingerprints[link]
+    else:
+        proxy = parse_proxy_link(link, '', None)
+        fp = proxy_fingerprint(proxy) if proxy else None
+    if cache is not None:
+        cache[link] = fp
+    return fp
+
+
+class DedupIndex:
+    """
+    指纹 -> (rank, 胜出项) 的哈希索引，rank 越小越优先
+    所有候选项加入后调用 winners() 取得保留项集合
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._cache = {}
+        self.duplicates = 0
+
+    def add(self, link, rank, item):
+        fp = link_fingerprint(link, self._cache)
+        if fp is None:
+            # 无法解析的链接不参与去重，直接保留
+            self._index[('raw', id(item))] = (rank, item)
+            return
+        current = self._index.get(fp)
+        if current is not None:
+            self.duplicates += 1
+            if current[0] <= rank:
+                return
+        self._index[fp] = (rank, item)
+
+    def winners(self):
+        """保留项的 id 集合"""
+        return {id(item) for _, item in self._index.values()}
+
+    def commit(self):
+        """同步结束后保存本次计算过的指纹，供下次同步复用"""
+        global _fingerprints
+        _fingerprints = self._cache
+
+
+def source_rank(policy, order):
+    """按策略把订阅的排序号转换为 rank"""
+    return -order if policy == POLICY_LAST else order
@@ -0,0 +1,272 @@
+import base64
+import copy
+import json
+import re
+import urllib.parse
+from io import StringIO
+
+from ruamel.yaml import YAML
+
+from .link_parser import parse_proxy_link, get_emoji_flag, fix_link_ipv6
+from .sub_formats import proxy_to_singbox_outbound
+
+# =========================================================
+# 订阅输出引擎
+# 注册表每个版本只构建一次中间表示 (每个节点的每条链接一项)：
+#   {'uuid', 'origin', 'routing_type', 'protocol', 'region', 'source_id', 'name', 'share_link', 'proxy'}
+# 链接解析结果按链接文本跨版本复用，只有新增/修改过的链接才重新解析。
+# 各客户端格式 (Clash / sing-box / Base64 / 纯链接) 都由 emitter 从中间表示生成。
+# 过滤 (地区/协议/来源/订阅/名称) 使用按版本预建的倒排索引，不逐个节点扫描。
+# =========================================================
+
+TARGET_CLASH = 'clash'
+TARGET_SINGBOX = 'singbox'
+TARGET_BASE64 = 'base64'
+TARGET_LINKS = 'links'
+
+TARGET_ALIASES = {
+    'clash': TARGET_CLASH, 'mihomo': TARGET_CLASH, 'meta': TARGET_CLASH, 'stash': TARGET_CLASH,
+    'singbox': TARGET_SINGBOX, 'sing-box': TARGET_SINGBOX, 'sfa': TARGET_SINGBOX, 'sfi': TARGET_SINGBOX,
+    'base64': TARGET_BASE64, 'v2ray': TARGET_BASE64, 'v2rayn': TARGET_BASE64,
+    'links': TARGET_LINKS, 'raw': TARGET_LINKS, 'plain': TARGET_LINKS,
+}
+
+# 客户端 User-Agent 识别 (未识别时输出 Base64，兼容 v2rayN / Passwall 等)
+_UA_SINGBOX = re.compile(r'sing-?box|\bsf[aimt]/', re.I)
+_UA_CLASH = re.compile(r'clash|mihomo|stash', re.I)
+
+# 可过滤字段：查询参数名 -> 中间表示字段
+FILTER_FIELDS = {
+    'region': 'region',
+    'protocol': 'protocol',
+    'origin': 'origin',
+    'source': 'source_id',
+}
+PROTOCOL_ALIASES = {'hysteria2': 'hy2', 'shadowsocks': 'ss', 'socks': 'socks5'}
+
+# 上一版本的链接解析结果：link -> Clash proxy 字典 (name 在输出时覆盖)，解析失败为 None
+_parsed_links = {}
+
+
+def node_display_name(node, proto):
+    """输出名称：DB 节点 '国旗 proto-名称'，本地节点 '📝 proto-名称'，订阅节点保留原名"""
+    origin = node.get('origin', 'local')
+    name = node.get('name', 'Unknown')
+    if origin == 'db':
+        flag, prefix = get_emoji_flag(node.get('region')), f"{proto.lower()}-"
+    elif origin == 'sub':
+        flag, prefix = '', ''
+    else:
+        flag, prefix = '📝', f"{proto.lower()}-"
+    return f"{flag} {prefix}{name}".strip()
+
+
+def build_output_nodes(nodes_map):
+    """构建中间表示 (通过 node_registry.memo 按版本缓存，在注册表锁内执行)"""
+    global _parsed_links
+    previous, current = _parsed_links, {}
+    entries = []
+
+    for node in sorted(nodes_map.values(), key=lambda x: x.get('sort_index', 0)):
+        for proto, link in (node.get('links') or {}).items():
+            if not (link and link.strip()):
+                continue
+            link = link.strip()
+            name = node_display_name(node, proto)
+
+            if link in current:
+                parsed = current[link]
+            elif link in previous:
+                parsed = previous[link]
+            else:
+                parsed = parse_proxy_link(link, name, node.get('region'))
+            current[link] = parsed
+
+            share_link = fix_link_ipv6(link)  # 提高对ipv6的兼容性
+            if '#' in share_link:
+                share_link = share_link.split('#')[0]
+
+            entries.append({
+                'uuid': node.get('uuid'),
+                'origin': node.get('origin', 'local'),
+                'routing_type': node.get('routing_type'),
+                'protocol': proto,
+                'region': node.get('region'),
+                'source_id': node.get('sub_source_id'),
+                'name': name,
+                'share_link': f"{share_link}#{urllib.parse.quote(name)}",
+                # 无论解析器返回的 name 是什么，统一使用上面构造的输出名称
+                # 深拷贝：解析结果按链接共享，嵌套的 ws-opts 等不能在多个节点间共用
+                'proxy': dict(copy.deepcopy(parsed), name=name) if parsed else None
+            })
+
+    _parsed_links = current
+    return entries
+
+
+def select_entries(entries, group):
+    """
+    按分组筛选：'0' 直连、'1' 落地；'all' 为直连 + 落地 + 尚未分类的订阅节点
+    (避免用户尚未手动分组时订阅内容为空)
+    """
+    if group in ('0', '1'):
+        r_type = int(group)
+        return [e for e in entries if e['routing_type'] == r_type]
+    return [
+        e for e in entries
+        if e['routing_type'] in (0, 1) or (e['origin'] == 'sub' and e['routing_type'] in (None, -1))
+    ]
+
+
+_REGIONAL_INDICATOR_A = 0x1F1E6
+
+
+def normalize_region(value):
+    """
+    地区统一为小写 ISO 代码：DB 节点的 region 通常是国旗 Emoji (如 🇸🇬)，
+    请求参数通常是代码 (SG)；两个区域指示符组成的国旗转换为对应字母，其余原样小写
+    """
+    value = str(value).strip()
+    letters = [ord(c) - _REGIONAL_INDICATOR_A for c in value]
+    if len(letters) == 2 and all(0 <= n < 26 for n in letters):
+        return ''.join(chr(ord('a') + n) for n in letters)
+    return value.lower()
+
+
+def _index_value(field, value):
+    if field == 'region':
+        return normalize_region(value)
+    value = str(value).strip().lower()
+    if field == 'protocol':
+        value = PROTOCOL_ALIASES.get(value, value)
+    return value
+
+
+def build_output_index(entries):
+    """按字段建立倒排索引：{field: {value: [entry 下标, ...]}} (按版本缓存)"""
+    index = {field: {} for field in FILTER_FIELDS.values()}
+    for pos, entry in enumerate(entries):
+        for field in index:
+            if entry.get(field) is not None:
+                index[field].setdefault(_index_value(field, entry[field]), []).append(pos)
+    return index
+
+
+def parse_filters(args):
+    """
+    从查询参数解析过滤条件，返回 (filters, key)；无过滤时 key 为 ''
+    同一字段可用逗号给出多个值 (或关系)，不同字段之间为与关系；name 为不区分大小写的正则
+    key 为规范化后的过滤条件，参数顺序/大小写不同的请求共用同一份缓存
+    """
+    filters = {}
+    for param, field in FILTER_FIELDS.items():
+        raw = args.get(param)
+        if raw:
+            values = sorted({_index_value(field, v) for v in raw.split(',') if v.strip()})
+            if values:
+                filters[field] = values
+    name = (args.get('name') or '').strip()
+    if name:
+        try:
+            filters['name'] = re.compile(name, re.I)
+        except re.error as e:
+            raise ValueError(f'名称过滤表达式无效: {e}')
+
+    parts = [f"{field}={','.join(values)}" for field, values in sorted(filters.items()) if field != 'name']
+    if name:
+        parts.append(f'name={name}')
+    return filters, '&'.join(parts)
+
+
+def filter_entries(entries, index, filters):
+    """按索引求交集后保持原有顺序返回；名称正则只在候选集上匹配"""
+    if not filters:
+        return entries
+    candidates = None
+    for field, values in filters.items():
+        if field == 'name':
+            continue
+        matched = set()
+        for value in values:
+            matched.update(index[field].get(value, ()))
+        candidates = matched if candidates is None else candidates & matched
+        if not candidates:
+            return []
+    positions = sorted(candidates) if candidates is not None else range(len(entries))
+    pattern = filters.get('name')
+    return [entries[pos] for pos in positions if not pattern or pattern.search(entries[pos]['name'])]
+
+
+# ---------------------------------------------------------
+# Emitters：entries -> 文本
+# ---------------------------------------------------------
+def dump_proxies_yaml(proxies):
+    """将 proxy 列表序列化为 {'proxies': [...]} YAML 文本"""
+    yaml = YAML()
+    yaml.preserve_quotes = True
+    yaml.indent(mapping=2, sequence=2, offset=0)
+    # 4096是为了组合模板时候不被截断
+    yaml.width = 4096
+    # 不输出 &id001 / *id001 锚点别名，部分客户端不支持
+    yaml.representer.ignore_aliases = lambda *args: True
+    out = StringIO()
+    yaml.dump({'proxies': proxies}, out)
+    return out.getvalue()
+
+
+def emit_clash(entries):
+    return dump_proxies_yaml([e['proxy'] for e in entries if e['proxy']])
+
+
+def emit_singbox(entries):
+    outbounds = []
+    used_tags = set()
+    for e in entries:
+        if not e['proxy']:
+            continue
+        # sing-box 要求 tag 唯一
+        tag, n = e['name'], 2
+        while tag in used_tags:
+            tag, n = f"{e['name']} {n}", n + 1
+        outbound = proxy_to_singbox_outbound(e['proxy'], tag)
+        if outbound:
+            used_tags.add(tag)
+            outbounds.append(outbound)
+
+    tags = [o['tag'] for o in outbounds]
+    # urltest / selector 不允许空列表：没有节点时只保留 direct
+    groups = [
+        {'type': 'selector', 'tag': 'proxy', 'outbounds': ['auto'] + tags},
+        {'type': 'urltest', 'tag': 'auto', 'outbounds': tags}
+    ] if tags else [{'type': 'selector', 'tag': 'proxy', 'outbounds': ['direct']}]
+    config = {'outbounds': groups + outbounds + [{'type': 'direct', 'tag': 'direct'}]}
+    return json.dumps(config, ensure_ascii=False, indent=2)
+
+
+def emit_links(entries):
+    return "\n".join(e['share_link'] for e in entries)
+
+
+def emit_base64(entries):
+    return base64.b64encode(emit_links(entries).encode('utf-8'))
+
+
+# target -> (emitter, mimetype)
+EMITTERS = {
+    TARGET_CLASH: (emit_clash, 'text/yaml; charset=utf-8'),
+    TARGET_SINGBOX: (emit_singbox, 'application/json; charset=utf-8'),
+    TARGET_BASE64: (emit_base64, 'text/plain'),
+    TARGET_LINKS: (emit_links, 'text/plain; charset=utf-8'),
+}
+
+
+def resolve_target(target=None, user_agent=None):
+    """按 ?target= 参数或 User-Agent 选择输出格式，参数无效时返回 None"""
+    if target:
+        return TARGET_ALIASES.get(target.strip().lower())
+    user_agent = user_agent or ''
+    if _UA_SINGBOX.search(user_agent):
+        return TARGET_SINGBOX
+    if _UA_CLASH.search(user_agent):
+        return TARGET_CLASH
+    return TARGET_BASE64
@@ -1,7 +1,12 @@
 import urllib.parse
 import base64
+import binascii
+import codecs
 import json
 import re
+import tempfile
+
+from .sub_formats import FORMAT_LINKS, detect_content_format, iter_structured_nodes, sip003_to_plugin_opts
 
 # ==============================================================================
 # SECTION 1: 基础工具函数 (Utils)
@@ -532,6 +537,10 @@ def _parse_ss(link, proxy_name, params=None):
                             proxy['plugin-opts'] = json.loads(opts)
                         except:
                             proxy['plugin-opts'] = {"options": opts}
+                    elif ';' in proxy['plugin']:
+                        # SIP002 标准写法：plugin=obfs-local;obfs=http;obfs-host=...
+                        plugin, options = proxy['plugin'].split(';', 1)
+                        proxy['plugin'], proxy['plugin-opts'] = sip003_to_plugin_opts(plugin, options)
                 return proxy
     except Exception as e:
         print(f"SS Parsing Error: {e}")
@@ -591,48 +600,188 @@ def parse_proxy_link(link, base_name, region_code):
 # SECTION 4: 订阅内容解析 (Subscription Helper)
 # ==============================================================================
 
+def parse_share_line(line):
+    """
+    [订阅辅助] 解析单行分享链接，返回 {'name', 'protocol', 'link'}；不支持的行返回 None
+    """
+    line = line.strip()
+    if not line: return None
+    
+    protocol = None
+    if '://' in line:
+        protocol = line.split('://')[0].lower()
+    
+    if protocol in ['hysteria2', 'hy2']: protocol = 'hy2'
+    elif protocol in ['shadowsocks']: protocol = 'ss'
+    elif protocol in ['vmess', 'VMESS']: protocol = 'vmess'
+    elif protocol in ['vless', 'tuic', 'trojan', 'socks5', 'ss']: pass
+    else: return None
+    
+    name = "Unknown Node"
+    if '#' in line:
+        try:
+            raw_name = line.split('#')[-1]
+            name = urllib.parse.unquote(raw_name).strip()
+        except: pass
+    else:
+        try:
+            parsed = urllib.parse.urlparse(line)
+            name = f"{parsed.hostname}:{parsed.port}"
+        except: pass
+
+    return {
+        'name': name,
+        'protocol': protocol,
+        'link': line
+    }
+
 def extract_nodes_from_content(content):
     """
     [订阅辅助] 从订阅文本（可能是 Base64 编码的）中提取每行链接
     用于 routes.py 中的 fetch_from_sub_api
+    同时支持 Clash YAML (proxies) 与 sing-box JSON (outbounds) 格式
     """
-    nodes = []
-    
     decoded = safe_base64_decode(content)
     text_content = decoded if decoded else content
-    
-    lines = text_content.splitlines()
-    
-    for line in lines:
-        line = line.strip()
-        if not line: continue
-        
-        protocol = None
-        if '://' in line:
-            protocol = line.split('://')[0].lower()
-        
-        if protocol in ['hysteria2', 'hy2']: protocol = 'hy2'
-        elif protocol in ['shadowsocks']: protocol = 'ss'
-        elif protocol in ['vmess', 'VMESS']: protocol = 'vmess'
-        elif protocol in ['vless', 'tuic', 'trojan', 'socks5']: pass
-        else: continue 
-        
-        name = "Unknown Node"
-        if '#' in line:
-            try:
-                raw_name = line.split('#')[-1]
-                name = urllib.parse.unquote(raw_name).strip()
-            except: pass
-        else:
+
+    fmt = detect_content_format(text_content[:_DETECT_BYTES * 4])
+    if fmt != FORMAT_LINKS:
+        try:
+            return list(iter_structured_nodes(text_content, fmt))
+        except Exception as e:
+            print(f"Subscription {fmt} parse error: {e}")
+            return []
+
+    nodes = []
+    for line in text_content.splitlines():
+        node = parse_share_line(line)
+        if node: nodes.append(node)
+    return nodes
+
+# ------------------------------------------------------------------------------
+# 流式解析：按块读取订阅内容并逐行产出节点，内存占用与内容大小无关
+# (Base64 内容先解码到临时文件，解码失败时按纯文本重新解析)
+# ------------------------------------------------------------------------------
+_B64_CHARS = set(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=-_')
+_B64_TRANSLATE = bytes.maketrans(b'-_', b'+/')
+_WHITESPACE = b' \t\r\n'
+_DETECT_BYTES = 256
+_SPOOL_MEMORY_BYTES = 1024 * 1024
+_SPOOL_CHUNK = 64 * 1024
+
+def _looks_like_base64(head):
+    """根据开头的若干字节判断内容是否为整体 Base64 编码"""
+    sample = bytes(b for b in head if b not in _WHITESPACE)
+    return bool(sample) and all(b in _B64_CHARS for b in sample)
+
+def _iter_base64_decoded(chunks):
+    """增量 Base64 解码：每次只解码 4 的整数倍长度，余下字符留到下一块"""
+    pending = b''
+    for chunk in chunks:
+        pending += chunk.translate(_B64_TRANSLATE, _WHITESPACE)
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield base64.b64decode(pending[:usable], validate=True)
+            pending = pending[usable:]
+    if pending.rstrip(b'='):
+        pending = pending.rstrip(b'=')
+        yield base64.b64decode(pending + b'=' * (-len(pending) % 4), validate=True)
+
+def _iter_spooled(spool):
+    spool.seek(0)
+    while True:
+        chunk = spool.read(_SPOOL_CHUNK)
+        if not chunk:
+            break
+        yield chunk
+
+def _spool_base64(source):
+    """
+    Base64 内容先完整解码到临时文件再产出 (超过 _SPOOL_MEMORY_BYTES 自动落盘)：
+    开头像 Base64 的纯文本可能在中途才解码失败，此时改为按纯文本解析原始内容，
+    而不是产出一半乱码后中断。返回 (字节块迭代器, 临时文件列表)
+    """
+    raw = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MEMORY_BYTES)
+    decoded = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MEMORY_BYTES)
+
+    def _tee():
+        for chunk in source:
+            raw.write(chunk)
+            yield chunk
+
+    try:
+        for block in _iter_base64_decoded(_tee()):
+            decoded.write(block)
+        return _iter_spooled(decoded), (raw, decoded)
+    except (binascii.Error, ValueError) as e:
+        print(f"Subscription base64 decode error, parsing as plain text: {e}")
+        for chunk in source:
+            raw.write(chunk)
+        return _iter_spooled(raw), (raw, decoded)
+
+def _iter_text_lines(byte_chunks):
+    """增量 UTF-8 解码并按行切分"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ''
+    for chunk in byte_chunks:
+        buffer += decoder.decode(chunk)
+        lines = buffer.splitlines(keepends=True)
+        # 最后一段可能是不完整的行，留到下一块
+        buffer = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b'', final=True)
+    if buffer:
+        yield buffer
+
+def iter_lines_from_chunks(chunks):
+    """
+    [订阅辅助] 流式解析并保留行号：逐个 yield (行号, 原始行, 节点或 None)
+    不支持的行节点为 None (供批量导入返回逐行错误)；
+    Clash / sing-box 文档的行号为第几个节点，原始行为节点名称
+    """
+    chunks = iter(chunks)
+    head = b''
+    # 先攒够用于判断格式的字节
+    for chunk in chunks:
+        head += chunk
+        if len(head.strip()) >= _DETECT_BYTES:
+            break
+    if not head.strip():
+        return
+
+    def _all_chunks():
+        yield head
+        yield from chunks
+
+    source = _all_chunks()
+    spools = ()
+    if _looks_like_base64(head[:_DETECT_BYTES * 4]):
+        source, spools = _spool_base64(source)
+    else:
+        fmt = detect_content_format(head[:_DETECT_BYTES * 4].decode('utf-8', errors='replace'))
+        if fmt != FORMAT_LINKS:
+            # Clash / sing-box 为整体文档，需读完后一次解析 (下载大小已有上限)
             try:
-                parsed = urllib.parse.urlparse(line)
-                name = f"{parsed.hostname}:{parsed.port}"
-            except: pass
+                text = b''.join(source).decode('utf-8', errors='replace')
+                for idx, node in enumerate(iter_structured_nodes(text, fmt), 1):
+                    yield idx, node['name'], node
+            except Exception as e:
+                print(f"Subscription {fmt} parse error: {e}")
+            return
 
-        nodes.append({
-            'name': name,
-            'protocol': protocol,
-            'link': line
-        })
-        
-    return nodes
\ No newline at end of file
+    try:
+        for line_no, line in enumerate(_iter_text_lines(source), 1):
+            yield line_no, line.rstrip('\r\n'), parse_share_line(line)
+    finally:
+        for spool in spools:
+            spool.close()
+
+def iter_nodes_from_chunks(chunks):
+    """
+    [订阅辅助] 流式版本的 extract_nodes_from_content
+    chunks 为 bytes 块的可迭代对象 (例如 resp.iter_content())，逐个 yield 节点
+    """
+    for _, _, node in iter_lines_from_chunks(chunks):
+        if node:
+            yield node
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from .sub_fetcher import CHUNK_SIZE, ContentTooLarge
+
+# =========================================================
+# 远程资源镜像
+# Clash 模板中的规则集 (rule-providers) 与 geox-url 默认指向 GitHub / jsDelivr，
+# 很多网络下客户端直连下载很慢甚至失败。这里定时把这些文件镜像到 nodes/mirror，
+# 下载时带 ETag / Last-Modified 条件请求 (304 不重新下载)，写入临时文件后原子替换；
+# 下发配置时把已镜像成功的地址改写为本机的 /subscription/mirror/<id>。
+# =========================================================
+
+MIRROR_TIMEOUT = 60
+MIRROR_WORKERS = 4
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+INDEX_FILE = 'index.json'
+USER_AGENT = 'clash.meta'
+
+_SAFE_EXT = re.compile(r'^\.[A-Za-z0-9]{1,8}$')
+
+
+def mirror_id(url):
+    """镜像文件名：URL 哈希 + 原扩展名 (保留扩展名便于客户端/排查识别格式)"""
+    ext = os.path.splitext(urllib.parse.urlsplit(url).path)[1]
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + (ext.lower() if _SAFE_EXT.match(ext) else '')
+
+
+class MirrorStore:
+    def __init__(self, dir_getter):
+        self._dir_getter = dir_getter
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._index = None
+        self.version = 0
+        self.running = False
+        self.last_run_at = None
+        self.last_summary = {}
+
+    # ---------- 索引 ----------
+    def _dir(self):
+        path = os.path.join(self._dir_getter(), 'mirror')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(os.path.join(self._dir(), INDEX_FILE), 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        path = os.path.join(self._dir(), INDEX_FILE)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    # ---------- 读 ----------
+    def get(self, mid):
+        """返回 (文件路径, 元数据)；未镜像或文件缺失返回 None"""
+        with self._lock:
+            meta = self._load_index().get(mid)
+            if not meta or not meta.get('sha1'):
+                return None
+            path = os.path.join(self._dir(), mid)
+            if not os.path.exists(path):
+                return None
+            return path, dict(meta)
+
+    def ready_map(self):
+        """已镜像成功的 {原始 URL: mirror_id}，用于改写模板"""
+        with self._lock:
+            return {
+                meta['url']: mid for mid, meta in self._load_index().items()
+                if meta.get('sha1') and os.path.exists(os.path.join(self._dir(), mid))
+            }
+
+    def status(self):
+        with self._lock:
+            items = [dict(meta, id=mid) for mid, meta in self._load_index().items()]
+        return {
+            'running': self.running,
+            'version': self.version,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'summary': dict(self.last_summary),
+            'items': sorted(items, key=lambda x: x['url'])
+        }
+
+    # ---------- 写 ----------
+    def _fetch(self, url, meta, max_bytes):
+        """条件请求下载单个资源，返回更新后的元数据"""
+        mid = mirror_id(url)
+        meta = dict(meta or {}, url=url)
+        headers = {'User-Agent': USER_AGENT}
+        if meta.get('sha1') and os.path.exists(os.path.join(self._dir(), mid)):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        meta['checked_at'] = datetime.now().isoformat()
+
+        try:
+            with requests.get(url, timeout=MIRROR_TIMEOUT, headers=headers, stream=True) as resp:
+                if resp.status_code == 304:
+                    meta.update({'state': 'not_modified', 'error': None})
+                    return mid, meta, False
+                resp.raise_for_status()
+                declared = resp.headers.get('Content-Length')
+                if declared and declared.isdigit() and int(declared) > max_bytes:
+                    raise ContentTooLarge(f'文件过大 ({int(declared)} > {max_bytes} 字节)')
+
+                digest = hashlib.sha1()
+                size = 0
+                fd, tmp_path = tempfile.mkstemp(dir=self._dir(), prefix='.download-')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                            if not chunk:
+                                continue
+                            size += len(chunk)
+                            if size > max_bytes:
+                                raise ContentTooLarge(f'文件超过上限 {max_bytes} 字节')
+                            digest.update(chunk)
+                            f.write(chunk)
+                    changed = digest.hexdigest() != meta.get('sha1')
+                    os.replace(tmp_path, os.path.join(self._dir(), mid))
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+                meta.update({
+                    'state': 'fetched' if changed else 'unchanged',
+                    'error': None,
+                    'sha1': digest.hexdigest(),
+                    'size': size,
+                    'etag': resp.headers.get('ETag'),
+                    'last_modified': resp.headers.get('Last-Modified'),
+                    'content_type': resp.headers.get('Content-Type'),
+                    'fetched_at': meta['checked_at']
+                })
+                return mid, meta, changed
+        except Exception as e:
+            # 下载失败时保留旧文件继续提供
+            meta.update({'state': 'error', 'error': str(e)})
+            return mid, meta, False
+
+    def sync(self, urls, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        [写] 镜像一组 URL (阻塞，在后台线程/定时任务中调用)；上一轮未结束时返回 None
+        不再需要的镜像文件会被删除
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return None
+        try:
+            self.running = True
+            urls = list(dict.fromkeys(urls))
+            with self._lock:
+                index = dict(self._load_index())
+
+            with ThreadPoolExecutor(max_workers=MIRROR_WORKERS) as pool:
+                results = list(pool.map(lambda u: self._fetch(u, index.get(mirror_id(u)), max_bytes), urls))
+
+            wanted = {mid for mid, _, _ in results}
+            changed = any(c for _, _, c in results)
+            with self._lock:
+                new_index = {mid: meta for mid, meta, _ in results}
+                for mid in set(self._load_index()) - wanted:
+                    changed = True
+                    try:
+                        os.remove(os.path.join(self._dir(), mid))
+                    except OSError:
+                        pass
+                self._index = new_index
+                self._save_index()
+
+            states = [meta['state'] for _, meta, _ in results]
+            self.last_summary = {
+                'total': len(urls),
+                'fetched': states.count('fetched'),
+                'not_modified': states.count('not_modified') + states.count('unchanged'),
+                'failed': states.count('error')
+            }
+            self.last_run_at = datetime.now()
+            if changed:
+                self.version += 1
+            return self.last_summary
+        finally:
+            self.running = False
+            self._sync_lock.release()
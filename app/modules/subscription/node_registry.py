@@ -0,0 +1,523 @@
+import atexit
+import json
+import os
+import threading
+import uuid as uuid_lib
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.utils.db_manager import (
+    Node,
+    get_all_nodes,
+    get_config,
+    set_config,
+    get_local_node_dicts,
+    save_local_node_changes
+)
+from app.utils.debounce_worker import DebouncedWorker
+from app.utils.scheduler import scheduler
+
+# =========================================================
+# 进程内节点注册表
+# 统一保存 DB 节点 + 本地/订阅节点，启动后只读取一次 local_nodes 表。
+# - 读：直接返回内存数据，按 version 缓存排序结果与派生数据
+# - 写：通过 edit() 等显式方法修改，version + 1，延迟异步按行落库
+#   已发布的节点 dict 不再原地修改 (edit() 只复制被触及的节点，成功后写回)，读方可在锁外遍历；
+#   每次提交只对被触及的节点计算指纹，变更日志与落库都按 uuid 增量处理
+# - DB：Node 表提交后通过 SQLAlchemy 事件标记失效，下次读取时只重新合并 DB 部分
+# - 变更日志：每个 version 记录相对上一版本新增/修改/删除的 uuid，供增量订阅使用，
+#   只保留最近 CHANGELOG_MAX_ENTRIES 个版本 (更早的请求退回全量)
+# =========================================================
+
+SAVE_DELAY_SECONDS = 1.0
+SAVE_MAX_DELAY_SECONDS = 5.0
+# 落库失败后的重试间隔：从 SAVE_RETRY_BASE_SECONDS 开始翻倍，最长 SAVE_RETRY_MAX_SECONDS
+SAVE_RETRY_BASE_SECONDS = 2.0
+SAVE_RETRY_MAX_SECONDS = 300.0
+LEGACY_IMPORTED_KEY = 'LOCAL_NODES_JSON_IMPORTED'
+CHANGELOG_MAX_ENTRIES = 500
+
+
+def _fingerprint(node):
+    return json.dumps(node, ensure_ascii=False, sort_keys=True)
+
+
+def _copy_node(node):
+    copied = dict(node)
+    copied['links'] = dict(node.get('links') or {})
+    return copied
+
+
+class _WorkingSet:
+    """
+    edit() 的工作集 (copy-on-write)：
+    - nodes[uuid] / get() 第一次访问某个节点时才复制它，调用方可直接原地修改
+    - 赋值 / 删除只记录在工作集中，正常退出时由注册表写回
+    - peek_items() 只读遍历 (不复制)，用于按名称查找等扫描；要修改请再用 nodes[uuid] 取副本
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self.copies = {}
+        self.deleted = set()
+
+    def _live(self, uuid):
+        return uuid in self.copies or (uuid in self._base and uuid not in self.deleted)
+
+    def __contains__(self, uuid):
+        return self._live(uuid)
+
+    def __getitem__(self, uuid):
+        node = self.copies.get(uuid)
+        if node is None:
+            if uuid in self.deleted or uuid not in self._base:
+                raise KeyError(uuid)
+            node = self.copies[uuid] = _copy_node(self._base[uuid])
+        return node
+
+    def get(self, uuid, default=None):
+        try:
+            return self[uuid]
+        except KeyError:
+            return default
+
+    def __setitem__(self, uuid, node):
+        self.copies[uuid] = node
+        self.deleted.discard(uuid)
+
+    def __delitem__(self, uuid):
+        if not self._live(uuid):
+            raise KeyError(uuid)
+        self.copies.pop(uuid, None)
+        self.deleted.add(uuid)
+
+    def pop(self, uuid, *default):
+        if not self._live(uuid):
+            if default:
+                return default[0]
+            raise KeyError(uuid)
+        node = self[uuid]
+        del self[uuid]
+        return node
+
+    def __iter__(self):
+        for uuid in self._base:
+            if uuid not in self.deleted:
+                yield uuid
+        for uuid in self.copies:
+            if uuid not in self._base:
+                yield uuid
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def keys(self):
+        return list(self)
+
+    def peek_items(self):
+        """只读遍历 (uuid, node)，不复制节点"""
+        for uuid in list(self):
+            yield uuid, self.copies.get(uuid) or self._base[uuid]
+
+    def items(self):
+        """可修改的 (uuid, node)；会复制全部节点，扫描请用 peek_items()"""
+        return [(uuid, self[uuid]) for uuid in list(self)]
+
+    def values(self):
+        return [node for _, node in self.items()]
+
+    def touched(self):
+        return set(self.copies) | self.deleted
+
+
+def load_legacy_json(path):
+    """读取旧版 local_nodes.json，文件不存在或为空时返回 []"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        nodes = json.loads(content) if content.strip() else []
+        return [n for n in nodes if isinstance(n, dict) and n.get('uuid')]
+    except Exception as e:
+        print(f"Error loading local nodes: {e}")
+        return []
+
+
+class NodeRegistry:
+    def __init__(self, legacy_path_getter):
+        self._legacy_path_getter = legacy_path_getter
+        self._lock = threading.RLock()
+        self._nodes = {}
+        self._persisted = {}
+        self._loaded = False
+        self._db_dirty = True
+        self._derived = {}
+        self._derived_version = None
+        self._write_lock = threading.Lock()
+        self._saver = DebouncedWorker('node-registry-save', self.flush,
+                                      debounce=SAVE_DELAY_SECONDS, max_delay=SAVE_MAX_DELAY_SECONDS)
+        self._save_failures = 0
+        self._retry_timer = None
+        self._listeners = []
+        # 当前版本的节点指纹与变更日志 [(version, added, changed, removed)]
+        # 指纹在首次加载时建立基线 (对应 version 0)，之后只由 _commit_change 按被触及的 uuid 更新
+        self._fingerprints = None
+        # 上次落库后有变化的 uuid；None 表示需要全量比对 (加载后)
+        self._unsaved = None
+        self._changelog = deque(maxlen=CHANGELOG_MAX_ENTRIES)
+        # version 只在进程内单调递增，重启后从 0 开始；客户端用 epoch 判断版本号是否可比
+        self.epoch = uuid_lib.uuid4().hex[:12]
+        self.version = 0
+
+    def add_listener(self, callback):
+        """注册变更回调 (节点修改或 DB 失效时调用，回调需非阻塞)"""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Node registry listener error: {e}")
+
+    # ---------- 加载与 DB 合并 ----------
+    def _load_store(self):
+        nodes = get_local_node_dicts()
+        self._persisted = {n['uuid']: _fingerprint(n) for n in nodes}
+
+        # 一次性迁移：表为空时导入旧版 local_nodes.json
+        if not nodes and not get_config(LEGACY_IMPORTED_KEY):
+            nodes = load_legacy_json(self._legacy_path_getter())
+            if save_local_node_changes(nodes, []):
+                set_config(LEGACY_IMPORTED_KEY, 1, description='local_nodes.json 已导入数据库')
+                self._persisted = {n['uuid']: _fingerprint(n) for n in nodes}
+                if nodes:
+                    print(f">>> 已从 local_nodes.json 导入 {len(nodes)} 个节点")
+
+        changed = False
+        self._nodes = {}
+        for node in nodes:
+            # 兼容旧数据：来源缺失一律视为本地节点
+            if node.get('origin') not in ['db', 'local', 'sub']:
+                node['origin'] = 'local'
+                node['is_fixed'] = False
+                changed = True
+            self._nodes[node['uuid']] = node
+        self._loaded = True
+        # 首次加载：记录 version 0 的基线 (不写变更日志)，启动后没有变化时第一条日志也能正确对比；
+        # reload() 保留原基线，下一次提交记录的是重新加载前后的真实差异
+        if self._fingerprints is None:
+            self._fingerprints = {uuid: _fingerprint(node) for uuid, node in self._nodes.items()}
+        self._unsaved = None
+        return changed
+
+    def _merge_db(self):
+        """将数据库节点合并进注册表，返回有变化的 uuid 集合"""
+        db_nodes = get_all_nodes()
+        active_db_uuids = set()
+        changed = set()
+
+        for db_node in db_nodes:
+            uuid_str = str(db_node.uuid)
+            active_db_uuids.add(uuid_str)
+            updates = {
+                'name': db_node.custom_name or db_node.name,
+                'links': db_node.get_links_dict(),
+                'routing_type': db_node.routing_type if db_node.routing_type is not None else -1,
+                'region': db_node.region or 'DB',
+                'origin': 'db',
+                'is_fixed': False  # 允许 DB 节点被拖拽移动
+            }
+            node = self._nodes.get(uuid_str)
+            if node is None:
+                node = {'uuid': uuid_str, 'sort_index': 99999}
+                node.update(updates)
+                self._nodes[uuid_str] = node
+                changed.add(uuid_str)
+                continue
+
+            # 有变化时替换为新 dict，不修改读方可能持有的旧对象
+            if 'sort_index' not in node:
+                updates['sort_index'] = 9999
+            if any(node.get(k) != v for k, v in updates.items()):
+                self._nodes[uuid_str] = dict(node, **updates)
+                changed.add(uuid_str)
+
+        # 清理已从数据库删除的节点
+        for uuid_str in [u for u, n in self._nodes.items() if n.get('origin') == 'db' and u not in active_db_uuids]:
+            del self._nodes[uuid_str]
+            changed.add(uuid_str)
+        return changed
+
+    def _ensure_fresh(self):
+        reloaded = False
+        touched = set()
+        if not self._loaded:
+            reloaded = self._load_store()
+        if self._db_dirty:
+            # 先清标记再合并：合并期间的新提交会重新置位
+            self._db_dirty = False
+            try:
+                touched = self._merge_db()
+            except Exception:
+                self._db_dirty = True
+                raise
+        if reloaded or touched:
+            self._commit_change(None if reloaded else touched)
+
+    def invalidate_db(self):
+        """Node 表有提交时调用 (无需加锁)，下次读取时重新合并 DB 节点"""
+        self._db_dirty = True
+        self._notify()
+
+    def reload(self):
+        """丢弃内存数据，重新读取节点表与数据库"""
+        with self._lock:
+            self._loaded = False
+            self._db_dirty = True
+            self._ensure_fresh()
+            self._commit_change()
+
+    # ---------- 读 ----------
+    def nodes(self):
+        """
+        [读] 按 sort_index 排序的节点列表 (同一 version 内复用同一个列表)
+        返回的 dict 为注册表内部对象 (发布后不再被修改)，调用方只读，修改请使用 edit()
+        """
+        return self.memo('sorted', lambda nodes: sorted(nodes.values(), key=lambda x: x.get('sort_index', 0)))
+
+    def current_version(self):
+        """[读] 合并待处理的 DB 变更后返回当前版本号"""
+        with self._lock:
+            self._ensure_fresh()
+            return self.version
+
+    def get(self, uuid):
+        """[读] 按 uuid 取节点副本，不存在返回 None"""
+        with self._lock:
+            self._ensure_fresh()
+            node = self._nodes.get(uuid)
+            if node is None:
+                return None
+            return _copy_node(node)
+
+    def changes_since(self, since):
+        """
+        [读] 返回 (version, delta)
+        delta 为 {'added': [node], 'changed': [node], 'removed': [uuid]} (节点为副本)；
+        since 不在变更日志范围内 (已被压缩或大于当前版本) 时 delta 为 None，调用方应返回全量
+        """
+        with self._lock:
+            self._ensure_fresh()
+            if since > self.version or (since < self.version and (
+                    not self._changelog or since < self._changelog[0][0] - 1)):
+                return self.version, None
+
+            # 按版本顺序合并：existed 记录 uuid 在 since 版本时是否已存在
+            existed = {}
+            for version, added, changed, removed in self._changelog:
+                if version <= since:
+                    continue
+                for uuid in added:
+                    existed.setdefault(uuid, False)
+                for uuid in changed | removed:
+                    existed.setdefault(uuid, True)
+
+            delta = {'added': [], 'changed': [], 'removed': []}
+            for uuid, was_present in existed.items():
+                node = self._nodes.get(uuid)
+                if node is None:
+                    if was_present:
+                        delta['removed'].append(uuid)
+                    continue
+                copied = json.loads(self._fingerprints[uuid])
+                delta['changed' if was_present else 'added'].append(copied)
+            for key in ('added', 'changed'):
+                delta[key].sort(key=lambda x: x.get('sort_index', 9999))
+            return self.version, delta
+
+    def memo(self, key, builder):
+        """
+        [读] 按 version 缓存派生数据 (统计、生成的订阅内容等)
+        builder 接收 {uuid: node}，在注册表锁内执行
+        """
+        with self._lock:
+            self._ensure_fresh()
+            if self._derived_version != self.version:
+                self._derived = {}
+                self._derived_version = self.version
+            if key not in self._derived:
+                self._derived[key] = builder(self._nodes)
+            return self._derived[key]
+
+    # ---------- 写 ----------
+    @contextmanager
+    def edit(self):
+        """
+        [写] 修改注册表：with node_registry.edit() as nodes: ...
+        nodes 为按需复制的工作集 (见 _WorkingSet)，取出的节点可直接原地修改；
+        正常退出时只写回被触及的节点，version + 1 并安排落盘；with 块内抛出异常时丢弃全部修改
+        """
+        with self._lock:
+            self._ensure_fresh()
+            working = _WorkingSet(self._nodes)
+            yield working
+            for uuid in working.deleted:
+                self._nodes.pop(uuid, None)
+            self._nodes.update(working.copies)
+            self._commit_change(working.touched())
+
+    def add(self, node):
+        with self.edit() as nodes:
+            nodes[node['uuid']] = node
+        return node
+
+    def update(self, uuid, **fields):
+        with self._lock:
+            self._ensure_fresh()
+            if uuid not in self._nodes:
+                return False
+            with self.edit() as nodes:
+                nodes[uuid].update(fields)
+            return True
+
+    def remove(self, uuid):
+        with self._lock:
+            self._ensure_fresh()
+            if uuid not in self._nodes:
+                return False
+            with self.edit() as nodes:
+                del nodes[uuid]
+            return True
+
+    def _record_changes(self, version, touched=None):
+        """
+        对比被触及节点的指纹，写入一条变更日志并更新指纹
+        touched 为 None 时 (重新加载) 全量比对
+        """
+        if self._fingerprints is None:
+            self._fingerprints = {}
+        fingerprints = self._fingerprints
+        if touched is None:
+            touched = set(fingerprints) | set(self._nodes)
+        added, changed, removed = set(), set(), set()
+        for uuid in touched:
+            node = self._nodes.get(uuid)
+            previous = fingerprints.get(uuid)
+            if node is None:
+                if previous is not None:
+                    removed.add(uuid)
+                    del fingerprints[uuid]
+                continue
+            current = _fingerprint(node)
+            if previous is None:
+                added.add(uuid)
+            elif previous != current:
+                changed.add(uuid)
+            fingerprints[uuid] = current
+        self._changelog.append((version, added, changed, removed))
+        if self._unsaved is not None:
+            self._unsaved |= added | changed | removed
+
+    def _commit_change(self, touched=None):
+        self.version += 1
+        self._record_changes(self.version, touched)
+        self._saver.request()
+        self._notify()
+
+    # ---------- 落库 ----------
+    def flush(self):
+        """
+        [写] 将变化的节点按行写入 local_nodes 表 (需在 app 上下文内调用)
+        只比对上次落库后有变化的 uuid (加载后首次为全量)，写新增/修改的行并删除已移除的行，单个事务提交
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._loaded:
+                    return True
+                pending, self._unsaved = self._unsaved, set()
+                fingerprints = self._fingerprints or {}
+                uuids = set(fingerprints) | set(self._persisted) if pending is None else pending
+                upsert_fps = {
+                    u: fingerprints[u] for u in uuids
+                    if u in fingerprints and self._persisted.get(u) != fingerprints[u]
+                }
+                deleted = [u for u in uuids if u not in fingerprints and u in self._persisted]
+            if not upsert_fps and not deleted:
+                return True
+            if not save_local_node_changes([json.loads(fp) for fp in upsert_fps.values()], deleted):
+                with self._lock:
+                    if pending is None or self._unsaved is None:
+                        self._unsaved = None
+                    else:
+                        self._unsaved |= pending
+                self._schedule_retry()
+                return False
+            self._save_failures = 0
+            for uuid in deleted:
+                self._persisted.pop(uuid, None)
+            self._persisted.update(upsert_fps)
+            return True
+
+    def _schedule_retry(self):
+        """落库失败：按指数退避再次请求保存，避免修改只留在内存中"""
+        self._save_failures += 1
+        delay = min(SAVE_RETRY_BASE_SECONDS * 2 ** (self._save_failures - 1), SAVE_RETRY_MAX_SECONDS)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 节点表保存失败 (第 {self._save_failures} 次)，{delay:.0f} 秒后重试")
+        if self._retry_timer is not None and self._retry_timer.is_alive():
+            return
+        self._retry_timer = threading.Timer(delay, self._saver.request)
+        self._retry_timer.daemon = True
+        self._retry_timer.start()
+
+    def export_nodes(self):
+        """[读] 导出全部节点 (与旧版 local_nodes.json 格式一致)，用于备份"""
+        with self._lock:
+            self._ensure_fresh()
+            return json.loads(json.dumps(
+                sorted(self._nodes.values(), key=lambda x: x.get('sort_index', 9999)), ensure_ascii=False))
+
+
+_registries = []
+
+
+def create_registry(path_getter):
+    registry = NodeRegistry(path_getter)
+    _registries.append(registry)
+    return registry
+
+
+# ---------------------------------------------------------
+# DB 失效钩子：只在包含 Node 变更的事务提交后通知注册表
+# ---------------------------------------------------------
+@event.listens_for(Session, 'after_flush')
+def _track_node_changes(session, flush_context):
+    if any(isinstance(obj, Node) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['node_registry_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_node_changes(session):
+    if session.info.pop('node_registry_dirty', False):
+        for registry in _registries:
+            registry.invalidate_db()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_node_changes(session):
+    session.info.pop('node_registry_dirty', None)
+
+
+@atexit.register
+def _flush_on_exit():
+    app = getattr(scheduler, 'app', None)
+    if app is None:
+        return
+    with app.app_context():
+        for registry in _registries:
+            registry.flush()
@@ -0,0 +1,211 @@
+import asyncio
+import ssl
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# =========================================================
+# 节点连通性探测
+# - 在独立线程中运行 asyncio，信号量限制并发，对每个 server:port 做 TCP 连接
+#   (可选再做一次 TLS 握手) 并记录耗时
+# - 相同 (server, port, tls, sni) 只探测一次，结果按链接保存最近 HISTORY_SIZE 次
+# - Hysteria2 / TUIC 走 UDP (QUIC)，TCP 探测没有意义，标记为 skipped，不参与剔除
+# - 每轮探测结束 version + 1，订阅产物据此判断是否需要按新结果重新生成
+# =========================================================
+
+PROBE_TIMEOUT = 3.0
+PROBE_CONCURRENCY = 64
+HISTORY_SIZE = 10
+# 连续失败达到该次数才视为不可达，避免偶发超时导致节点被剔除
+FAIL_THRESHOLD = 2
+
+UDP_PROXY_TYPES = ('hysteria2', 'tuic')
+TLS_PROXY_TYPES = ('trojan',)
+
+
+def probe_target(proxy, with_tls=True):
+    """从 Clash proxy 字典提取探测目标 (host, port, tls, sni)；UDP 协议返回 None"""
+    p_type = str(proxy.get('type', '')).lower()
+    if p_type in UDP_PROXY_TYPES:
+        return None
+    host = str(proxy.get('server', '')).strip('[]')
+    try:
+        port = int(proxy.get('port'))
+    except (TypeError, ValueError):
+        return None
+    if not host or not port:
+        return None
+    tls = with_tls and (p_type in TLS_PROXY_TYPES or bool(proxy.get('tls')) or bool(proxy.get('reality-opts')))
+    sni = (proxy.get('servername') or proxy.get('sni') or host) if tls else None
+    return host, port, tls, sni
+
+
+def _tls_context():
+    # 只测量握手耗时，不校验证书 (自签名 / Reality 节点同样视为可达)
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def probe_endpoint(host, port, tls=False, sni=None, timeout=PROBE_TIMEOUT, context=None):
+    """
+    探测单个端点，返回 {'ok', 'rtt', 'tls_rtt', 'error'} (单位毫秒)
+    rtt 为 TCP 建连耗时，tls_rtt 为建连 + TLS 握手总耗时
+    """
+    result = {'ok': False, 'rtt': None, 'tls_rtt': None, 'error': None}
+    writer = None
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        result['rtt'] = round((time.perf_counter() - started) * 1000, 1)
+        if tls:
+            loop = asyncio.get_running_loop()
+            transport = writer.transport
+            protocol = transport.get_protocol()
+            remaining = max(timeout - (time.perf_counter() - started), 0.1)
+            tls_transport = await asyncio.wait_for(
+                loop.start_tls(transport, protocol, context or _tls_context(), server_hostname=sni or host),
+                remaining)
+            # start_tls 返回新的 transport，旧 writer 不再可用
+            writer = None
+            tls_transport.close()
+            result['tls_rtt'] = round((time.perf_counter() - started) * 1000, 1)
+        result['ok'] = True
+    except asyncio.TimeoutError:
+        result['error'] = 'timeout'
+    except Exception as e:
+        result['error'] = str(e) or e.__class__.__name__
+    finally:
+        if writer is not None:
+            writer.close()
+    return result
+
+
+class NodeProber:
+    def __init__(self, concurrency=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._history = {}
+        self._skipped = set()
+        self.version = 0
+        self.running = False
+        self.last_run_at = None
+        self.last_summary = {}
+
+    async def _probe_many(self, endpoints):
+        semaphore = asyncio.Semaphore(self._concurrency)
+        context = _tls_context()
+
+        async def _one(endpoint):
+            async with semaphore:
+                return endpoint, await probe_endpoint(*endpoint, timeout=self._timeout, context=context)
+
+        return dict(await asyncio.gather(*[_one(ep) for ep in endpoints]))
+
+    def run(self, entries, with_tls=True):
+        """
+        [写] 探测一轮 (阻塞，在后台线程/定时任务中调用)
+        entries 为输出引擎的中间表示，只探测能解析出 proxy 的链接
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return None  # 上一轮尚未结束
+        try:
+            self.running = True
+            targets = {}
+            skipped = set()
+            for entry in entries:
+                proxy = entry.get('proxy')
+                if not proxy:
+                    continue
+                target = probe_target(proxy, with_tls)
+                if target is None:
+                    skipped.add(entry['share_link'])
+                else:
+                    targets.setdefault(target, []).append(entry['share_link'])
+
+            started = time.perf_counter()
+            results = asyncio.run(self._probe_many(list(targets))) if targets else {}
+            now = datetime.now()
+
+            with self._lock:
+                history = {}
+                for target, links in targets.items():
+                    result = results[target]
+                    for link in links:
+                        # 只保留本轮仍存在的链接
+                        items = self._history.get(link) or deque(maxlen=HISTORY_SIZE)
+                        items.append((now, result))
+                        history[link] = items
+                self._history = history
+                self._skipped = skipped
+                ok = sum(1 for r in results.values() if r['ok'])
+                self.last_summary = {
+                    'endpoints': len(targets),
+                    'reachable': ok,
+                    'unreachable': len(targets) - ok,
+                    'skipped': len(skipped),
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000)
+                }
+                self.last_run_at = now
+                self.version += 1
+            return self.last_summary
+        finally:
+            self.running = False
+            self._run_lock.release()
+
+    # ---------- 读 ----------
+    def latency(self, link):
+        """最近一次成功探测的耗时 (有 TLS 时取握手总耗时)，未知返回 None"""
+        with self._lock:
+            items = self._history.get(link)
+            if not items:
+                return None
+            _, result = items[-1]
+            if not result['ok']:
+                return None
+            return result['tls_rtt'] if result['tls_rtt'] is not None else result['rtt']
+
+    def is_unreachable(self, link):
+        """最近连续 FAIL_THRESHOLD 次探测失败；未探测或跳过的链接视为可达"""
+        with self._lock:
+            items = self._history.get(link)
+            if not items or len(items) < FAIL_THRESHOLD:
+                return False
+            return all(not result['ok'] for _, result in list(items)[-FAIL_THRESHOLD:])
+
+    def history(self, link):
+        with self._lock:
+            return [
+                {'at': at.strftime('%Y-%m-%d %H:%M:%S'), 'ok': r['ok'], 'rtt': r['rtt'],
+                 'tls_rtt': r['tls_rtt'], 'error': r['error']}
+                for at, r in self._history.get(link, ())
+            ]
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'version': self.version,
+                'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+                'summary': dict(self.last_summary)
+            }
+
+
+def apply_probe_policy(entries, prober, exclude_dead=False, sort_by_latency=False):
+    """按探测结果剔除不可达链接 / 按延迟升序排列 (未知延迟排在最后，原有顺序不变)"""
+    if exclude_dead:
+        entries = [e for e in entries if not prober.is_unreachable(e['share_link'])]
+    if sort_by_latency:
+        def _key(entry):
+            latency = prober.latency(entry['share_link'])
+            return (latency is None, latency or 0)
+        entries = sorted(entries, key=_key)
+    return entries
+
+
+# 全局单例
+node_prober = NodeProber()
@@ -1,27 +1,44 @@
 # routes.py
 
-from flask import Blueprint, render_template, jsonify, Response, make_response, request, url_for, abort
+from flask import Blueprint, render_template, jsonify, Response, make_response, request, url_for, abort, current_app, send_file
 from flask_login import login_required, current_user
+from werkzeug.exceptions import RequestEntityTooLarge
 # 引入 update_node_custom_name 用于 DB 节点改名
-from app.utils.db_manager import get_all_nodes, update_node_details, get_config, set_config, update_node_custom_name
+from app.utils.db_manager import get_config, set_config, update_node_custom_name, update_nodes_routing
 from app.utils.scheduler import scheduler
 import os
 import sys         # 用于判断打包环境
 import shutil      # 用于复制文件恢复模板
-import requests    # 用于下载订阅
 from app.utils.path_helper import get_external_config_path # 引入创建的路径处理工具
 import json
-import base64
 import time
 from datetime import datetime
-import urllib.parse
 import uuid
-from io import BytesIO
 
 from collections import defaultdict
 
-from ruamel.yaml import YAML
-from .link_parser import parse_proxy_link, get_emoji_flag, extract_nodes_from_content, fix_link_ipv6
+from .emitters import (
+    EMITTERS, TARGET_CLASH, TARGET_BASE64, TARGET_LINKS,
+    build_output_nodes, build_output_index, select_entries, parse_filters, filter_entries,
+    dump_proxies_yaml, resolve_target
+)
+from .node_registry import create_registry
+from .clash_template import clash_template
+from .sub_fetcher import subscription_fetcher, FETCHED, NOT_MODIFIED, UNCHANGED, FAILED, CHUNK_SIZE, ContentTooLarge
+from .link_parser import iter_lines_from_chunks, parse_proxy_link
+from .rule_compiler import rule_list_cache, RULE_KINDS, KIND_CLASSICAL
+from .mirror import MirrorStore
+from .prober import node_prober, apply_probe_policy
+from .dedup import DedupIndex, DEDUP_POLICIES, POLICY_FIRST, POLICY_OFF, source_rank
+from app.utils.debounce_worker import DebouncedWorker
+from app.utils.artifact_cache import ArtifactCache, Artifact, artifact_response
+from app.utils.rate_limiter import public_endpoint, mirror_endpoint, client_stats
+from app.utils.setting_cache import setting_cache
+from app.utils.ingest_queue import IngestQueue
+from app.modules.data_core.dashboard_summary import dashboard_summary
+import queue
+import re
+import threading
 
 bp = Blueprint('subscription', __name__, url_prefix='/subscription', template_folder='templates')
 
@@ -42,6 +59,10 @@ def _normalize_subscription_entry(data, order_index=0):
         'last_message': data.get('last_message', ''),
         'last_synced_at': data.get('last_synced_at'),
         'last_trigger': data.get('last_trigger', ''),
+        # 条件请求与内容去重所需的缓存信息
+        'etag': data.get('etag'),
+        'last_modified': data.get('last_modified'),
+        'content_hash': data.get('content_hash'),
         'order': data.get('order', order_index)
     }
     return entry
@@ -194,199 +215,97 @@ def get_nodes_dir():
 # ---------------------------------------------------------
 # 2. 本地节点管理工具 & 核心同步逻辑
 # ---------------------------------------------------------
+# 旧版节点文件：仅用于首次启动时导入 local_nodes 表
 LOCAL_NODES_FILE = 'local_nodes.json'
 
 def get_local_nodes_path():
     return os.path.join(get_nodes_dir(), LOCAL_NODES_FILE)
 
-def load_local_nodes_raw():
+# 节点注册表：DB 节点 + 本地/订阅节点的唯一内存数据源，修改后异步按行写入 local_nodes 表
+node_registry = create_registry(get_local_nodes_path)
+
+# ---------------------------------------------------------
+# 3. 配置文件生成逻辑 (读取统一数据源)
+# ---------------------------------------------------------
+_file_sync_lock = threading.Lock()
+_file_sync_state = {'version': None, 'message': ''}
+
+def _config_flag(key, default='0'):
+    # 订阅下载等热路径每个请求都会读取，经短时缓存避免访问数据库
+    return setting_cache.flag(key, default)
+
+def probe_policy():
+    """探测结果的使用方式：(剔除不可达链接, 按延迟排序)"""
+    return _config_flag('SUB_PROBE_EXCLUDE_DEAD'), _config_flag('SUB_PROBE_SORT_BY_LATENCY')
+
+def output_stamp():
     """
-    [底层函数] 仅读取原始 JSON 数据，不进行业务逻辑处理
+    [读] 订阅产物的版本戳：节点版本 + 探测策略
+    启用了剔除/排序时探测结果更新也会使产物失效，未启用时探测不影响产物
     """
-    path = get_local_nodes_path()
-    if not os.path.exists(path): return []
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except: return []
+    policy = probe_policy()
+    return node_registry.current_version(), node_prober.version if any(policy) else 0, policy
 
-# 建立别名兼容旧代码调用
-load_local_nodes = load_local_nodes_raw
+def output_entries():
+    """[读] 中间表示 (按版本缓存) 经探测策略处理后的结果"""
+    entries = node_registry.memo('output_nodes', build_output_nodes)
+    exclude_dead, sort_by_latency = probe_policy()
+    return apply_probe_policy(entries, node_prober, exclude_dead, sort_by_latency)
 
-def save_local_nodes(nodes):
-    """保存节点列表到 JSON"""
-    try:
-        # 保存前按 sort_index 排序，保持文件整洁
-        nodes.sort(key=lambda x: x.get('sort_index', 9999))
-        with open(get_local_nodes_path(), 'w', encoding='utf-8') as f:
-            json.dump(nodes, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"Error saving local nodes: {e}")
-        return False
-
-def merge_db_to_local_json():
+def build_proxies_map(entries):
     """
-    将数据库节点同步到本地 JSON
-    修改点：将 DB 节点的 is_fixed 改为 False，允许前端拖拽改变分组
+    按路由分组取出 Clash proxy 字典 (来自输出引擎的中间表示，每条链接只解析一次)
+    返回 (proxies_map, count_summary)
     """
-    db_nodes = get_all_nodes()
-    local_nodes = load_local_nodes_raw()
-    
-    local_map = {n['uuid']: n for n in local_nodes}
-    active_db_uuids = set()
-    has_changes = False
-
-    # --- 1. 同步 DB 节点 ---
-    for db_node in db_nodes:
-        uuid_str = str(db_node.uuid)
-        active_db_uuids.add(uuid_str)
-        
-        # 获取 DB 权威数据
-        db_name = db_node.custom_name or db_node.name
-        links = db_node.get_links_dict()
-        r_type = db_node.routing_type if db_node.routing_type is not None else -1
-        region = db_node.region or 'DB'
-
-        if uuid_str in local_map:
-            # [更新]
-            node = local_map[uuid_str]
-            
-            updates = {
-                'name': db_name,
-                'links': links,
-                'routing_type': r_type,
-                'region': region,
-                'origin': 'db',
-                'is_fixed': False  # 允许 DB 节点被拖拽移动
-            }
-            
-            for k, v in updates.items():
-                if node.get(k) != v:
-                    node[k] = v
-                    has_changes = True
-            
-            if 'sort_index' not in node:
-                node['sort_index'] = 9999
-                has_changes = True
-                
-        else:
-            # [新增]
-            new_node = {
-                "uuid": uuid_str,
-                "name": db_name,
-                "links": links,
-                "routing_type": r_type,
-                "region": region,
-                "origin": "db",
-                "is_fixed": False, # 允许 DB 节点被拖拽移动
-                "sort_index": 99999
-            }
-            local_nodes.append(new_node)
-            has_changes = True
-
-    # --- 2. 清理失效节点 ---
-    final_nodes = []
-    for node in local_nodes:
-        is_db_node = node.get('origin') == 'db'
-        
-        if is_db_node and node['uuid'] not in active_db_uuids:
-            has_changes = True
-            continue 
-            
-        if not is_db_node:
-            if node.get('origin') not in ['local', 'sub']:
-                node['origin'] = 'local'
-                node['is_fixed'] = False 
-                has_changes = True
+    proxies_map = {0: [], 1: []}
+    for entry in entries:
+        if entry['routing_type'] in proxies_map and entry['proxy']:
+            proxies_map[entry['routing_type']].append(entry['proxy'])
+    count_summary = {r_type: len(proxies) for r_type, proxies in proxies_map.items()}
+    return proxies_map, count_summary
 
-        final_nodes.append(node)
-    
-    if has_changes:
-        save_local_nodes(final_nodes)
-        return final_nodes
-    
-    return final_nodes
-# ---------------------------------------------------------
-# 3. 配置文件生成逻辑 (读取统一数据源)
-# ---------------------------------------------------------
-def sync_nodes_to_files():
+def sync_nodes_to_files(force=False):
     """
     生成 0.yaml 和 1.yaml
-    强制将 YAML 中的 name 字段重写为 'Flag Proto-Name' 格式
+    注册表版本与探测策略未变化且文件存在时跳过 (force=True 强制重写)
     """
-    # 1. 获取最新合并后的节点列表
-    all_nodes = merge_db_to_local_json()
-    
-    # 2. 按 sort_index 排序
-    all_nodes.sort(key=lambda x: x.get('sort_index', 0))
+    with _file_sync_lock:
+        version = output_stamp()
+        nodes_dir = get_nodes_dir()
+        files_exist = all(os.path.exists(os.path.join(nodes_dir, f)) for f in ('0.yaml', '1.yaml'))
+        if not force and files_exist and _file_sync_state['version'] == version:
+            return True, _file_sync_state['message']
 
-    proxies_map = {0: [], 1: []}
-    count_summary = {0: 0, 1: 0}
+        proxies_map, count_summary = build_proxies_map(output_entries())
 
-    for node in all_nodes:
-        r_type = node.get('routing_type', -1)
-        if r_type not in proxies_map: continue
-        
-        links = node.get('links', {})
-        node_name = node.get('name', 'Unknown')
-        origin = node.get('origin', 'local')
-        region = node.get('region')
-        
-        for proto, link in links.items():
-            if link and link.strip():
-                # 命名格式强制调整
-                # 1. 确定国旗
-                # 增加对 'sub' (外部订阅) 的判断，显示云朵图标
-                if origin == 'db':
-                    flag = get_emoji_flag(region)
-                    name_prefix = f"{proto.lower()}-"   # DB 节点必须带协议前缀
-                elif origin == 'sub':
-                    flag = ''  # 外部订阅不显示国旗或标志，保留原始名称
-                    name_prefix = ""    # 外部订阅节点：不带任何前缀
-                else:
-                    flag = '📝' # 本地手填标志
-                    name_prefix = f"{proto.lower()}-"
-                
-                # 2. 构造强制名称：Flag Protocol-Name (例如: 🇸🇬 hy2-SG-NAT1)
-                display_name = f"{flag} {name_prefix}{node_name}".strip()
-                
-                # 3. 调用解析器
-                # 注意：虽然传入了 display_name，但解析器可能会优先读取 link 中的 #hash
-                proxy_dict = parse_proxy_link(link.strip(), display_name, region)
-                
-                if proxy_dict:
-                    # 无论 parse_proxy_link 返回的 name 是什么（可能是旧的后缀格式），
-                    # 这里强制将其覆盖为我们刚刚构造的前缀格式。
-                    proxy_dict['name'] = display_name
-                    proxies_map[r_type].append(proxy_dict)
-                    count_summary[r_type] += 1
-
-    # --- 写入 YAML ---
-    nodes_dir = get_nodes_dir()
-    yaml = YAML()
-    yaml.preserve_quotes = True
-    yaml.indent(mapping=2, sequence=2, offset=0)
-    # 4096是为了组合模板时候不被截断
-    yaml.width = 4096
+        try:
+            for r_type in (0, 1):
+                with open(os.path.join(nodes_dir, f'{r_type}.yaml'), 'w', encoding='utf-8') as f:
+                    f.write(dump_proxies_yaml(proxies_map[r_type]))
+        except Exception as e:
+            return False, f"写入失败: {str(e)}"
 
-    try:
-        with open(os.path.join(nodes_dir, '0.yaml'), 'w', encoding='utf-8') as f:
-            yaml.dump({'proxies': proxies_map[0]}, f)
-        with open(os.path.join(nodes_dir, '1.yaml'), 'w', encoding='utf-8') as f:
-            yaml.dump({'proxies': proxies_map[1]}, f)  
-        return True, f"同步成功: 直连 {count_summary[0]}, 落地 {count_summary[1]}"
-    except Exception as e:
-        return False, f"写入失败: {str(e)}"
+        message = f"同步成功: 直连 {count_summary[0]}, 落地 {count_summary[1]}"
+        _file_sync_state['version'] = version
+        _file_sync_state['message'] = message
+        return True, message
+
+# 后台合并重建：注册表每次变化只标记待重建，短时间内的多次修改只生成一次文件
+file_sync_worker = DebouncedWorker('subscription-file-sync', sync_nodes_to_files)
+node_registry.add_listener(file_sync_worker.request)
+
+# 订阅下载内容：按节点版本预生成 (含 gzip/br)，客户端轮询走 ETag/304
+artifact_cache = ArtifactCache()
 
 # ---------------------------------------------------------
 # 4. 统计逻辑
 # ---------------------------------------------------------
 def get_stats_data():
-    """获取统计信息：修改为统一从合并列表获取"""
-    # 触发同步，获取全量数据
-    all_nodes = merge_db_to_local_json()
+    """获取统计信息：按注册表版本缓存，节点未变化时直接返回"""
+    return node_registry.memo('stats', _build_stats)
 
+def _build_stats(nodes_map):
+    all_nodes = nodes_map.values()
     stats = {
         "total": len(all_nodes),
         "direct": 0,
@@ -440,15 +359,17 @@ def get_sub_settings():
         'sub_auto_interval': auto_interval
     }
 
+def request_api_token():
+    """公开接口每个请求都要校验，经短时缓存读取 (修改后立即清除缓存)"""
+    return setting_cache.get('api_token', 'default')
+
 def verify_request_token():
     token = request.args.get('token')
-    settings = get_sub_settings()
-    if token != settings.get('api_token', 'default'):
+    if token != request_api_token():
         abort(403, description="Invalid Access Token")
 
 def get_base_url():
-    settings = get_sub_settings()
-    fixed = settings.get('fixed_domain', '').strip()
+    fixed = str(setting_cache.get('fixed_domain', '') or '').strip()
     if fixed: return fixed.rstrip('/')
     
     scheme = request.headers.get('X-Forwarded-Proto', request.scheme)
@@ -471,11 +392,12 @@ def manager():
     
     clash_url = f"{base_url}/subscription/clash?token={token}"
     v2ray_url = f"{base_url}/subscription/base64/all?token={token}"
+    universal_url = f"{base_url}/subscription/sub?token={token}"
     script_url = f"{base_url}{url_for('subscription.download_singbox_script')}"
     callback_url = f"{base_url}{url_for('subscription.add_node_callback')}"
     
     return render_template('sub_manager.html', stats=stats, clash_url=clash_url, 
-                           v2ray_url=v2ray_url, script_url=script_url, 
+                           v2ray_url=v2ray_url, universal_url=universal_url, script_url=script_url, 
                            callback_url=callback_url, token=token, 
                            settings=settings, current_base_url=base_url)
 
@@ -492,6 +414,7 @@ def update_settings_api():
         if set_config('fixed_domain', domain, description='订阅管理-固定域名'): is_saved = True
     if 'api_token' in data:
         if set_config('api_token', data.get('api_token', '').strip(), description='订阅管理-安全Token'): is_saved = True
+    setting_cache.clear()
     # 订阅列表保存：优先接收结构化 sub_items，其次兼容 sub_urls/sub_url
     new_entries_payload = None
     if isinstance(data.get('sub_items'), list):
@@ -503,16 +426,22 @@ def update_settings_api():
                 continue
             entry_id = item.get('id') or str(uuid.uuid4())
             base = existing.get(entry_id, {})
+            url = (item.get('url') or '').strip()
+            # URL 变化后缓存信息失效
+            cache_base = base if base.get('url') == url else {}
             prepared.append({
                 'id': entry_id,
                 'name': (item.get('name') or '').strip(),
-                'url': (item.get('url') or '').strip(),
+                'url': url,
                 'note': (item.get('note') or '').strip(),
                 'enabled': bool(item.get('enabled', True)),
                 'last_status': base.get('last_status'),
                 'last_message': base.get('last_message', ''),
                 'last_synced_at': base.get('last_synced_at'),
                 'last_trigger': base.get('last_trigger'),
+                'etag': cache_base.get('etag'),
+                'last_modified': cache_base.get('last_modified'),
+                'content_hash': cache_base.get('content_hash'),
                 'order': idx
             })
         new_entries_payload = prepared
@@ -572,53 +501,137 @@ def refresh_token_api():
     """API: 刷新 Token"""
     new_token = str(uuid.uuid4()).replace('-', '')[:16]
     if set_config('api_token', new_token, description='订阅管理-安全Token'):
+        setting_cache.clear()
         return jsonify({'status': 'success', 'token': new_token, 'message': 'Token 已刷新'})
     return jsonify({'status': 'error', 'message': '刷新失败'}), 500
 
+# 远程规则集 / geodata 镜像 (保存在 nodes/mirror)
+mirror_store = MirrorStore(get_nodes_dir)
+
+def mirror_enabled():
+    return _config_flag('SUB_MIRROR_ENABLED')
+
+def mirror_targets():
+    """需要镜像的 URL：模板中的远程资源，按 SUB_MIRROR_FILTER (正则，留空为全部) 筛选"""
+    path = os.path.join(get_nodes_dir(), 'clash_meta.yaml')
+    if not os.path.exists(path):
+        return []
+    urls = clash_template.remote_resources(path)
+    pattern = str(get_config('SUB_MIRROR_FILTER', '') or '').strip()
+    if pattern:
+        try:
+            regex = re.compile(pattern)
+            urls = [u for u in urls if regex.search(u)]
+        except re.error as e:
+            print(f"[Subscription-Mirror] SUB_MIRROR_FILTER 无效，镜像全部资源: {e}")
+    return urls
+
+def run_mirror_sync():
+    """镜像一轮 (需在 app 上下文内调用)"""
+    try:
+        max_mb = float(get_config('SUB_MIRROR_MAX_SIZE_MB', 64))
+    except (TypeError, ValueError):
+        max_mb = 64
+    return mirror_store.sync(mirror_targets(), max_bytes=int(max(max_mb, 1) * 1024 * 1024))
+
+def mirror_resources_job():
+    """供 APScheduler 每分钟调用：未启用或距上次镜像不足间隔时直接返回"""
+    app = getattr(scheduler, 'app', None)
+    if app is None:
+        return
+    with app.app_context():
+        try:
+            if not mirror_enabled():
+                return
+            try:
+                interval = max(float(get_config('SUB_MIRROR_INTERVAL_HOURS', 24)), 0.1)
+            except (TypeError, ValueError):
+                interval = 24
+            last = mirror_store.last_run_at
+            if last and (datetime.now() - last).total_seconds() < interval * 3600 - 5:
+                return
+            summary = run_mirror_sync()
+            if summary:
+                print(f"[Subscription-Mirror] 共 {summary['total']}，更新 {summary['fetched']}，"
+                      f"未变化 {summary['not_modified']}，失败 {summary['failed']}")
+        except Exception as e:
+            print(f"[Subscription-Mirror] 执行失败: {e}")
+
+def _build_clash_artifact(path, base_url, token):
+    # 模板只在修改后重新解析，这里只做占位符替换
+    mirrors = mirror_store.ready_map() if mirror_enabled() else None
+    content = clash_template.render(path, base_url, token, int(time.time()), mirrors)
+    return Artifact(content, "text/yaml; charset=utf-8",
+                    {"Content-Disposition": "attachment; filename=clash_meta_config.yaml"})
+
+def userinfo_headers(extra=None):
+    """订阅响应附带的 subscription-userinfo 头 (快照入库后预先计算，这里只读内存)"""
+    headers = dict(extra or {})
+    if _config_flag('SUB_USERINFO_ENABLED', '1'):
+        userinfo = dashboard_summary.subscription_userinfo()
+        if userinfo:
+            headers['subscription-userinfo'] = userinfo
+    return headers
+
 @bp.route('/clash')
+@public_endpoint
 def download_clash_config():
-    """下载 Clash 配置文件"""
+    """下载 Clash 配置文件 (按模板修改时间与节点版本缓存)"""
     verify_request_token()
     
     try:
         base_url = get_base_url()
-        token = get_sub_settings().get('api_token', 'default')
-        timestamp = int(time.time())
+        token = request_api_token()
         path = os.path.join(get_nodes_dir(), 'clash_meta.yaml')
         
         if not os.path.exists(path): return "Error: Template not found.", 404
         
-        yaml = YAML()
-        yaml.preserve_quotes = True
-        yaml.indent(mapping=2, sequence=4, offset=2)
-        with open(path, 'r', encoding='utf-8') as f: config_data = yaml.load(f)
-        
-        # 更新 Provider URL
-        if 'proxy-providers' in config_data:
-            for name, p in config_data['proxy-providers'].items():
-                if '0.yaml' in p.get('path', '') or '/raw/0' in p.get('url', '') or '中转' in name:
-                    p['url'] = f"{base_url}/subscription/raw/0?token={token}&t={timestamp}"
-                    p['interval'] = 300
-                elif '1.yaml' in p.get('path', '') or '/raw/1' in p.get('url', '') or '落地' in name:
-                    p['url'] = f"{base_url}/subscription/raw/1?token={token}&t={timestamp}"
-                    p['interval'] = 300
-        
-        if 'rule-providers' in config_data:
-            for name, p in config_data['rule-providers'].items():
-                if 'direct' in name or 'direct' in p.get('path', ''):
-                    p['url'] = f"{base_url}/subscription/list/direct?token={token}&t={timestamp}"
-                elif 'customize' in name or 'customize' in p.get('path', ''):
-                    p['url'] = f"{base_url}/subscription/list/customize?token={token}&t={timestamp}"
-
-        out = BytesIO()
-        yaml.dump(config_data, out)
-        resp = make_response(out.getvalue())
-        resp.headers["Content-Disposition"] = "attachment; filename=clash_meta_config.yaml"
-        resp.mimetype = "text/yaml; charset=utf-8"
-        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        return resp
+        stamp = (node_registry.current_version(), os.path.getmtime(path),
+                 mirror_store.version if mirror_enabled() else None)
+        artifact = artifact_cache.get(f'clash:{base_url}:{token}', stamp,
+                                      lambda: _build_clash_artifact(path, base_url, token))
+        return artifact_response(artifact, userinfo_headers())
     except Exception as e: return f"Error: {str(e)}", 500
 
+@bp.route('/mirror/<mid>')
+@mirror_endpoint
+def download_mirror_file(mid):
+    """下载镜像的远程资源 (规则集 / geodata)，支持 ETag / 304"""
+    verify_request_token()
+    item = mirror_store.get(mid)
+    if item is None:
+        return "", 404
+    path, meta = item
+    return send_file(path, mimetype=meta.get('content_type') or 'application/octet-stream',
+                     etag=meta['sha1'], conditional=True, max_age=0, download_name=mid)
+
+@bp.route('/api/mirror', methods=['GET', 'POST'])
+@login_required
+def mirror_api():
+    """
+    API: 远程资源镜像
+    GET 返回镜像状态与每个资源的结果；POST 在后台立即镜像一轮
+    """
+    if request.method == 'POST':
+        if mirror_store.running:
+            return jsonify({'status': 'warning', 'message': '镜像正在进行中'})
+        app = current_app._get_current_object()
+
+        def _run():
+            with app.app_context():
+                try:
+                    run_mirror_sync()
+                except Exception as e:
+                    print(f"[Subscription-Mirror] 执行失败: {e}")
+
+        threading.Thread(target=_run, name='resource-mirror', daemon=True).start()
+        return jsonify({'status': 'success', 'message': '已开始镜像'})
+
+    status = mirror_store.status()
+    status['enabled'] = mirror_enabled()
+    status['targets'] = mirror_targets()
+    return jsonify({'status': 'success', 'mirror': status})
+
 @bp.route('/install-singbox.sh')
 def download_singbox_script():
     path = os.path.join(get_nodes_dir(), 'install-singbox.sh')
@@ -626,21 +639,26 @@ def download_singbox_script():
     with open(path, 'r', encoding='utf-8') as f: return Response(f.read(), mimetype='text/plain')
 
 
+@bp.route('/api/rate_limits', methods=['GET', 'DELETE'])
+@login_required
+def rate_limit_stats_api():
+    """API: 公开订阅接口的客户端访问计数 (DELETE 清空计数)"""
+    if request.method == 'DELETE':
+        client_stats.reset()
+        return jsonify({'status': 'success', 'message': '访问计数已清空'})
+    return jsonify({'status': 'success', 'clients': client_stats.snapshot()})
+
 @bp.route('/api/stats')
 @login_required
 def get_stats_api():
     try:
-        # 1. 触发文件同步：
-        # 此函数会执行：a) DB -> local_nodes.json (缓存)
-        #              b) local_nodes.json -> 0.yaml/1.yaml (文件生成)
-        success, message = sync_nodes_to_files() 
-        
-        # 2. 获取统计数据
+        # 只读：文件生成由后台任务负责，这里不再触发同步
         stats = get_stats_data()
         
-        # 如果文件同步失败，返回一个警告状态，但仍带上统计信息
-        if not success:
-            return jsonify({'status': 'warning', 'message': message, 'stats': stats})
+        # 如果最近一次文件生成失败，返回一个警告状态，但仍带上统计信息
+        result = file_sync_worker.last_result
+        if isinstance(result, tuple) and not result[0]:
+            return jsonify({'status': 'warning', 'message': result[1], 'stats': stats})
 
         # 成功则返回状态和统计数据
         return jsonify({'status': 'success', 'stats': stats})
@@ -652,10 +670,32 @@ def get_stats_api():
 @bp.route('/api/sync_files', methods=['POST'])
 @login_required
 def sync_files_api():
-    """API: 手动触发同步"""
-    success, message = sync_nodes_to_files()
+    """API: 手动触发同步 (强制重写文件)"""
+    success, message = sync_nodes_to_files(force=True)
     return jsonify({'status': 'success' if success else 'error', 'message': message})
 
+@bp.route('/api/sync_status', methods=['GET'])
+@login_required
+def sync_status_api():
+    """
+    API: 查询后台文件生成进度
+    参数: generation (可选，等待该代次完成), wait (最长等待秒数，默认 0)
+    """
+    try:
+        generation = int(request.args.get('generation', 0))
+        wait = min(max(float(request.args.get('wait', 0)), 0), 30)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '参数错误'}), 400
+
+    done = file_sync_worker.completed >= generation
+    if generation and not done and wait > 0:
+        done = file_sync_worker.wait(generation, timeout=wait)
+
+    status = file_sync_worker.status()
+    status['done'] = done
+    status['registry_version'] = node_registry.version
+    return jsonify({'status': 'success', 'sync': status})
+
 # ---------------------------------------------------------
 # 节点管理 API (统一管理 DB 和 Local)
 # ---------------------------------------------------------
@@ -665,20 +705,20 @@ def sync_files_api():
 def get_nodes_list_api():
     """
     API: 获取节点列表
-    修改：调用 merge_db_to_local_json 获取统一列表并按 sort_index 排序
+    从节点注册表读取已排序的统一列表
     """
     try:
-        nodes = merge_db_to_local_json() # 获取最新同步数据
-        nodes.sort(key=lambda x: x.get('sort_index', 0)) # 排序
-        
-        # 补充前端需要的辅助字段
-        for node in nodes:
+        nodes = []
+        for node in node_registry.nodes():
+            # 复制后再补充前端需要的辅助字段，避免污染注册表
+            item = dict(node)
             # is_db 字段方便前端判断图标
-            node['is_db'] = (node.get('origin') == 'db')
-            node['is_local'] = (node.get('origin') == 'local')
-            node['is_sub'] = (node.get('origin') == 'sub')
+            item['is_db'] = (node.get('origin') == 'db')
+            item['is_local'] = (node.get('origin') == 'local')
+            item['is_sub'] = (node.get('origin') == 'sub')
             # 协议列表
-            node['protocols'] = list(node.get('links', {}).keys())
+            item['protocols'] = list(node.get('links', {}).keys())
+            nodes.append(item)
             
         return jsonify({'status': 'success', 'nodes': nodes})
     except Exception as e:
@@ -686,8 +726,43 @@ def get_nodes_list_api():
 
 
 # ---------------------------------------------------------
-# 从订阅获取节点并保存到 local_nodes.json
+# 从订阅获取节点并保存到节点注册表
 # ---------------------------------------------------------
+def dedupe_subscription_nodes(aggregated_nodes, kept_sources, tasks, policy):
+    """
+    按指纹去重本次解析出的节点，未变化来源在注册表中的链接也参与比较
+    返回 (保留的新节点, 需从注册表移除的未变化来源链接, {source_id: 被合并的数量})
+    """
+    if policy == POLICY_OFF or not aggregated_nodes:
+        return aggregated_nodes, [], {}
+
+    orders = {entry.get('id'): entry.get('order', idx) for idx, entry in enumerate(tasks)}
+    kept_items = [
+        {'uuid': node['uuid'], 'protocol': proto, 'link': link, 'source_id': node.get('sub_source_id')}
+        for node in node_registry.nodes()
+        if node.get('origin') == 'sub' and node.get('sub_source_id') in kept_sources
+        for proto, link in (node.get('links') or {}).items() if link
+    ]
+
+    index = DedupIndex()
+    # rank = (来源优先级, 出现顺序)：同一来源内的重复项保留第一条
+    for seq, item in enumerate(kept_items + aggregated_nodes):
+        index.add(item['link'], (source_rank(policy, orders.get(item.get('source_id'), 0)), seq), item)
+    winners = index.winners()
+    index.commit()
+
+    dedup_stats = defaultdict(int)
+    kept_nodes = []
+    for item in aggregated_nodes:
+        if id(item) in winners:
+            kept_nodes.append(item)
+        else:
+            dedup_stats[item.get('source_id')] += 1
+    kept_losers = [item for item in kept_items if id(item) not in winners]
+    for item in kept_losers:
+        dedup_stats[item['source_id']] += 1
+    return kept_nodes, kept_losers, dict(dedup_stats)
+
 def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='manual'):
     entries = load_subscription_entries()
     entry_map = {entry['id']: entry for entry in entries}
@@ -736,6 +811,7 @@ def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='m
 
     aggregated_nodes = []
     reports = []
+    pending = []
     for entry in tasks:
         report = {
             'id': entry.get('id'),
@@ -744,49 +820,101 @@ def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='m
             'note': entry.get('note', ''),
             'status': 'pending',
             'message': '',
+            'fetch_state': None,
             'fetched': 0,
             'new': 0,
             'updated': 0,
+            'duplicates': 0,
             'errors': [],
             'trigger': triggered_by
         }
+        reports.append(report)
 
         if not entry.get('enabled', True) and not entry.get('temporary'):
             report['status'] = 'disabled'
             report['message'] = '此订阅已被禁用'
-            reports.append(report)
             continue
 
-        url = (entry.get('url') or '').strip()
-        if not url:
+        if not (entry.get('url') or '').strip():
             report['status'] = 'error'
             report['message'] = 'URL 为空'
-            reports.append(report)
             continue
 
-        try:
-            resp = requests.get(url, timeout=20, headers={'User-Agent': 'v2rayN/6.0'})
-            resp.raise_for_status()
-            content = resp.text
-            extracted = extract_nodes_from_content(content)
-            if extracted:
-                for item in extracted:
-                    item['source_id'] = entry.get('id')
-                    aggregated_nodes.append(item)
-                report['status'] = 'success'
-                report['fetched'] = len(extracted)
-                report['message'] = f'解析 {len(extracted)} 个节点'
-            else:
-                report['status'] = 'empty'
-                report['message'] = '订阅内容为空或无法解析'
-        except Exception as e:
+        pending.append((entry, report))
+
+    # 本地仍有该来源的节点时才允许条件请求/跳过解析，否则必须重新解析
+    source_counts = defaultdict(int)
+    for node in node_registry.nodes():
+        if node.get('origin') == 'sub':
+            source_counts[node.get('sub_source_id')] += 1
+
+    try:
+        max_mb = float(get_config('SUBSCRIPTION_MAX_SIZE_MB', 20))
+    except (TypeError, ValueError):
+        max_mb = 20
+    results = subscription_fetcher.fetch_all(
+        [entry for entry, _ in pending],
+        conditional_for=lambda e: not e.get('temporary') and source_counts.get(e.get('id'), 0) > 0,
+        max_bytes=int(max(max_mb, 0.1) * 1024 * 1024)
+    )
+
+    kept_sources = set()
+    for (entry, report), result in zip(pending, results):
+        report['fetch_state'] = result.state
+        if result.state == FAILED:
             report['status'] = 'error'
             report['message'] = '下载失败'
-            report['errors'].append(str(e))
+            report['errors'].append(result.error)
+            continue
 
-        reports.append(report)
+        stored = entry_map.get(entry.get('id'))
+        if stored:
+            stored['etag'] = result.etag
+            stored['last_modified'] = result.last_modified
+
+        if result.state in (NOT_MODIFIED, UNCHANGED):
+            # 内容未变化：保留该来源现有节点，不解析、不合并
+            kept_sources.add(entry.get('id'))
+            report['status'] = 'success'
+            report['fetched'] = source_counts.get(entry.get('id'), 0)
+            report['message'] = '订阅未更新 (304)，沿用已有节点' if result.state == NOT_MODIFIED else '内容未变化，跳过解析'
+            continue
 
-    if not aggregated_nodes:
+        # 从临时文件分块读取并逐个解析，不在内存中保留完整订阅内容
+        extracted_count = 0
+        try:
+            for item in result.iter_nodes():
+                item['source_id'] = entry.get('id')
+                aggregated_nodes.append(item)
+                extracted_count += 1
+        except Exception as e:
+            report['errors'].append(str(e))
+        finally:
+            result.close()
+        if extracted_count:
+            if stored:
+                stored['content_hash'] = result.content_hash
+            report['status'] = 'success'
+            report['fetched'] = extracted_count
+            report['message'] = f'解析 {extracted_count} 个节点'
+        else:
+            report['status'] = 'empty'
+            report['message'] = '订阅内容为空或无法解析'
+
+    # 跨订阅去重：指纹相同的节点只保留按策略胜出的一条
+    dedup_policy = str(get_config('SUB_DEDUP_POLICY', POLICY_FIRST)).strip().lower()
+    if dedup_policy not in DEDUP_POLICIES:
+        dedup_policy = POLICY_FIRST
+    aggregated_nodes, kept_losers, dedup_stats = dedupe_subscription_nodes(
+        aggregated_nodes, kept_sources, tasks, dedup_policy)
+    for source_id in {item['source_id'] for item in kept_losers}:
+        # 未变化来源的节点被去重裁掉后，下次需要重新解析才能在胜出来源失效时恢复
+        stored = entry_map.get(source_id)
+        if stored:
+            stored['etag'] = stored['last_modified'] = stored['content_hash'] = None
+    total_duplicates = sum(dedup_stats.values())
+
+    if not aggregated_nodes and not kept_sources:
         # 更新同步时间，保存状态（即便失败）
         now_iso = datetime.utcnow().isoformat()
         touched = False
@@ -813,49 +941,65 @@ def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='m
             'triggered_by': triggered_by
         }
 
-    local_nodes = load_local_nodes_raw()
     new_node_names = set()
-    sub_node_map = {n['name']: n for n in local_nodes if n.get('origin') == 'sub'}
     source_stats = defaultdict(lambda: {'new': 0, 'updated': 0})
-
-    for item in aggregated_nodes:
-        name = item['name']
-        proto = item['protocol']
-        link = item['link']
-        source_id = item.get('source_id')
-
-        new_node_names.add(name)
-
-        if name in sub_node_map:
-            target = sub_node_map[name]
-            target.setdefault('links', {})[proto] = link
-            if source_id:
-                target['sub_source_id'] = source_id
-            source_stats[source_id]['updated'] += 1
-        else:
-            new_node = {
-                "uuid": str(uuid.uuid4()),
-                "name": name,
-                "links": {proto: link},
-                "routing_type": -1,
-                "origin": "sub",
-                "is_fixed": False,
-                "sort_index": 99999,
-                "sub_source_id": source_id
-            }
-            local_nodes.append(new_node)
-            sub_node_map[name] = new_node
-            source_stats[source_id]['new'] += 1
-
-    initial_count = len(local_nodes)
-    local_nodes = [
-        n for n in local_nodes
-        if not (n.get('origin') == 'sub' and n['name'] not in new_node_names)
-    ]
-    count_deleted = initial_count - len(local_nodes)
-
-    save_local_nodes(local_nodes)
-    sync_nodes_to_files()
+    count_deleted = 0
+
+    # 所有来源内容都未变化时不触碰注册表 (版本号不变，订阅产物无需重建)
+    if aggregated_nodes:
+        with node_registry.edit() as nodes:
+            for item in kept_losers:
+                node = nodes.get(item['uuid'])
+                if node and (node.get('links') or {}).get(item['protocol']) == item['link']:
+                    del node['links'][item['protocol']]
+                    if not node['links']:
+                        del nodes[item['uuid']]
+
+            # 只读扫描按名称建索引，真正修改时再取副本 (只复制被触及的节点)
+            sub_node_map = {n['name']: (u, n) for u, n in nodes.peek_items() if n.get('origin') == 'sub'}
+
+            for item in aggregated_nodes:
+                name = item['name']
+                proto = item['protocol']
+                link = item['link']
+                source_id = item.get('source_id')
+
+                new_node_names.add(name)
+
+                if name in sub_node_map:
+                    target_uuid, current = sub_node_map[name]
+                    if (current.get('links') or {}).get(proto) != link or \
+                            (source_id and current.get('sub_source_id') != source_id):
+                        target = nodes[target_uuid]
+                        target.setdefault('links', {})[proto] = link
+                        if source_id:
+                            target['sub_source_id'] = source_id
+                        sub_node_map[name] = (target_uuid, target)
+                    source_stats[source_id]['updated'] += 1
+                else:
+                    new_node = {
+                        "uuid": str(uuid.uuid4()),
+                        "name": name,
+                        "links": {proto: link},
+                        "routing_type": -1,
+                        "origin": "sub",
+                        "is_fixed": False,
+                        "sort_index": 99999,
+                        "sub_source_id": source_id
+                    }
+                    nodes[new_node['uuid']] = new_node
+                    sub_node_map[name] = (new_node['uuid'], new_node)
+                    source_stats[source_id]['new'] += 1
+
+            # 未变化来源的节点原样保留
+            stale = [
+                u for u, n in nodes.peek_items()
+                if n.get('origin') == 'sub' and n['name'] not in new_node_names
+                and n.get('sub_source_id') not in kept_sources
+            ]
+            for uuid_val in stale:
+                del nodes[uuid_val]
+            count_deleted = len(stale)
 
     total_new = sum(stats['new'] for stats in source_stats.values())
     total_updated = sum(stats['updated'] for stats in source_stats.values())
@@ -866,12 +1010,15 @@ def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='m
         stats = source_stats.get(report.get('id'), {'new': 0, 'updated': 0})
         report['new'] = stats['new']
         report['updated'] = stats['updated']
+        report['duplicates'] = dedup_stats.get(report.get('id'), 0)
         report['synced_at'] = synced_at_iso
-        if report['status'] == 'success':
+        if report['status'] == 'success' and report['fetch_state'] == FETCHED:
             if stats['new'] == 0 and stats['updated'] == 0:
                 report['message'] = '解析成功，但未产生变更'
             else:
                 report['message'] = f"新增 {stats['new']}，更新 {stats['updated']}"
+            if report['duplicates']:
+                report['message'] += f"，重复 {report['duplicates']} 已合并"
 
     touched = False
     for report in reports:
@@ -889,6 +1036,10 @@ def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='m
     overall_msg = f"同步完成：新增 {total_new}，更新 {total_updated}"
     if count_deleted > 0:
         overall_msg += f'，清理失效 {count_deleted}'
+    if total_duplicates:
+        overall_msg += f'，合并重复 {total_duplicates}'
+    if kept_sources:
+        overall_msg += f'，{len(kept_sources)} 个订阅未变化'
 
     return {
         'status': 'success',
@@ -897,12 +1048,84 @@ def run_subscription_sync(selected_ids=None, urls_override=None, triggered_by='m
         'summary': {
             'new': total_new,
             'updated': total_updated,
-            'deleted': count_deleted
+            'deleted': count_deleted,
+            'duplicates': total_duplicates,
+            'dedup_policy': dedup_policy
         },
         'synced_at': synced_at_iso,
-        'triggered_by': triggered_by
+        'triggered_by': triggered_by,
+        'generation': file_sync_worker.requested
     }
 
+def run_node_probe():
+    """探测全部节点一轮 (需在 app 上下文内调用)；启用了剔除/排序时触发配置文件重建"""
+    with_tls = _config_flag('SUB_PROBE_TLS', '1')
+    summary = node_prober.run(node_registry.memo('output_nodes', build_output_nodes), with_tls)
+    if summary is not None and any(probe_policy()):
+        file_sync_worker.request()
+    return summary
+
+def probe_nodes_job():
+    """
+    供 APScheduler 每分钟调用：未启用或距上次探测不足间隔时直接返回
+    (开关与间隔在系统设置中修改后立即生效，无需重启)
+    """
+    app = getattr(scheduler, 'app', None)
+    if app is None:
+        return
+    with app.app_context():
+        try:
+            if not _config_flag('SUB_PROBE_ENABLED'):
+                return
+            try:
+                interval = max(int(get_config('SUB_PROBE_INTERVAL_MINUTES', 10)), 1)
+            except (TypeError, ValueError):
+                interval = 10
+            last = node_prober.last_run_at
+            if last and (datetime.now() - last).total_seconds() < interval * 60 - 5:
+                return
+            summary = run_node_probe()
+            if summary:
+                print(f"[Subscription-Probe] 可达 {summary['reachable']}，不可达 {summary['unreachable']}，"
+                      f"跳过 {summary['skipped']}，耗时 {summary['elapsed_ms']}ms")
+        except Exception as e:
+            print(f"[Subscription-Probe] 执行失败: {e}")
+
+@bp.route('/api/probe', methods=['GET', 'POST'])
+@login_required
+def probe_nodes_api():
+    """
+    API: 节点连通性探测
+    GET 返回探测状态与每条链接的最近结果；POST 在后台立即探测一轮
+    """
+    if request.method == 'POST':
+        if node_prober.running:
+            return jsonify({'status': 'warning', 'message': '探测正在进行中'})
+        app = current_app._get_current_object()
+
+        def _run():
+            with app.app_context():
+                try:
+                    run_node_probe()
+                except Exception as e:
+                    print(f"[Subscription-Probe] 执行失败: {e}")
+
+        threading.Thread(target=_run, name='node-probe', daemon=True).start()
+        return jsonify({'status': 'success', 'message': '已开始探测', 'probe': node_prober.status()})
+
+    results = []
+    for entry in node_registry.memo('output_nodes', build_output_nodes):
+        link = entry['share_link']
+        results.append({
+            'uuid': entry['uuid'],
+            'name': entry['name'],
+            'protocol': entry['protocol'],
+            'latency': node_prober.latency(link),
+            'unreachable': node_prober.is_unreachable(link),
+            'history': node_prober.history(link)
+        })
+    return jsonify({'status': 'success', 'probe': node_prober.status(), 'results': results})
+
 def auto_sync_subscriptions_job():
     """供 APScheduler 调用的自动同步任务"""
     try:
@@ -948,35 +1171,180 @@ def add_local_node_api():
         name, proto, link = data.get('name'), data.get('protocol'), data.get('link')
         if not all([name, proto, link]): return jsonify({'status': 'error', 'message': '参数不完整'}), 400
         
-        local_nodes = load_local_nodes_raw()
-        # 查找是否存在同名本地节点 (排除 DB 节点)
-        target = next((n for n in local_nodes if n['name'] == name and n.get('origin') != 'db'), None)
-        
-        if target:
-            target.setdefault('links', {})[proto] = link
-            msg = f"协议 {proto} 已合并到本地节点 {name}"
-        else:
-            local_nodes.append({
-                "uuid": str(uuid.uuid4()),
-                "name": name,
-                "links": {proto: link},
-                "routing_type": 1, # 默认直连
-                "origin": "local",
-                "is_fixed": False,
-                "sort_index": 99999
-            })
-            msg = f"本地节点 {name} 已创建"
+        with node_registry.edit() as nodes:
+            # 查找是否存在同名本地节点 (排除 DB 节点)
+            target_uuid = next((u for u, n in nodes.peek_items() if n['name'] == name and n.get('origin') != 'db'), None)
+            
+            if target_uuid:
+                nodes[target_uuid].setdefault('links', {})[proto] = link
+                msg = f"协议 {proto} 已合并到本地节点 {name}"
+            else:
+                new_uuid = str(uuid.uuid4())
+                nodes[new_uuid] = {
+                    "uuid": new_uuid,
+                    "name": name,
+                    "links": {proto: link},
+                    "routing_type": 1, # 默认直连
+                    "origin": "local",
+                    "is_fixed": False,
+                    "sort_index": 99999
+                }
+                msg = f"本地节点 {name} 已创建"
             
-        save_local_nodes(local_nodes)
         return jsonify({'status': 'success', 'message': msg})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
+IMPORT_MAX_ERRORS = 200
+
+def _check_import_link(node):
+    """用 parse_proxy_link 校验链接，返回错误信息 (有效时返回 None)"""
+    proxy = parse_proxy_link(node['link'], node['name'], None)
+    if not proxy:
+        return '链接解析失败'
+    server = str(proxy.get('server') or '').strip('[]')
+    if not server or server.startswith(':'):
+        return '缺少服务器地址'
+    try:
+        port = int(proxy.get('port'))
+    except (TypeError, ValueError):
+        return '端口无效'
+    if not 0 < port < 65536:
+        return '端口无效'
+    if proxy.get('type') != 'socks5' and not (proxy.get('uuid') or proxy.get('password')):
+        return '缺少 UUID 或密码'
+    return None
+
+IMPORT_FORM_OVERHEAD = 64 * 1024
+
+def _import_chunks():
+    """
+    按块读取导入内容：
+    multipart 上传的 file 字段 > 表单/JSON 的 content 字段 > 原始请求体
+    - 原始请求体 (text/plain 等) 直接分块读取 request.stream，不整体读入内存
+    - 上传文件由 werkzeug 暂存 (较大时落盘)，再分块读取
+    - 表单/JSON 只能整体解析，解析前按 Content-Length 拒绝超限的请求体，
+      解析后的 content 按块编码，不再复制一份完整字节
+    超过 SUBSCRIPTION_MAX_SIZE_MB 时抛出 ContentTooLarge
+    """
+    try:
+        max_bytes = int(max(float(get_config('SUBSCRIPTION_MAX_SIZE_MB', 20)), 0.1) * 1024 * 1024)
+    except (TypeError, ValueError):
+        max_bytes = 20 * 1024 * 1024
+    too_large = ContentTooLarge(f'导入内容超过 {round(max_bytes / 1024 / 1024, 1)}MB')
+
+    # 请求体上限 (含表单边界等开销)，超过时 werkzeug 在读取前即拒绝
+    request.max_content_length = max_bytes + IMPORT_FORM_OVERHEAD
+    request.max_form_memory_size = max_bytes + IMPORT_FORM_OVERHEAD
+    try:
+        if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded', 'application/json'):
+            upload = request.files.get('file')
+            if upload is not None:
+                source = iter(lambda: upload.stream.read(CHUNK_SIZE), b'')
+            else:
+                payload = request.get_json(silent=True) if request.is_json else request.form
+                content = (payload or {}).get('content') or ''
+                source = (content[i:i + CHUNK_SIZE].encode('utf-8') for i in range(0, len(content), CHUNK_SIZE))
+        else:
+            source = iter(lambda: request.stream.read(CHUNK_SIZE), b'')
+
+        total = 0
+        for chunk in source:
+            total += len(chunk)
+            if total > max_bytes:
+                raise too_large
+            yield chunk
+    except RequestEntityTooLarge:
+        raise too_large
+
+def _request_routing_type(default=1):
+    raw = request.values.get('routing_type')
+    if raw in (None, ''):
+        return default
+    value = int(raw)
+    if value not in (0, 1, -1):
+        raise ValueError('routing_type 无效')
+    return value
+
+@bp.route('/api/local_nodes/import', methods=['POST'])
+@login_required
+def import_local_nodes_api():
+    """
+    API: 批量导入本地节点
+    内容可为多行分享链接 / Base64 订阅 / Clash YAML / sing-box JSON，
+    通过上传文件 (file)、content 字段或 text/plain 请求体提交。
+    逐行校验，所有有效链接在一次注册表修改中合并 (同名节点合并协议)，返回逐行错误。
+    参数: routing_type (默认 1)，dry_run=1 只校验不写入
+    """
+    try:
+        routing_type = _request_routing_type()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'routing_type 无效'}), 400
+    dry_run = str(request.values.get('dry_run', '')).lower() in ['1', 'true', 'yes']
+
+    valid, errors = [], []
+    error_count = 0
+    lines = 0
+    try:
+        for line_no, text, node in iter_lines_from_chunks(_import_chunks()):
+            stripped = text.strip()
+            if not stripped or stripped.startswith(('#', '//')):
+                continue
+            lines += 1
+            message = _check_import_link(node) if node else '不支持的协议或格式'
+            if message is None:
+                valid.append(node)
+                continue
+            error_count += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'line': line_no, 'content': stripped[:120], 'message': message})
+    except ContentTooLarge as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 413
+
+    created = merged = 0
+    if valid and not dry_run:
+        with node_registry.edit() as nodes:
+            # 与单个添加一致：同名的非 DB 节点合并协议，否则新建本地节点
+            by_name = {n['name']: u for u, n in nodes.peek_items() if n.get('origin') != 'db'}
+            for node in valid:
+                target_uuid = by_name.get(node['name'])
+                if target_uuid:
+                    nodes[target_uuid].setdefault('links', {})[node['protocol']] = node['link']
+                    merged += 1
+                else:
+                    new_uuid = by_name[node['name']] = str(uuid.uuid4())
+                    nodes[new_uuid] = {
+                        "uuid": new_uuid,
+                        "name": node['name'],
+                        "links": {node['protocol']: node['link']},
+                        "routing_type": routing_type,
+                        "origin": "local",
+                        "is_fixed": False,
+                        "sort_index": 99999
+                    }
+                    created += 1
+
+    if dry_run:
+        message = f"校验完成：有效 {len(valid)}，错误 {error_count}"
+    else:
+        message = f"导入完成：新建 {created}，合并 {merged}，错误 {error_count}"
+    status = 'success' if valid or not error_count else 'error'
+    if valid and error_count:
+        status = 'warning'
+    return jsonify({
+        'status': status,
+        'message': message,
+        'summary': {'lines': lines, 'valid': len(valid), 'created': created, 'merged': merged, 'errors': error_count},
+        'errors': errors,
+        'errors_truncated': error_count > len(errors),
+        'generation': file_sync_worker.requested
+    })
+
 @bp.route('/api/local_nodes/rename', methods=['POST'])
 @login_required
 def rename_local_node_api():
     """
     API: 重命名节点
-    修改：根据 origin 判断调用 DB 函数还是修改本地 JSON
+    修改：根据 origin 判断调用 DB 函数还是修改本地节点
     """
     try:
         data = request.get_json()
@@ -984,21 +1352,18 @@ def rename_local_node_api():
         new_name = data.get('name')
         if not target_uuid or not new_name: return jsonify({'status': 'error', 'message': '参数不完整'}), 400
             
-        local_nodes = load_local_nodes_raw()
-        target_node = next((n for n in local_nodes if n['uuid'] == target_uuid), None)
+        target_node = node_registry.get(target_uuid)
         
         if not target_node: return jsonify({'status': 'error', 'message': '未找到节点'}), 404
             
         if target_node.get('origin') == 'db':
-            # DB 节点：调用数据库更新
+            # DB 节点：调用数据库更新 (提交后注册表自动失效重载)
             success = update_node_custom_name(target_uuid, new_name)
             if not success: return jsonify({'status': 'error', 'message': '数据库更新失败'}), 500
         else:
-            # Local 节点：直接更新 JSON
-            target_node['name'] = new_name
-            save_local_nodes(local_nodes)
+            # Local 节点：直接更新注册表
+            node_registry.update(target_uuid, name=new_name)
             
-        sync_nodes_to_files() # 重新同步以刷新配置
         return jsonify({'status': 'success', 'message': '重命名成功'})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -1009,8 +1374,7 @@ def update_local_node_links_api():
     try:
         data = request.get_json()
         uuid_val, links = data.get('uuid'), data.get('links')
-        local_nodes = load_local_nodes_raw()
-        node = next((n for n in local_nodes if n['uuid'] == uuid_val), None)
+        node = node_registry.get(uuid_val)
         
         if not node: return jsonify({'status': 'error', 'message': '节点不存在'}), 404
         # 防止修改 DB 节点链接
@@ -1018,14 +1382,12 @@ def update_local_node_links_api():
         
         cleaned = {k: v for k, v in links.items() if v and v.strip()}
         if not cleaned:
-            local_nodes.remove(node)
+            node_registry.remove(uuid_val)
             msg = '节点已清空并删除'
         else:
-            node['links'] = cleaned
+            node_registry.update(uuid_val, links=cleaned)
             msg = '链接已更新'
             
-        save_local_nodes(local_nodes)
-        sync_nodes_to_files()
         return jsonify({'status': 'success', 'message': msg})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -1035,18 +1397,29 @@ def delete_local_node_api():
     """API: 删除节点 (仅限本地节点)"""
     try:
         uuid_val = request.get_json().get('uuid')
-        local_nodes = load_local_nodes_raw()
-        node = next((n for n in local_nodes if n['uuid'] == uuid_val), None)
+        node = node_registry.get(uuid_val)
         
         if not node: return jsonify({'status': 'error', 'message': '节点不存在'}), 404
         if node.get('origin') == 'db': return jsonify({'status': 'error', 'message': '无法删除数据库同步节点'}), 403
         
-        local_nodes.remove(node)
-        save_local_nodes(local_nodes)
-        sync_nodes_to_files()
+        node_registry.remove(uuid_val)
         return jsonify({'status': 'success', 'message': '节点已删除'})
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@bp.route('/api/local_nodes/export', methods=['GET'])
+@login_required
+def export_local_nodes_api():
+    """API: 导出节点备份 (格式与旧版 local_nodes.json 相同)"""
+    try:
+        content = json.dumps(node_registry.export_nodes(), ensure_ascii=False, indent=2)
+        resp = make_response(content)
+        resp.mimetype = 'application/json; charset=utf-8'
+        filename = f"local_nodes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        resp.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        return resp
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @bp.route('/api/nodes/clear_subscription', methods=['POST'])
 @login_required
 def clear_subscription_nodes_api():
@@ -1055,20 +1428,15 @@ def clear_subscription_nodes_api():
     保留手动添加的 (local) 和数据库同步的 (db) 节点
     """
     try:
-        # 1. 读取当前节点列表
-        local_nodes = load_local_nodes_raw()
-        initial_count = len(local_nodes)
+        # 1. 找出全部 'sub' 节点，保留 'local' 和 'db'
+        sub_uuids = [n['uuid'] for n in node_registry.nodes() if n.get('origin') == 'sub']
+        deleted_count = len(sub_uuids)
         
-        # 2. 过滤列表：只保留 origin 不为 'sub' 的节点
-        # 这样会把 'sub' 节点全部剔除，保留 'local' 和 'db'
-        new_nodes = [n for n in local_nodes if n.get('origin') != 'sub']
-        
-        deleted_count = initial_count - len(new_nodes)
-        
-        # 3. 如果有变化，保存并触发同步
+        # 2. 如果有变化，从注册表移除并触发同步
         if deleted_count > 0:
-            save_local_nodes(new_nodes)
-            sync_nodes_to_files() # 立即重新生成 yaml，让更改生效
+            with node_registry.edit() as nodes:
+                for uuid_val in sub_uuids:
+                    nodes.pop(uuid_val, None)
             msg = f'已清除 {deleted_count} 个订阅节点'
         else:
             msg = '没有可清除的订阅节点'
@@ -1085,192 +1453,382 @@ def delete_local_node_protocol_api():
     try:
         data = request.get_json()
         uuid_val, proto = data.get('uuid'), data.get('protocol')
-        local_nodes = load_local_nodes_raw()
-        node = next((n for n in local_nodes if n['uuid'] == uuid_val), None)
+        node = node_registry.get(uuid_val)
         
         if not node: return jsonify({'status': 'error', 'message': '节点不存在'}), 404
         if node.get('origin') == 'db': return jsonify({'status': 'error', 'message': '无法修改数据库节点'}), 403
         
-        if 'links' in node and proto in node['links']:
+        if proto in node['links']:
             del node['links'][proto]
             msg = '协议已删除'
             if not node['links']:
-                local_nodes.remove(node)
+                node_registry.remove(uuid_val)
                 msg += '，节点为空已清理'
-            save_local_nodes(local_nodes)
-            sync_nodes_to_files()
+            else:
+                node_registry.update(uuid_val, links=node['links'])
             return jsonify({'status': 'success', 'message': msg})
         return jsonify({'status': 'error', 'message': '协议不存在'}), 404
     except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
 
+ROUTING_GROUPS = [('direct', 0), ('land', 1), ('blocked', -1)]
+
+class NodeBatchError(ValueError):
+    pass
+
+def _normalize_node_changes(raw_changes):
+    """校验批量修改项，返回 {uuid: {'routing_type'?, 'sort_index'?}}，格式错误抛出 NodeBatchError"""
+    if not isinstance(raw_changes, list):
+        raise NodeBatchError('changes 必须为数组')
+    valid_types = {code for _, code in ROUTING_GROUPS}
+    changes = {}
+    for item in raw_changes:
+        if not isinstance(item, dict) or not item.get('uuid'):
+            raise NodeBatchError('修改项缺少 uuid')
+        change = changes.setdefault(str(item['uuid']), {})
+        try:
+            if item.get('routing_type') is not None:
+                change['routing_type'] = int(item['routing_type'])
+            if item.get('sort_index') is not None:
+                change['sort_index'] = int(item['sort_index'])
+        except (TypeError, ValueError):
+            raise NodeBatchError(f"修改项格式错误: {item['uuid']}")
+        if change.get('routing_type', -1) not in valid_types:
+            raise NodeBatchError(f"无效的分组: {item['routing_type']}")
+    return changes
+
+def apply_node_changes(changes):
+    """
+    [写] 批量修改节点的排序与分组：
+    - 任一 uuid 不存在时整体拒绝，不做任何修改
+    - DB 节点的分组变化在一个事务内写回数据库，失败时注册表保持不变
+    - 注册表只编辑一次 (版本 + 1)，配置文件只重新生成一次
+    返回 (sort_changed, routing_changed)
+    """
+    # 先校验再编辑：校验失败时注册表版本不变，不会触发重新生成
+    current = {node['uuid']: node for node in node_registry.nodes()}
+    missing = [u for u in changes if u not in current]
+    if missing:
+        raise NodeBatchError(f"节点不存在: {', '.join(missing[:5])}")
+
+    # 只保留与当前值不同的字段；没有实际变化时不编辑注册表
+    defaults = {'routing_type': -1, 'sort_index': None}
+    pending = {}
+    for uuid_val, change in changes.items():
+        diff = {k: v for k, v in change.items() if current[uuid_val].get(k, defaults[k]) != v}
+        if diff:
+            pending[uuid_val] = diff
+    if not pending:
+        return 0, 0
+
+    db_routing = {
+        u: c['routing_type'] for u, c in pending.items()
+        if 'routing_type' in c and current[u].get('origin') == 'db'
+    }
+    if db_routing and not update_nodes_routing(db_routing):
+        raise RuntimeError('数据库写入失败，未做任何修改')
+
+    with node_registry.edit() as node_map:
+        for uuid_val, diff in pending.items():
+            node = node_map.get(uuid_val)
+            if node is not None:
+                node.update(diff)
+    sort_changed = sum(1 for c in pending.values() if 'sort_index' in c)
+    routing_changed = sum(1 for c in pending.values() if 'routing_type' in c)
+    return sort_changed, routing_changed
+
+@bp.route('/api/nodes/batch_update', methods=['POST'])
+@login_required
+def batch_update_nodes_api():
+    """
+    API: 批量修改节点排序与分组 (只需提交有变化的节点)
+    请求: {"changes": [{"uuid": "...", "routing_type": 0, "sort_index": 3}, ...]}
+    routing_type / sort_index 均可省略；全部修改在一次提交中生效
+    """
+    try:
+        changes = _normalize_node_changes((request.get_json(silent=True) or {}).get('changes'))
+        sort_changed, routing_changed = apply_node_changes(changes) if changes else (0, 0)
+        if not sort_changed and not routing_changed:
+            return jsonify({'status': 'success', 'message': '没有需要保存的修改', 'version': node_registry.version})
+        return jsonify({
+            'status': 'success',
+            'message': f'已保存：排序 {sort_changed} 个，分组 {routing_changed} 个',
+            'version': node_registry.version
+        })
+    except NodeBatchError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @bp.route('/api/nodes/update_routing', methods=['POST'])
 @login_required
 def update_nodes_routing_api():
     """
-    API: 更新节点排序和分组
-    修改：支持 DB 节点的分组修改。
-    如果检测到 DB 节点的分组(routing_type)发生变化，自动同步回数据库。
+    API: 按完整排序更新节点排序和分组 (兼容旧版前端)
+    请求: {"direct": [uuid...], "land": [...], "blocked": [...]}，按列表顺序重新编号
+    与批量接口共用同一事务逻辑，列表中已不存在的节点会被忽略
     """
     try:
-        data = request.get_json()
-        local_nodes = load_local_nodes_raw()
-        node_map = {n['uuid']: n for n in local_nodes}
-        
-        groups = [('direct', 0), ('land', 1), ('blocked', -1)]
+        data = request.get_json() or {}
+        existing = {node['uuid'] for node in node_registry.nodes()}
+        changes = {}
         current_index = 0
-        
-        for group_name, type_code in groups:
-            uuid_list = data.get(group_name, [])
-            for uuid_val in uuid_list:
-                if uuid_val in node_map:
-                    node = node_map[uuid_val]
-                    
-                    # 1. 更新排序索引 (所有节点)
-                    node['sort_index'] = current_index
+        for group_name, type_code in ROUTING_GROUPS:
+            for uuid_val in data.get(group_name, []):
+                if uuid_val in existing:
+                    changes[uuid_val] = {'sort_index': current_index, 'routing_type': type_code}
                     current_index += 1
-                    
-                    # 2. 更新分组 (路由类型)
-                    old_type = node.get('routing_type', -1)
-                    
-                    # 如果分组发生了变化
-                    if old_type != type_code:
-                        if node.get('origin') == 'db':
-                            # [核心修改] DB 节点：调用数据库函数更新 routing_type
-                            # update_node_details 需要完整信息，我们从 local_nodes 中读取当前的 links 和 name
-                            success = update_node_details(
-                                uuid_val, 
-                                node.get('links', {}), 
-                                type_code, # 新的路由类型
-                                node.get('name') 
-                            )
-                            if success:
-                                node['routing_type'] = type_code
-                            else:
-                                print(f"Failed to update DB node routing: {uuid_val}")
-                        else:
-                            # Local 节点：直接更新 JSON
-                            node['routing_type'] = type_code
-        
-        # 保存 JSON 并生成配置文件
-        save_local_nodes(local_nodes)
-        sync_nodes_to_files()
-        
+
+        apply_node_changes(changes)
+        # 注册表会异步写回节点表，并在后台重新生成配置文件
         return jsonify({'status': 'success', 'message': '排序与分组已更新 (DB已同步)'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def _output_index(nodes_map):
+    return build_output_index(node_registry.memo('output_nodes', build_output_nodes))
+
+def _build_output_artifact(target, group, filters):
+    """按输出格式、分组与过滤条件生成订阅产物"""
+    emitter, mimetype = EMITTERS[target]
+    entries = node_registry.memo('output_nodes', build_output_nodes)
+    if filters:
+        entries = filter_entries(entries, node_registry.memo('output_index', _output_index), filters)
+    exclude_dead, sort_by_latency = probe_policy()
+    entries = apply_probe_policy(entries, node_prober, exclude_dead, sort_by_latency)
+    return Artifact(emitter(select_entries(entries, group)), mimetype)
+
+def get_output_artifact(target, group='all', filters=None, filter_key=''):
+    """[读] 订阅产物按 (格式, 分组, 规范化过滤条件) 缓存，节点版本或探测结果变化后才重新生成"""
+    key = f'sub:{target}:{group}' + (f'?{filter_key}' if filter_key else '')
+    return artifact_cache.get(key, output_stamp(),
+                              lambda: _build_output_artifact(target, group, filters))
+
+def request_filters():
+    """解析请求中的过滤参数 (region/protocol/origin/source/name)，表达式无效时返回 400"""
+    try:
+        return parse_filters(request.args)
+    except ValueError as e:
+        abort(make_response(jsonify({'status': 'error', 'message': str(e)}), 400))
+
 @bp.route('/base64/all')
+@public_endpoint
 def download_v2ray_base64():
     """下载 Base64 订阅"""
     verify_request_token()
-    # 1. 统一从 merged 列表获取所有节点
-    all_nodes = merge_db_to_local_json()
-    # 2. 允许直连(0)、落地(1)，以及尚未分类的订阅节点 (routing_type=-1 或 None)
-    # 避免用户尚未手动分组时订阅内容为空
-    nodes_to_include = []
-    for node in all_nodes:
-        r_type = node.get('routing_type')
-        if r_type in [0, 1]:
-            nodes_to_include.append(node)
-            continue
-        if node.get('origin') == 'sub' and (r_type is None or r_type == -1):
-            nodes_to_include.append(node)
-
-    # 3. 按 sort_index 排序
-    nodes_to_include.sort(key=lambda x: x.get('sort_index', 0))
-    links = []
-    for node in nodes_to_include:
-        links_dict = node.get('links', {})
-        name = node.get('name', 'Unknown')
-        origin = node.get('origin', 'local')
-        region = node.get('region', 'LOC')
-        
-        # 增加对类型的图标判断
-        flag = get_emoji_flag(region) if origin == 'db' else ('📝' if origin == 'local' else '')
-        for proto, link in links_dict.items():
-            if link and link.strip():
-                # 2. 计算 name_prefix (在协议循环内，使用当前的 proto)
-                name_prefix = ""
-                if origin == 'db' or origin == 'local':
-                    # 只有 DB 和 Local 节点需要协议前缀
-                    name_prefix = f"{proto.lower()}-"
-                # origin == 'sub' 时，name_prefix 保持空字符串
-                
-                link = fix_link_ipv6(link) # 提高对ipv6的兼容性
-                
-                # 3. 构造最终名称
-                full_name = f"{flag} {name_prefix}{name}".strip()
-                
-                safe_name = urllib.parse.quote(full_name)
-                if '#' in link: link = link.split('#')[0]
-                links.append(f"{link}#{safe_name}")
-
-    joined = "\n".join(links)
     # 如果传入 ?raw=1 则直接返回原始文本，便于调试
     try:
         raw_flag = str(request.args.get('raw', '')).lower() in ['1', 'true', 'yes']
     except Exception:
         raw_flag = False
 
-    if raw_flag:
-        return Response(joined, mimetype='text/plain; charset=utf-8')
+    filters, filter_key = request_filters()
+    return artifact_response(get_output_artifact(TARGET_LINKS if raw_flag else TARGET_BASE64,
+                                                 filters=filters, filter_key=filter_key),
+                             userinfo_headers())
 
-    b64 = base64.b64encode(joined.encode('utf-8')).decode('utf-8')
-    return Response(b64, mimetype='text/plain')
+@bp.route('/sub')
+@public_endpoint
+def download_subscription():
+    """
+    通用订阅：按 ?target=clash|singbox|base64|links 输出，未指定时根据 User-Agent 识别客户端
+    ?group=0|1|all 选择直连/落地/全部节点 (默认 all)
+    过滤：?region=SG,HK&protocol=hy2&origin=sub&source=<订阅ID>&name=<正则>
+    region 可用代码或国旗 Emoji (SG 与 🇸🇬 等价，不区分大小写)；
+    只有 DB 节点带地区，指定 region 时未设置地区的本地/订阅节点不会出现在结果中
+    """
+    verify_request_token()
+    target = resolve_target(request.args.get('target'), request.headers.get('User-Agent'))
+    if target is None:
+        return jsonify({'status': 'error', 'message': '不支持的订阅格式'}), 400
+    group = request.args.get('group', 'all')
+    if group not in ('0', '1', 'all'):
+        return jsonify({'status': 'error', 'message': '无效的分组'}), 400
+
+    filters, filter_key = request_filters()
+
+    # 同一 URL 会因 User-Agent 返回不同内容
+    return artifact_response(get_output_artifact(target, group, filters, filter_key),
+                             userinfo_headers({'Vary': 'Accept-Encoding, User-Agent'}))
+
+def _build_snapshot_artifact(nodes_map):
+    # 在注册表锁内执行，version 与节点列表一致
+    body = json.dumps({
+        'status': 'success',
+        'epoch': node_registry.epoch,
+        'version': node_registry.version,
+        'full': True,
+        'nodes': sorted(nodes_map.values(), key=lambda x: x.get('sort_index', 9999))
+    }, ensure_ascii=False)
+    return Artifact(body, 'application/json')
+
+@bp.route('/delta')
+@public_endpoint
+def download_node_delta():
+    """
+    增量同步：?since=<version>&epoch=<epoch>
+    返回 since 之后新增/修改/删除的节点；since 与 epoch 必须同时给出且 epoch 与当前一致
+    (版本号每次启动从 0 开始，不同 epoch 的版本号不可比)，否则或 since 早于变更日志
+    保留范围时返回全量快照 (full=true)
+    """
+    verify_request_token()
+    since = request.args.get('since', type=int)
+    epoch = request.args.get('epoch')
+    if since is not None and epoch == node_registry.epoch:
+        version, delta = node_registry.changes_since(since)
+        if delta is not None:
+            return jsonify({'status': 'success', 'epoch': node_registry.epoch, 'version': version,
+                            'since': since, 'full': False, **delta})
+
+    # 全量快照按节点版本缓存 (含 ETag / 压缩)
+    return artifact_response(node_registry.memo('delta_snapshot', _build_snapshot_artifact))
+
+CALLBACK_PROTOCOL_RE = re.compile(r'^[A-Za-z0-9_-]{1,16}$')
+CALLBACK_MAX_NAME = 128
+CALLBACK_MAX_LINK = 8192
+
+def _validate_callback_payload(data):
+    """校验脚本回调内容，返回 (report, error)"""
+    if not isinstance(data, dict):
+        return None, 'Missing data'
+    name, proto, link = data.get('name'), data.get('protocol'), data.get('link')
+    if not all([name, proto, link]) or not all(isinstance(v, str) for v in (name, proto, link)):
+        return None, 'Missing data'
+    name, proto, link = name.strip(), proto.strip().lower(), link.strip()
+    if not name or len(name) > CALLBACK_MAX_NAME:
+        return None, '节点名称为空或过长'
+    if not CALLBACK_PROTOCOL_RE.match(proto):
+        return None, '协议名称无效'
+    if '://' not in link or len(link) > CALLBACK_MAX_LINK or any(c in link for c in '\r\n'):
+        return None, '节点链接无效'
+    return {'name': name, 'protocol': proto, 'link': link}, None
+
+def apply_callback_reports(reports):
+    """
+    [写] 合并一批脚本回调 (队列消费线程调用)：
+    整批只编辑一次注册表，按顺序处理，同名节点的多次上报依次合并
+    """
+    results = []
+    with node_registry.edit() as nodes:
+        local_by_name = {n['name']: u for u, n in nodes.peek_items() if n.get('origin') == 'local'}
+        for report in reports:
+            name, proto, link = report['name'], report['protocol'], report['link']
+            target_uuid = local_by_name.get(name)
+            if target_uuid:
+                nodes[target_uuid].setdefault('links', {})[proto] = link
+                results.append({'message': f"已合并到节点 {name}", 'uuid': target_uuid})
+            else:
+                new_uuid = local_by_name[name] = str(uuid.uuid4())
+                nodes[new_uuid] = {
+                    "uuid": new_uuid,
+                    "name": name,
+                    "links": {proto: link},
+                    "routing_type": 1,
+                    "origin": "local",
+                    "is_fixed": False,
+                    "sort_index": 99999
+                }
+                results.append({'message': f"自动添加节点 {name}", 'uuid': new_uuid})
+    # 注册表变化已触发后台重新生成，这里记录对应的文件代次供状态查询
+    generation = file_sync_worker.request()
+    for result in results:
+        result['generation'] = generation
+    return results
+
+# 脚本回调写入队列：批量部署时大量并发上报先入队，由单个线程合并写入
+callback_queue = IngestQueue('subscription-callback-ingest', apply_callback_reports)
+
+def _callback_status(ticket):
+    status = callback_queue.status(ticket)
+    if status is None:
+        return None
+    result = status['result'] or {}
+    generation = result.get('generation')
+    # applied: 已写入节点注册表；synced: 对应的配置文件已重新生成
+    status['synced'] = bool(generation) and file_sync_worker.completed >= generation
+    return status
 
 @bp.route('/api/callback/add_node', methods=['POST'])
+@public_endpoint
 def add_node_callback():
-    """API: 脚本回调自动添加节点 (视为 Local 节点)"""
+    """
+    API: 脚本回调自动添加节点 (视为 Local 节点)
+    校验后加入写入队列立即返回回执号；?wait=秒 可等待写入完成后再返回 (最长 30 秒)
+    """
+    report, error = _validate_callback_payload(request.get_json(silent=True))
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
     try:
-        data = request.get_json()
-        name, proto, link = data.get('name'), data.get('protocol'), data.get('link')
-        if not all([name, proto, link]): return jsonify({'status': 'error', 'message': 'Missing data'}), 400
-        
-        local_nodes = load_local_nodes_raw()
-        target = next((n for n in local_nodes if n['name'] == name and n.get('origin') == 'local'), None)
-        
-        if target:
-            target.setdefault('links', {})[proto] = link
-            msg = f"已合并到节点 {name}"
-        else:
-            local_nodes.append({
-                "uuid": str(uuid.uuid4()),
-                "name": name,
-                "links": {proto: link},
-                "routing_type": 1,
-                "origin": "local",
-                "is_fixed": False,
-                "sort_index": 99999
-            })
-            msg = f"自动添加节点 {name}"
-        save_local_nodes(local_nodes)
-        sync_nodes_to_files()
-        return jsonify({'status': 'success', 'message': msg})
-    except Exception as e: return jsonify({'status': 'error', 'message': str(e)}), 500
+        wait = min(max(float(request.args.get('wait', 0)), 0), 30)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '参数错误'}), 400
+
+    try:
+        ticket = callback_queue.submit(report)
+    except queue.Full:
+        return jsonify({'status': 'error', 'message': '队列已满，请稍后重试'}), 503
+
+    status_url = url_for('subscription.callback_status_api', ticket=ticket, _external=True)
+    if wait > 0 and callback_queue.wait(ticket, timeout=wait):
+        status = _callback_status(ticket)
+        if status and status['state'] == 'applied':
+            return jsonify({'status': 'success', 'message': status['result']['message'],
+                            'ticket': ticket, 'status_url': status_url})
+        return jsonify({'status': 'error', 'message': (status or {}).get('result', {}).get('message', '写入失败'),
+                        'ticket': ticket, 'status_url': status_url}), 500
+
+    return jsonify({'status': 'success', 'message': f"已加入队列: {report['name']}",
+                    'ticket': ticket, 'status_url': status_url}), 202
+
+@bp.route('/api/callback/status/<ticket>')
+@public_endpoint
+def callback_status_api(ticket):
+    """API: 查询脚本回调的处理状态 (queued / applied / failed)"""
+    status = _callback_status(ticket)
+    if status is None:
+        return jsonify({'status': 'error', 'message': '回执不存在或已过期'}), 404
+    return jsonify({'status': 'success', 'ticket': ticket, 'report': status, 'queue': callback_queue.stats()})
 
 @bp.route('/raw/<int:routing_type>')
+@public_endpoint
 def download_raw_subscription(routing_type):
     verify_request_token()
-    filename = '0.yaml' if routing_type == 0 else '1.yaml'
-    path = os.path.join(get_nodes_dir(), filename)
-    if not os.path.exists(path): sync_nodes_to_files()
-    content = "proxies: []"
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f: content = f.read()
-    resp = make_response(content)
-    resp.mimetype = "text/yaml; charset=utf-8"
-    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    return resp
+    group = 0 if routing_type == 0 else 1
 
-@bp.route('/list/<list_type>')
-def download_rule_list(list_type):
-    verify_request_token()
+    filters, filter_key = request_filters()
+    return artifact_response(get_output_artifact(TARGET_CLASH, str(group), filters, filter_key),
+                             userinfo_headers())
+
+def rule_list_path(list_type):
     filename = 'direct.list' if list_type == 'direct' else 'customize.list'
     path = os.path.join(get_nodes_dir(), filename)
     if not os.path.exists(path): path += '.txt'
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f: return Response(f.read(), mimetype='text/plain')
-    return "", 404
+    return path
+
+def get_rule_artifact(list_type, kind=KIND_CLASSICAL):
+    """[读] 编译后的规则列表 (按文件签名缓存)，文件不存在时返回 None"""
+    path = rule_list_path(list_type)
+    try:
+        signature, compiled = rule_list_cache.get(path)
+    except FileNotFoundError:
+        return None
+    return artifact_cache.get(f'rules:{list_type}:{kind}', signature,
+                              lambda: Artifact(compiled.render(kind), 'text/plain; charset=utf-8'))
+
+@bp.route('/list/<list_type>')
+@bp.route('/list/<list_type>/<kind>')
+@public_endpoint
+def download_rule_list(list_type, kind=KIND_CLASSICAL):
+    """
+    下载编译后的规则列表
+    kind: classical (默认，兼容现有 rule-provider) / domain / ipcidr (mihomo behavior 对应的规则集)
+    """
+    verify_request_token()
+    if kind not in RULE_KINDS:
+        return "", 404
+    artifact = get_rule_artifact(list_type, kind)
+    if artifact is None:
+        return "", 404
+    return artifact_response(artifact)
 
 @bp.route('/api/rules', methods=['GET', 'POST'])
 @login_required
@@ -1285,7 +1843,15 @@ def handle_rules():
         content = request.get_json().get('content', '')
         if filename.endswith('.sh'): content = content.replace('\r\n', '\n')
         with open(path, 'w', encoding='utf-8') as f: f.write(content)
-        return jsonify({'status': 'success'})
+        if not filename.endswith('.list'):
+            return jsonify({'status': 'success'})
+
+        # 保存后立即编译，客户端下次下载直接取内存中的结果
+        _, compiled = rule_list_cache.get(path)
+        stats = compiled.stats
+        message = (f"规则 {stats['input']} 条，编译后 {stats['output']} 条 "
+                   f"(重复 {stats['duplicates']}，被覆盖 {stats['covered']}，无效 {stats['invalid']})")
+        return jsonify({'status': 'success', 'message': message, 'compile': stats, 'errors': compiled.errors[:50]})
 
 @bp.route('/api/rule_template', methods=['GET', 'POST'])
 @login_required
@@ -1296,4 +1862,6 @@ def handle_rule_template():
         with open(path, 'r', encoding='utf-8') as f: return jsonify({'status': 'success', 'content': f.read()})
     else:
         with open(path, 'w', encoding='utf-8') as f: f.write(request.get_json().get('content', ''))
+        clash_template.invalidate()
+        artifact_cache.invalidate('clash:')
         return jsonify({'status': 'success'})
@@ -0,0 +1,227 @@
+import ipaddress
+import os
+import re
+import threading
+
+# =========================================================
+# 规则列表编译 (direct.list / customize.list)
+# 保存时 (或文件被外部修改后首次读取时) 编译一次：
+# - 规范化：类型大写、域名小写、IP 段规范化为网络地址；裸域名视为 DOMAIN-SUFFIX，裸 IP 视为 IP-CIDR
+#   国际化域名 (中文等) 转为 Punycode (xn--)，与客户端实际匹配的 DNS / SNI 域名一致
+# - 去重：完全相同的规则只保留一条
+# - 覆盖消除：已被更宽规则包含的条目删除
+#   (DOMAIN / DOMAIN-SUFFIX 落在某个 DOMAIN-SUFFIX 之下、包含某个 DOMAIN-KEYWORD，IP 段被更大的段包含)
+# - 分类：输出 classical 文本 (供现有 rule-provider 使用)，以及 domain / ipcidr 两个规则集
+# 磁盘上的源文件 (含注释) 原样保留，客户端下载的是编译结果。
+# =========================================================
+
+KIND_CLASSICAL = 'classical'
+KIND_DOMAIN = 'domain'
+KIND_IPCIDR = 'ipcidr'
+RULE_KINDS = (KIND_CLASSICAL, KIND_DOMAIN, KIND_IPCIDR)
+
+DOMAIN_TYPES = ('DOMAIN', 'DOMAIN-SUFFIX', 'DOMAIN-KEYWORD')
+IP_TYPES = ('IP-CIDR', 'IP-CIDR6')
+
+_DOMAIN_RE = re.compile(r'^(?=.{1,253}$)([a-z0-9_*](?:[a-z0-9_*-]{0,61}[a-z0-9_*])?\.)*[a-z0-9_*-]{1,63}$')
+
+
+class CompiledRules:
+    def __init__(self):
+        self.domains = set()       # DOMAIN 精确匹配
+        self.suffixes = set()      # DOMAIN-SUFFIX
+        self.keywords = set()      # DOMAIN-KEYWORD
+        self.networks = {}         # 附加参数 (如 'no-resolve') -> [ip_network, ...]
+        self.others = []           # 其他类型 (GEOIP / PROCESS-NAME / DST-PORT ...)，原样保留
+        self.stats = {'input': 0, 'output': 0, 'duplicates': 0, 'covered': 0, 'invalid': 0}
+        self.errors = []
+
+    def classical_lines(self):
+        # 域名类在前，IP 类在后 (IP 规则可能触发 DNS 解析)
+        lines = [f'DOMAIN,{d}' for d in sorted(self.domains)]
+        lines += [f'DOMAIN-SUFFIX,{s}' for s in sorted(self.suffixes)]
+        lines += [f'DOMAIN-KEYWORD,{k}' for k in sorted(self.keywords)]
+        lines += self.others
+        for options, networks in sorted(self.networks.items()):
+            suffix = f',{options}' if options else ''
+            for net in networks:
+                rule_type = 'IP-CIDR' if net.version == 4 else 'IP-CIDR6'
+                lines.append(f'{rule_type},{net.with_prefixlen}{suffix}')
+        return lines
+
+    def domain_lines(self):
+        """mihomo domain 规则集格式：'+.' 前缀表示后缀匹配；DOMAIN-KEYWORD 无法表达，只保留在 classical 中"""
+        return sorted(self.domains) + [f'+.{s}' for s in sorted(self.suffixes)]
+
+    def ipcidr_lines(self):
+        networks = ipaddress.collapse_addresses(
+            [n for nets in self.networks.values() for n in nets if n.version == 4])
+        networks6 = ipaddress.collapse_addresses(
+            [n for nets in self.networks.values() for n in nets if n.version == 6])
+        return [n.with_prefixlen for n in list(networks) + list(networks6)]
+
+    def render(self, kind=KIND_CLASSICAL):
+        if kind == KIND_DOMAIN:
+            lines = self.domain_lines()
+        elif kind == KIND_IPCIDR:
+            lines = self.ipcidr_lines()
+        else:
+            lines = self.classical_lines()
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+
+def _parse_network(value):
+    try:
+        return ipaddress.ip_network(value.strip('[]'), strict=False)
+    except ValueError:
+        return None
+
+
+def _normalize_line(line):
+    """返回 (类型, 值, 附加参数) ；注释/空行返回 None，无法识别抛出 ValueError"""
+    line = line.strip()
+    if not line or line.startswith(('#', '//', ';')):
+        return None
+    parts = [p.strip() for p in line.split(',')]
+    if len(parts) == 1:
+        # 裸条目：IP / 网段 或 域名 ('+.' / '.' 前缀同样视为后缀)
+        value = parts[0]
+        if _parse_network(value) is not None:
+            net = _parse_network(value)
+            return ('IP-CIDR' if net.version == 4 else 'IP-CIDR6'), value, ''
+        return 'DOMAIN-SUFFIX', value.lstrip('+').lstrip('.'), ''
+
+    rule_type, value, options = parts[0].upper(), parts[1], ','.join(p for p in parts[2:] if p)
+    if not value:
+        raise ValueError('缺少规则值')
+    return rule_type, value, options
+
+
+def _to_ascii_domain(value):
+    """国际化域名转为 Punycode；无法转换时原样返回 (随后按格式无效报告)"""
+    if value.isascii():
+        return value
+    try:
+        return value.encode('idna').decode('ascii')
+    except UnicodeError:
+        return value
+
+
+def _is_covered_domain(domain, suffixes, keywords):
+    """domain 是否已被某个 DOMAIN-SUFFIX (自身或上级域名) 或 DOMAIN-KEYWORD 覆盖"""
+    labels = domain.split('.')
+    for i in range(len(labels)):
+        if '.'.join(labels[i:]) in suffixes:
+            return True
+    return any(k in domain for k in keywords)
+
+
+def compile_rules(text):
+    """编译规则文本，返回 CompiledRules"""
+    compiled = CompiledRules()
+    stats = compiled.stats
+    seen = set()
+    domains, suffixes, keywords, networks = set(), set(), set(), {}
+
+    for line_no, line in enumerate(text.splitlines(), 1):
+        try:
+            parsed = _normalize_line(line)
+        except ValueError as e:
+            stats['invalid'] += 1
+            compiled.errors.append({'line': line_no, 'content': line.strip()[:120], 'message': str(e)})
+            continue
+        if parsed is None:
+            continue
+        stats['input'] += 1
+        rule_type, value, options = parsed
+
+        if rule_type in DOMAIN_TYPES:
+            value = value.lower().rstrip('.')
+            if rule_type != 'DOMAIN-KEYWORD':
+                value = _to_ascii_domain(value)
+                if not _DOMAIN_RE.match(value):
+                    stats['invalid'] += 1
+                    compiled.errors.append({'line': line_no, 'content': line.strip()[:120], 'message': '域名格式无效'})
+                    continue
+        elif rule_type in IP_TYPES:
+            net = _parse_network(value)
+            if net is None:
+                stats['invalid'] += 1
+                compiled.errors.append({'line': line_no, 'content': line.strip()[:120], 'message': 'IP 段格式无效'})
+                continue
+            value = net.with_prefixlen
+
+        key = (rule_type, value, options)
+        if key in seen:
+            stats['duplicates'] += 1
+            continue
+        seen.add(key)
+
+        if rule_type == 'DOMAIN':
+            domains.add(value)
+        elif rule_type == 'DOMAIN-SUFFIX':
+            suffixes.add(value)
+        elif rule_type == 'DOMAIN-KEYWORD':
+            keywords.add(value)
+        elif rule_type in IP_TYPES:
+            networks.setdefault(options.lower(), []).append(_parse_network(value))
+        else:
+            compiled.others.append(','.join([rule_type, value] + ([options] if options else [])))
+
+    # 覆盖消除：关键字 -> 后缀 -> 精确域名
+    for suffix in sorted(suffixes, key=lambda s: s.count('.')):
+        parent = suffix.split('.', 1)[1] if '.' in suffix else None
+        if (parent and _is_covered_domain(parent, compiled.suffixes, ())) or any(k in suffix for k in keywords):
+            stats['covered'] += 1
+        else:
+            compiled.suffixes.add(suffix)
+    for domain in domains:
+        if _is_covered_domain(domain, compiled.suffixes, keywords):
+            stats['covered'] += 1
+        else:
+            compiled.domains.add(domain)
+    compiled.keywords = keywords
+
+    # IP 段：同一附加参数内合并相邻/包含的网段
+    for options, nets in networks.items():
+        collapsed = list(ipaddress.collapse_addresses([n for n in nets if n.version == 4]))
+        collapsed += list(ipaddress.collapse_addresses([n for n in nets if n.version == 6]))
+        stats['covered'] += len(nets) - len(collapsed)
+        compiled.networks[options] = collapsed
+
+    stats['output'] = (len(compiled.domains) + len(compiled.suffixes) + len(compiled.keywords)
+                       + len(compiled.others) + sum(len(n) for n in compiled.networks.values()))
+    return compiled
+
+
+class RuleListCache:
+    """
+    编译结果缓存：按文件路径保存 (文件签名, CompiledRules)
+    文件签名为 (mtime_ns, size)，保存规则时主动编译，外部修改文件后下次读取时重新编译
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}
+        self.compiles = 0
+
+    @staticmethod
+    def signature(path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path):
+        """[读] 返回 (签名, CompiledRules)；文件不存在时抛出 FileNotFoundError"""
+        signature = self.signature(path)
+        with self._lock:
+            item = self._items.get(path)
+            if item and item[0] == signature:
+                return item
+            with open(path, 'r', encoding='utf-8') as f:
+                compiled = compile_rules(f.read())
+            item = self._items[path] = (signature, compiled)
+            self.compiles += 1
+            return item
+
+
+rule_list_cache = RuleListCache()
@@ -0,0 +1,168 @@
+import hashlib
+import tempfile
+import threading
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .link_parser import iter_nodes_from_chunks
+
+# =========================================================
+# 外部订阅并发下载
+# - 线程池并发下载，同一主机同时最多 PER_HOST_LIMIT 个请求
+# - 携带上次保存的 ETag / Last-Modified 发起条件请求 (304 = not_modified)
+# - 对内容计算哈希，与上次相同 (unchanged) 时跳过解析与合并
+# - 分块流式下载，超过大小上限即中止；内容暂存在 SpooledTemporaryFile
+#   (超过 SPOOL_MEMORY_BYTES 自动落盘)，解析时再分块读出，峰值内存有界
+# =========================================================
+
+FETCH_TIMEOUT = 20
+MAX_WORKERS = 8
+PER_HOST_LIMIT = 2
+USER_AGENT = 'v2rayN/6.0'
+CHUNK_SIZE = 64 * 1024
+SPOOL_MEMORY_BYTES = 1024 * 1024
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+
+FETCHED = 'fetched'
+NOT_MODIFIED = 'not_modified'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+
+class ContentTooLarge(Exception):
+    pass
+
+
+class FetchResult:
+    def __init__(self, entry):
+        self.entry = entry
+        self.state = FAILED
+        self.body = None
+        self.size = 0
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.error = None
+
+    def iter_chunks(self):
+        self.body.seek(0)
+        while True:
+            chunk = self.body.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_nodes(self):
+        """逐个产出解析后的节点 (仅 state == fetched 时可用)"""
+        if self.body is None:
+            return iter(())
+        return iter_nodes_from_chunks(self.iter_chunks())
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+
+class SubscriptionFetcher:
+    def __init__(self, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT):
+        self._max_workers = max_workers
+        self._per_host_limit = per_host_limit
+        self._host_locks = defaultdict(lambda: threading.BoundedSemaphore(self._per_host_limit))
+        self._host_lock_guard = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._host_lock_guard:
+            return self._host_locks[host]
+
+    def _download(self, url, headers, max_bytes):
+        """流式下载到临时文件，返回 (resp, body, size, sha256)；304 时 body 为 None"""
+        with requests.get(url, timeout=FETCH_TIMEOUT, headers=headers, stream=True) as resp:
+            if resp.status_code == 304:
+                return resp, None, 0, None
+            resp.raise_for_status()
+
+            declared = resp.headers.get('Content-Length')
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise ContentTooLarge(f'订阅内容过大 ({int(declared)} > {max_bytes} 字节)')
+
+            body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ContentTooLarge(f'订阅内容超过上限 {max_bytes} 字节')
+                    digest.update(chunk)
+                    body.write(chunk)
+            except Exception:
+                body.close()
+                raise
+            return resp, body, size, digest.hexdigest()
+
+    def fetch_one(self, entry, conditional=True, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        下载单个订阅
+        conditional=False 时忽略缓存信息 (例如本地已没有该来源的节点)
+        返回的 FetchResult 持有临时文件，使用完毕后需调用 close()
+        """
+        result = FetchResult(entry)
+        url = (entry.get('url') or '').strip()
+        headers = {'User-Agent': USER_AGENT}
+        if conditional:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            with self._host_semaphore(url):
+                resp, body, size, digest = self._download(url, headers, max_bytes)
+        except Exception as e:
+            result.error = str(e)
+            return result
+
+        result.etag = resp.headers.get('ETag') or entry.get('etag')
+        result.last_modified = resp.headers.get('Last-Modified') or entry.get('last_modified')
+        if body is None:
+            result.state = NOT_MODIFIED
+            result.content_hash = entry.get('content_hash')
+            return result
+
+        result.size = size
+        result.content_hash = digest
+        if conditional and result.content_hash == entry.get('content_hash'):
+            body.close()
+            result.state = UNCHANGED
+            return result
+
+        result.state = FETCHED
+        result.body = body
+        return result
+
+    def fetch_all(self, entries, conditional_for=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        并发下载多个订阅，按输入顺序返回 FetchResult 列表
+        conditional_for(entry) -> bool 决定是否允许条件请求/跳过
+        """
+        if not entries:
+            return []
+        workers = min(self._max_workers, len(entries))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sub-fetch') as pool:
+            futures = [
+                pool.submit(self.fetch_one, entry,
+                            conditional_for(entry) if conditional_for else True, max_bytes)
+                for entry in entries
+            ]
+            return [f.result() for f in futures]
+
+
+# 全局单例 (同主机并发限制跨多次同步共享)
+subscription_fetcher = SubscriptionFetcher()
@@ -0,0 +1,645 @@
+import base64
+import json
+import re
+import urllib.parse
+
+try:
+    import yaml as _pyyaml  # 可选依赖：优先使用 libyaml 的 C 加速 SafeLoader
+    _YAML_LOADER = getattr(_pyyaml, 'CSafeLoader', _pyyaml.SafeLoader)
+except ImportError:
+    _pyyaml = None
+    _YAML_LOADER = None
+
+# ==============================================================================
+# 结构化订阅格式 (Clash YAML / sing-box JSON)
+# - detect_content_format 根据开头内容判断订阅格式
+# - Clash proxies 直接使用；sing-box outbound 转换为与 parse_proxy_link 相同的 Clash 字典
+# - proxy_to_share_link 再把 Clash 字典编码为分享链接，沿用节点表以链接存储的方式
+# ==============================================================================
+
+FORMAT_LINKS = 'links'
+FORMAT_CLASH = 'clash'
+FORMAT_SINGBOX = 'singbox'
+
+# 顶层 YAML 键 (例如 "proxies:" / "port: 7890")；分享链接的 "vless://" 不会匹配
+_YAML_KEY = re.compile(r'^[A-Za-z0-9_-]+\s*:(\s|$)')
+
+# 链接 scheme -> 节点表中的协议键 (与 parse_share_line 一致)
+_PROTOCOL_KEYS = {
+    'vless': 'vless',
+    'vmess': 'vmess',
+    'trojan': 'trojan',
+    'hysteria2': 'hy2',
+    'tuic': 'tuic',
+    'ss': 'ss',
+    'socks5': 'socks5',
+}
+
+
+def detect_content_format(head):
+    """根据订阅内容开头 (str) 判断格式：links / clash / singbox"""
+    for line in head.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith(('{', '[')):
+            return FORMAT_SINGBOX
+        if _YAML_KEY.match(line):
+            return FORMAT_CLASH
+        return FORMAT_LINKS
+    return FORMAT_LINKS
+
+
+def load_yaml_fast(text):
+    """使用 SafeLoader 读取 YAML (不保留注释/格式，速度远快于 ruamel 往返模式)"""
+    if _pyyaml is not None:
+        return _pyyaml.load(text, Loader=_YAML_LOADER)
+    from ruamel.yaml import YAML
+    return YAML(typ='safe').load(text)
+
+
+# ------------------------------------------------------------------------------
+# Shadowsocks 插件参数：SIP003 "k=v;k=v" 字符串 (sing-box plugin_opts) <-> Clash plugin-opts 字典
+# 只映射 obfs / v2ray-plugin 的常用参数；其他插件原样保存在 {'options': ...} 中
+# ------------------------------------------------------------------------------
+
+# SIP003 插件名 -> Clash 插件名
+_SIP003_PLUGINS = {'obfs-local': 'obfs', 'simple-obfs': 'obfs', 'obfs': 'obfs', 'v2ray-plugin': 'v2ray-plugin'}
+# Clash 插件名 -> sing-box 插件名
+_SINGBOX_PLUGINS = {'obfs': 'obfs-local', 'v2ray-plugin': 'v2ray-plugin'}
+
+
+def _split_sip003(options):
+    """按 SIP003 规则切分 "k=v;flag"，支持反斜杠转义；无值的键为 True"""
+    pairs, key, value, current, escaped = {}, None, None, [], False
+    for ch in (options or '') + ';':
+        if escaped:
+            current.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch == '=' and key is None:
+            key, current = ''.join(current), []
+        elif ch == ';':
+            if key is None:
+                key, value = ''.join(current), True
+            else:
+                value = ''.join(current)
+            if key:
+                pairs[key.strip()] = value
+            key, value, current = None, None, []
+        else:
+            current.append(ch)
+    return pairs
+
+
+def _join_sip003(pairs):
+    def _escape(text):
+        return re.sub(r'([\\;=])', r'\\\1', str(text))
+    return ';'.join(_escape(k) if v is True else f"{_escape(k)}={_escape(v)}" for k, v in pairs)
+
+
+def sip003_to_plugin_opts(plugin, options):
+    """SIP003 插件名与参数字符串 -> (Clash 插件名, plugin-opts 字典)"""
+    name = _SIP003_PLUGINS.get(plugin)
+    pairs = _split_sip003(options)
+    if name == 'obfs':
+        opts = {'mode': pairs.get('obfs', 'http')}
+        if pairs.get('obfs-host'):
+            opts['host'] = pairs['obfs-host']
+        return name, opts
+    if name == 'v2ray-plugin':
+        opts = {'mode': pairs.get('mode', 'websocket')}
+        if pairs.get('tls') is True:
+            opts['tls'] = True
+        for key in ('host', 'path'):
+            if isinstance(pairs.get(key), str):
+                opts[key] = pairs[key]
+        if isinstance(pairs.get('mux'), str):
+            opts['mux'] = pairs['mux'] != '0'
+        return name, opts
+    return plugin, {'options': options or ''}
+
+
+def plugin_opts_to_sip003(plugin, opts):
+    """(Clash 插件名, plugin-opts 字典) -> (SIP003 插件名, 参数字符串)"""
+    if not isinstance(opts, dict):
+        return plugin, str(opts or '')
+    if 'options' in opts or plugin not in _SINGBOX_PLUGINS:
+        return plugin, str(opts.get('options', ''))
+    if plugin == 'obfs':
+        pairs = [('obfs', opts.get('mode', 'http'))]
+        if opts.get('host'):
+            pairs.append(('obfs-host', opts['host']))
+    else:
+        pairs = [('mode', opts.get('mode', 'websocket'))]
+        if opts.get('tls'):
+            pairs.append(('tls', True))
+        for key in ('host', 'path'):
+            if opts.get(key):
+                pairs.append((key, opts[key]))
+        if 'mux' in opts:
+            pairs.append(('mux', '1' if opts['mux'] else '0'))
+    return _SINGBOX_PLUGINS[plugin], _join_sip003(pairs)
+
+
+# ------------------------------------------------------------------------------
+# sing-box outbound -> Clash proxy 字典
+# ------------------------------------------------------------------------------
+
+def _singbox_tls(outbound, proxy, sni_key):
+    tls = outbound.get('tls') or {}
+    if not tls.get('enabled'):
+        return
+    proxy['tls'] = True
+    if tls.get('server_name'):
+        proxy[sni_key] = tls['server_name']
+    if tls.get('insecure'):
+        proxy['skip-cert-verify'] = True
+    if tls.get('alpn'):
+        proxy['alpn'] = list(tls['alpn'])
+    fingerprint = (tls.get('utls') or {}).get('fingerprint')
+    if fingerprint:
+        proxy['client-fingerprint'] = fingerprint
+    reality = tls.get('reality') or {}
+    if reality.get('enabled'):
+        proxy['reality-opts'] = {
+            'public-key': reality.get('public_key', ''),
+            'short-id': reality.get('short_id', '')
+        }
+
+
+def _singbox_transport(outbound, proxy):
+    transport = outbound.get('transport') or {}
+    t_type = transport.get('type')
+    if t_type == 'ws':
+        proxy['network'] = 'ws'
+        proxy['ws-opts'] = {'path': transport.get('path', '/'), 'headers': {}}
+        host = (transport.get('headers') or {}).get('Host')
+        if host:
+            proxy['ws-opts']['headers']['Host'] = host
+    elif t_type == 'grpc':
+        proxy['network'] = 'grpc'
+        proxy['grpc-opts'] = {'grpc-service-name': transport.get('service_name', '')}
+    elif t_type == 'http':
+        proxy['network'] = 'h2'
+        proxy['h2-opts'] = {'path': [transport.get('path', '/')], 'host': list(transport.get('host') or [])}
+    elif t_type == 'httpupgrade':
+        proxy['network'] = 'http'
+        proxy['http-opts'] = {'method': 'GET', 'path': [transport.get('path', '/')]}
+        if transport.get('host'):
+            proxy['http-opts']['headers'] = {'Host': [transport['host']]}
+    else:
+        proxy['network'] = 'tcp'
+
+
+def singbox_outbound_to_proxy(outbound):
+    """将单个 sing-box outbound 转为 Clash proxy 字典，不支持的类型返回 None"""
+    if not isinstance(outbound, dict):
+        return None
+    o_type = outbound.get('type')
+    server = outbound.get('server')
+    port = outbound.get('server_port')
+    if not server or not port:
+        return None
+
+    proxy = {
+        'name': outbound.get('tag') or f'{server}:{port}',
+        'server': server,
+        'port': int(port),
+        'udp': True
+    }
+
+    if o_type == 'vless':
+        proxy.update({'type': 'vless', 'uuid': outbound.get('uuid', '')})
+        if outbound.get('flow'):
+            proxy['flow'] = outbound['flow']
+        if outbound.get('packet_encoding'):
+            proxy['packet-encoding'] = outbound['packet_encoding']
+        _singbox_tls(outbound, proxy, 'servername')
+        _singbox_transport(outbound, proxy)
+    elif o_type == 'vmess':
+        proxy.update({
+            'type': 'vmess',
+            'uuid': outbound.get('uuid', ''),
+            'alterId': int(outbound.get('alter_id', 0)),
+            'cipher': outbound.get('security', 'auto')
+        })
+        _singbox_tls(outbound, proxy, 'servername')
+        _singbox_transport(outbound, proxy)
+    elif o_type == 'trojan':
+        proxy.update({'type': 'trojan', 'password': outbound.get('password', '')})
+        _singbox_tls(outbound, proxy, 'sni')
+        _singbox_transport(outbound, proxy)
+    elif o_type == 'hysteria2':
+        proxy.update({'type': 'hysteria2', 'password': outbound.get('password', '')})
+        obfs = outbound.get('obfs') or {}
+        if obfs.get('type'):
+            proxy['obfs'] = obfs['type']
+            proxy['obfs-password'] = obfs.get('password', '')
+        if outbound.get('up_mbps'):
+            proxy['up'] = outbound['up_mbps']
+        if outbound.get('down_mbps'):
+            proxy['down'] = outbound['down_mbps']
+        _singbox_tls(outbound, proxy, 'sni')
+    elif o_type == 'tuic':
+        proxy.update({
+            'type': 'tuic',
+            'uuid': outbound.get('uuid', ''),
+            'password': outbound.get('password', ''),
+            'congestion-controller': outbound.get('congestion_control', 'bbr'),
+            'udp-relay-mode': outbound.get('udp_relay_mode', 'native'),
+            'zero-rtt': bool(outbound.get('zero_rtt_handshake'))
+        })
+        _singbox_tls(outbound, proxy, 'sni')
+    elif o_type == 'shadowsocks':
+        proxy.update({
+            'type': 'ss',
+            'cipher': outbound.get('method', ''),
+            'password': outbound.get('password', '')
+        })
+        if outbound.get('plugin'):
+            proxy['plugin'], proxy['plugin-opts'] = sip003_to_plugin_opts(outbound['plugin'], outbound.get('plugin_opts', ''))
+    elif o_type == 'socks':
+        proxy.update({
+            'type': 'socks5',
+            'username': outbound.get('username', ''),
+            'password': outbound.get('password', '')
+        })
+    else:
+        # selector / urltest / direct / block / dns 等非代理出站
+        return None
+    return proxy
+
+
+# ------------------------------------------------------------------------------
+# Clash proxy 字典 -> sing-box outbound (输出 sing-box 订阅时使用)
+# ------------------------------------------------------------------------------
+
+def _to_singbox_tls(proxy, always=False):
+    if not (always or proxy.get('tls') or proxy.get('reality-opts')):
+        return None
+    tls = {'enabled': True}
+    sni = proxy.get('servername') or proxy.get('sni')
+    if sni:
+        tls['server_name'] = sni
+    if proxy.get('skip-cert-verify'):
+        tls['insecure'] = True
+    if proxy.get('alpn'):
+        tls['alpn'] = list(proxy['alpn'])
+    fingerprint = proxy.get('client-fingerprint')
+    reality = proxy.get('reality-opts')
+    if reality:
+        # sing-box 的 reality 必须配合 utls 使用
+        fingerprint = fingerprint or 'chrome'
+        tls['reality'] = {
+            'enabled': True,
+            'public_key': reality.get('public-key', ''),
+            'short_id': reality.get('short-id', '')
+        }
+    if fingerprint:
+        tls['utls'] = {'enabled': True, 'fingerprint': fingerprint}
+    return tls
+
+
+def _to_singbox_transport(proxy):
+    network = proxy.get('network') or 'tcp'
+    if network == 'ws':
+        opts = proxy.get('ws-opts') or {}
+        transport = {'type': 'ws', 'path': opts.get('path', '/')}
+        host = (opts.get('headers') or {}).get('Host')
+        if host:
+            transport['headers'] = {'Host': host}
+        return transport
+    if network == 'grpc':
+        return {'type': 'grpc', 'service_name': (proxy.get('grpc-opts') or {}).get('grpc-service-name', '')}
+    if network == 'h2':
+        opts = proxy.get('h2-opts') or {}
+        transport = {'type': 'http', 'path': (opts.get('path') or ['/'])[0]}
+        if opts.get('host'):
+            transport['host'] = list(opts['host'])
+        return transport
+    if network == 'http':
+        opts = proxy.get('http-opts') or {}
+        transport = {'type': 'http', 'method': opts.get('method', 'GET'), 'path': (opts.get('path') or ['/'])[0]}
+        host = (opts.get('headers') or {}).get('Host')
+        if host:
+            transport['host'] = host if isinstance(host, list) else [host]
+        return transport
+    return None
+
+
+def proxy_to_singbox_outbound(proxy, tag=None):
+    """将 Clash proxy 字典转为 sing-box outbound，不支持的类型返回 None"""
+    p_type = str(proxy.get('type', '')).lower()
+    outbound = {
+        'tag': tag or proxy.get('name', ''),
+        'server': str(proxy.get('server', '')).strip('[]'),
+        'server_port': int(proxy.get('port') or 0)
+    }
+    tls = None
+    if p_type == 'vless':
+        outbound.update({'type': 'vless', 'uuid': proxy.get('uuid', '')})
+        if proxy.get('flow'):
+            outbound['flow'] = proxy['flow']
+        if proxy.get('packet-encoding'):
+            outbound['packet_encoding'] = proxy['packet-encoding']
+        tls = _to_singbox_tls(proxy)
+    elif p_type == 'vmess':
+        outbound.update({
+            'type': 'vmess',
+            'uuid': proxy.get('uuid', ''),
+            'alter_id': int(proxy.get('alterId', 0)),
+            'security': proxy.get('cipher', 'auto')
+        })
+        tls = _to_singbox_tls(proxy)
+    elif p_type == 'trojan':
+        outbound.update({'type': 'trojan', 'password': proxy.get('password', '')})
+        tls = _to_singbox_tls(proxy, always=True)
+    elif p_type == 'hysteria2':
+        outbound.update({'type': 'hysteria2', 'password': proxy.get('password', '')})
+        if proxy.get('obfs'):
+            outbound['obfs'] = {'type': proxy['obfs'], 'password': proxy.get('obfs-password', '')}
+        for key, target in (('up', 'up_mbps'), ('down', 'down_mbps')):
+            value = _bandwidth(proxy.get(key)) if proxy.get(key) else None
+            if value:
+                outbound[target] = int(value)
+        tls = _to_singbox_tls(proxy, always=True)
+    elif p_type == 'tuic':
+        outbound.update({
+            'type': 'tuic',
+            'uuid': proxy.get('uuid', ''),
+            'password': proxy.get('password', ''),
+            'congestion_control': proxy.get('congestion-controller', 'bbr'),
+            'udp_relay_mode': proxy.get('udp-relay-mode', 'native'),
+            'zero_rtt_handshake': bool(proxy.get('zero-rtt'))
+        })
+        tls = _to_singbox_tls(proxy, always=True)
+    elif p_type == 'ss':
+        outbound.update({
+            'type': 'shadowsocks',
+            'method': proxy.get('cipher', ''),
+            'password': proxy.get('password', '')
+        })
+        if proxy.get('plugin'):
+            outbound['plugin'], outbound['plugin_opts'] = plugin_opts_to_sip003(proxy['plugin'], proxy.get('plugin-opts') or {})
+    elif p_type == 'socks5':
+        outbound.update({'type': 'socks', 'version': '5'})
+        if proxy.get('username'):
+            outbound['username'] = proxy['username']
+            outbound['password'] = proxy.get('password', '')
+    else:
+        return None
+
+    if tls:
+        outbound['tls'] = tls
+    if p_type in ('vless', 'vmess', 'trojan'):
+        transport = _to_singbox_transport(proxy)
+        if transport:
+            outbound['transport'] = transport
+    return outbound
+
+
+# ------------------------------------------------------------------------------
+# Clash proxy 字典 -> 分享链接 (可被 parse_proxy_link 还原)
+# ------------------------------------------------------------------------------
+
+def _host_port(proxy):
+    server = str(proxy.get('server', ''))
+    if ':' in server and not server.startswith('['):
+        server = f'[{server}]'
+    return f"{server}:{proxy.get('port')}"
+
+
+def _quote(value):
+    return urllib.parse.quote(str(value), safe='')
+
+
+def _fragment(proxy):
+    return '#' + urllib.parse.quote(str(proxy.get('name', '')))
+
+
+def _bandwidth(value):
+    """Clash 带宽可写成 '100 Mbps'，分享链接只保留数字"""
+    match = re.match(r'\s*(\d+)', str(value))
+    return match.group(1) if match else None
+
+
+def _transport_params(proxy, params):
+    network = proxy.get('network') or 'tcp'
+    params['type'] = network
+    if network == 'ws':
+        opts = proxy.get('ws-opts') or {}
+        params['path'] = opts.get('path', '/')
+        host = (opts.get('headers') or {}).get('Host')
+        if host:
+            params['host'] = host
+    elif network == 'grpc':
+        params['serviceName'] = (proxy.get('grpc-opts') or {}).get('grpc-service-name', '')
+    elif network == 'h2':
+        opts = proxy.get('h2-opts') or {}
+        params['path'] = ','.join(opts.get('path') or ['/'])
+        if opts.get('host'):
+            params['host'] = ','.join(opts['host'])
+    elif network == 'http':
+        opts = proxy.get('http-opts') or {}
+        params['path'] = ','.join(opts.get('path') or ['/'])
+        host = (opts.get('headers') or {}).get('Host')
+        if host:
+            params['host'] = ','.join(host) if isinstance(host, list) else host
+
+
+def _tls_params(proxy, params, sni_key):
+    reality = proxy.get('reality-opts')
+    if reality:
+        params['security'] = 'reality'
+        params['pbk'] = reality.get('public-key', '')
+        params['sid'] = reality.get('short-id', '')
+    elif proxy.get('tls'):
+        params['security'] = 'tls'
+    sni = proxy.get(sni_key) or proxy.get('servername') or proxy.get('sni')
+    if sni:
+        params['sni'] = sni
+    if proxy.get('client-fingerprint'):
+        params['fp'] = proxy['client-fingerprint']
+    if proxy.get('alpn'):
+        params['alpn'] = ','.join(proxy['alpn'])
+    if proxy.get('skip-cert-verify'):
+        params['insecure'] = '1'
+
+
+def _encode_vless(proxy):
+    params = {}
+    if proxy.get('flow'):
+        params['flow'] = proxy['flow']
+    if proxy.get('packet-encoding'):
+        params['packet_encoding'] = proxy['packet-encoding']
+    _tls_params(proxy, params, 'servername')
+    params.setdefault('security', 'none')
+    _transport_params(proxy, params)
+    return f"vless://{_quote(proxy.get('uuid', ''))}@{_host_port(proxy)}?{urllib.parse.urlencode(params)}{_fragment(proxy)}"
+
+
+def _encode_trojan(proxy):
+    params = {}
+    _tls_params(proxy, params, 'sni')
+    params.setdefault('security', 'tls')
+    _transport_params(proxy, params)
+    return f"trojan://{_quote(proxy.get('password', ''))}@{_host_port(proxy)}?{urllib.parse.urlencode(params)}{_fragment(proxy)}"
+
+
+def _encode_hysteria2(proxy):
+    params = {}
+    if proxy.get('sni'):
+        params['sni'] = proxy['sni']
+    if proxy.get('skip-cert-verify'):
+        params['insecure'] = '1'
+    if proxy.get('alpn'):
+        params['alpn'] = ','.join(proxy['alpn'])
+    if proxy.get('obfs'):
+        params['obfs'] = proxy['obfs']
+        params['obfs-password'] = proxy.get('obfs-password', '')
+    for key in ('up', 'down'):
+        value = _bandwidth(proxy.get(key)) if proxy.get(key) else None
+        if value:
+            params[key] = value
+    if proxy.get('ports'):
+        params['ports'] = proxy['ports']
+    query = f"?{urllib.parse.urlencode(params)}" if params else ''
+    return f"hysteria2://{_quote(proxy.get('password', ''))}@{_host_port(proxy)}{query}{_fragment(proxy)}"
+
+
+def _encode_tuic(proxy):
+    params = {
+        'congestion_controller': proxy.get('congestion-controller', 'bbr'),
+        'udp-relay-mode': proxy.get('udp-relay-mode', 'native'),
+        'insecure': '1' if proxy.get('skip-cert-verify') else '0'
+    }
+    sni = proxy.get('sni') or proxy.get('servername')
+    if sni:
+        params['sni'] = sni
+    if proxy.get('alpn'):
+        params['alpn'] = ','.join(proxy['alpn'])
+    for key in ('disable-sni', 'reduce-rtt', 'zero-rtt'):
+        if proxy.get(key):
+            params[key] = '1'
+    userinfo = f"{_quote(proxy.get('uuid', ''))}:{_quote(proxy.get('password', ''))}"
+    return f"tuic://{userinfo}@{_host_port(proxy)}?{urllib.parse.urlencode(params)}{_fragment(proxy)}"
+
+
+def _encode_vmess(proxy):
+    network = proxy.get('network') or 'tcp'
+    data = {
+        'v': '2',
+        'ps': proxy.get('name', ''),
+        'add': str(proxy.get('server', '')).strip('[]'),
+        'port': str(proxy.get('port')),
+        'id': proxy.get('uuid', ''),
+        'aid': str(proxy.get('alterId', 0)),
+        'scy': proxy.get('cipher', 'auto'),
+        'net': network,
+        'type': 'none',
+        'tls': 'tls' if proxy.get('tls') else '',
+        'sni': proxy.get('servername', '')
+    }
+    if proxy.get('skip-cert-verify'):
+        data['skip-cert-verify'] = True
+    if network == 'ws':
+        opts = proxy.get('ws-opts') or {}
+        data['path'] = opts.get('path', '/')
+        data['host'] = (opts.get('headers') or {}).get('Host', '')
+    elif network == 'grpc':
+        data['path'] = (proxy.get('grpc-opts') or {}).get('grpc-service-name', '')
+    elif network in ('h2', 'http'):
+        opts = proxy.get(f'{network}-opts') or {}
+        data['path'] = (opts.get('path') or ['/'])[0]
+        host = opts.get('host') if network == 'h2' else (opts.get('headers') or {}).get('Host')
+        if isinstance(host, list):
+            host = host[0] if host else ''
+        data['host'] = host or ''
+    if proxy.get('packet-encoding'):
+        data['packet_encoding'] = proxy['packet-encoding']
+    encoded = base64.b64encode(json.dumps(data, ensure_ascii=False).encode('utf-8')).decode('ascii')
+    return f"vmess://{encoded}"
+
+
+def _encode_ss(proxy):
+    userinfo = f"{proxy.get('cipher', '')}:{proxy.get('password', '')}"
+    encoded = base64.urlsafe_b64encode(userinfo.encode('utf-8')).decode('ascii').rstrip('=')
+    query = ''
+    if proxy.get('plugin'):
+        params = {'plugin': proxy['plugin']}
+        if proxy.get('plugin-opts'):
+            params['plugin_opts'] = json.dumps(proxy['plugin-opts'], ensure_ascii=False)
+        query = f"?{urllib.parse.urlencode(params)}"
+    return f"ss://{encoded}@{_host_port(proxy)}{query}{_fragment(proxy)}"
+
+
+def _encode_socks5(proxy):
+    userinfo = ''
+    if proxy.get('username'):
+        userinfo = f"{_quote(proxy['username'])}:{_quote(proxy.get('password', ''))}@"
+    return f"socks5://{userinfo}{_host_port(proxy)}{_fragment(proxy)}"
+
+
+_ENCODERS = {
+    'vless': _encode_vless,
+    'trojan': _encode_trojan,
+    'hysteria2': _encode_hysteria2,
+    'tuic': _encode_tuic,
+    'vmess': _encode_vmess,
+    'ss': _encode_ss,
+    'socks5': _encode_socks5,
+}
+
+
+def proxy_to_share_link(proxy):
+    """将 Clash proxy 字典编码为分享链接，不支持的类型返回 None"""
+    encoder = _ENCODERS.get(str(proxy.get('type', '')).lower())
+    if not encoder or not proxy.get('server') or not proxy.get('port'):
+        return None
+    try:
+        return encoder(proxy)
+    except Exception as e:
+        print(f"Proxy Encode Error [{proxy.get('name')}]: {e}")
+        return None
+
+
+# ------------------------------------------------------------------------------
+# 订阅内容 -> 节点
+# ------------------------------------------------------------------------------
+
+def load_structured_proxies(text, fmt):
+    """读取 Clash / sing-box 订阅内容，返回 Clash proxy 字典列表"""
+    if fmt == FORMAT_CLASH:
+        data = load_yaml_fast(text)
+        proxies = data.get('proxies') if isinstance(data, dict) else None
+        return [p for p in (proxies or []) if isinstance(p, dict)]
+
+    if fmt == FORMAT_SINGBOX:
+        data = json.loads(text)
+        outbounds = data.get('outbounds') if isinstance(data, dict) else data
+        proxies = []
+        for outbound in outbounds or []:
+            proxy = singbox_outbound_to_proxy(outbound)
+            if proxy:
+                proxies.append(proxy)
+        return proxies
+    return []
+
+
+def iter_structured_nodes(text, fmt):
+    """
+    [订阅辅助] 解析 Clash / sing-box 订阅，逐个 yield {'name', 'protocol', 'link'}
+    与 parse_share_line 的返回格式一致
+    """
+    for proxy in load_structured_proxies(text, fmt):
+        link = proxy_to_share_link(proxy)
+        if not link:
+            continue
+        p_type = str(proxy.get('type')).lower()
+        yield {
+            'name': str(proxy.get('name') or _host_port(proxy)).strip(),
+            'protocol': _PROTOCOL_KEYS.get(p_type, p_type),
+            'link': link
+        }
@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import request, make_response
+
+try:
+    import brotli  # 可选依赖：未安装时只提供 gzip
+except ImportError:
+    brotli = None
+
+# 预生成的下载内容缓存
+# 每个产物按 key 存放一份，stamp (例如节点注册表版本) 变化时才重建；
+# 重建使用按 key 的互斥锁 (single-flight)，并发请求只会触发一次生成。
+# 产物同时保存 gzip / brotli 压缩版本和内容哈希 ETag，支持 304。
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIN_COMPRESS_SIZE = 256
+
+
+class Artifact:
+    def __init__(self, body, mimetype, headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers or {}
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+        self.built_at = datetime.now()
+        self.encoded = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.encoded['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+class ArtifactCache:
+    def __init__(self, max_entries=64):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._flights = {}
+        self._max_entries = max_entries
+        self.builds = 0
+        self.hits = 0
+
+    def _lookup(self, key, stamp):
+        with self._lock:
+            item = self._items.get(key)
+            if item and item[0] == stamp:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            return None
+
+    def get(self, key, stamp, builder):
+        """
+        [读] 获取产物；缓存的 stamp 与当前不同则调用 builder() 重建
+        builder 返回 Artifact
+        """
+        artifact = self._lookup(key, stamp)
+        if artifact is not None:
+            return artifact
+
+        with self._lock:
+            flight = self._flights.setdefault(key, threading.Lock())
+        with flight:
+            # 等待期间其他请求可能已经完成重建
+            artifact = self._lookup(key, stamp)
+            if artifact is not None:
+                return artifact
+            artifact = builder()
+            with self._lock:
+                self._items[key] = (stamp, artifact)
+                self._items.move_to_end(key)
+                while len(self._items) > self._max_entries:
+                    old_key, _ = self._items.popitem(last=False)
+                    self._flights.pop(old_key, None)
+                self.builds += 1
+            return artifact
+
+    def invalidate(self, prefix=''):
+        with self._lock:
+            for key in [k for k in self._items if k.startswith(prefix)]:
+                del self._items[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._items), 'builds': self.builds, 'hits': self.hits}
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # 弱比较：忽略 W/ 前缀
+    candidates = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return etag.removeprefix('W/') in candidates
+
+
+def _pick_encoding(artifact):
+    accepted = request.headers.get('Accept-Encoding', '')
+    tokens = {part.split(';')[0].strip().lower() for part in accepted.split(',') if part.strip()}
+    for encoding in ('br', 'gzip'):
+        if encoding in tokens and encoding in artifact.encoded:
+            return encoding
+    return None
+
+
+def artifact_response(artifact, extra_headers=None):
+    """按 If-None-Match / Accept-Encoding 返回 304、压缩或原始内容"""
+    if _etag_matches(request.headers.get('If-None-Match'), artifact.etag):
+        resp = make_response('', 304)
+    else:
+        encoding = _pick_encoding(artifact)
+        resp = make_response(artifact.encoded[encoding] if encoding else artifact.body)
+        resp.mimetype = artifact.mimetype
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        for name, value in artifact.headers.items():
+            resp.headers[name] = value
+
+    resp.headers['ETag'] = artifact.etag
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # 允许客户端缓存，但每次使用前必须用 ETag 重新验证
+    resp.headers['Cache-Control'] = 'no-cache'
+    for name, value in (extra_headers or {}).items():
+        resp.headers[name] = value
+    return resp
@@ -1,9 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-from sqlalchemy import desc, func, case, BigInteger, literal_column, text
+from sqlalchemy import desc, func, case, cast, BigInteger, literal_column, text
 from sqlalchemy.exc import IntegrityError
 from flask_login import UserMixin
+import calendar
 import json
 import os
 
@@ -42,9 +43,9 @@ class Node(db.Model):
     uuid = db.Column(db.String(36), primary_key=True)
     name = db.Column(db.String(128))
     custom_name = db.Column(db.String(128))
-    region = db.Column(db.String(16)) 
-    expired_at = db.Column(db.DateTime)
-    weight = db.Column(db.Integer, default=0)
+    region = db.Column(db.String(16), index=True) 
+    expired_at = db.Column(db.DateTime, index=True)
+    weight = db.Column(db.Integer, default=0, index=True)
     traffic_limit = db.Column(db.BigInteger)
     
     # 链接字段 (JSON) - 兼容 SQLite/PG 使用 Text
@@ -57,6 +58,7 @@ class Node(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     # cascade='all, delete-orphan' 确保删除 Node 时自动删除关联的 HistoryData
     history_data = db.relationship('HistoryData', backref='node', lazy='dynamic', cascade='all, delete-orphan')
+    billing = db.relationship('NodeBilling', backref='node', uselist=False, cascade='all, delete-orphan')
 
     def get_links_dict(self):
         try:
@@ -74,6 +76,92 @@ class HistoryData(db.Model):
     total_down = db.Column(db.BigInteger)
     cpu_usage = db.Column(db.Float)
 
+class NodeBilling(db.Model):
+    """
+    节点账期流量统计 (由快照任务增量维护，仪表盘直接读取)
+    cycle_up / cycle_down 为本账期内经过重启修正的累计用量
+    """
+    __tablename__ = 'node_billing'
+    uuid = db.Column(db.String(36), db.ForeignKey('nodes.uuid'), primary_key=True)
+    # 每月账期重置日 (1-28)
+    reset_day = db.Column(db.Integer, default=1)
+    cycle_start = db.Column(db.DateTime)
+    cycle_end = db.Column(db.DateTime)
+    cycle_up = db.Column(db.BigInteger, default=0)
+    cycle_down = db.Column(db.BigInteger, default=0)
+    # 上一次快照的计数器，用于计算增量
+    last_up = db.Column(db.BigInteger)
+    last_down = db.Column(db.BigInteger)
+    # 最新计数器总和，供节点列表按流量排序 (带索引)
+    last_total = db.Column(db.BigInteger, index=True)
+    last_sample_at = db.Column(db.DateTime)
+    # 本账期开始统计的时间 (节点中途加入时晚于 cycle_start)
+    tracked_since = db.Column(db.DateTime)
+    # 按当前速率预计耗尽限额的时间，None 表示无限额或无消耗
+    exhaust_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    @property
+    def cycle_used(self):
+        return (self.cycle_up or 0) + (self.cycle_down or 0)
+
+class LocalNode(db.Model):
+    """
+    订阅管理节点表 (原 local_nodes.json)
+    保存本地手填/外部订阅节点，以及 DB 节点的排序与分组覆盖 (origin='db')
+    """
+    __tablename__ = 'local_nodes'
+    uuid = db.Column(db.String(64), primary_key=True)
+    name = db.Column(db.String(255), index=True)
+    # 来源: db / local / sub
+    origin = db.Column(db.String(16), index=True, default='local')
+    links = db.Column(db.Text, default='{}')
+    routing_type = db.Column(db.Integer, default=-1)
+    sort_index = db.Column(db.Integer, default=99999)
+    region = db.Column(db.String(64))
+    is_fixed = db.Column(db.Boolean, default=False)
+    sub_source_id = db.Column(db.String(64), index=True)
+    # 其余扩展字段 (JSON)
+    extra = db.Column(db.Text, default='{}')
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    COLUMNS = ('uuid', 'name', 'origin', 'links', 'routing_type', 'sort_index', 'region', 'is_fixed', 'sub_source_id')
+
+    def to_dict(self):
+        try:
+            data = json.loads(self.extra) if self.extra else {}
+        except:
+            data = {}
+        try:
+            links = json.loads(self.links) if self.links else {}
+        except:
+            links = {}
+        data.update({
+            'uuid': self.uuid,
+            'name': self.name,
+            'origin': self.origin,
+            'links': links,
+            'routing_type': self.routing_type,
+            'sort_index': self.sort_index,
+            'is_fixed': bool(self.is_fixed)
+        })
+        if self.region is not None:
+            data['region'] = self.region
+        if self.sub_source_id is not None:
+            data['sub_source_id'] = self.sub_source_id
+        return data
+
+    def apply_dict(self, data):
+        self.name = data.get('name')
+        self.origin = data.get('origin') or 'local'
+        self.links = json.dumps(data.get('links') or {}, ensure_ascii=False)
+        self.routing_type = data.get('routing_type', -1)
+        self.sort_index = data.get('sort_index', 99999)
+        self.region = data.get('region')
+        self.is_fixed = bool(data.get('is_fixed', False))
+        self.sub_source_id = data.get('sub_source_id')
+        self.extra = json.dumps({k: v for k, v in data.items() if k not in self.COLUMNS}, ensure_ascii=False)
+
 
 # =========================================================
 #  第三部分：全局操作接口 (Operations / DAO)
@@ -81,6 +169,18 @@ class HistoryData(db.Model):
 
 # --- 1. 配置相关操作 ---
 
+def ensure_indexes():
+    """
+    补建索引：create_all 不会为已存在的表新增索引，
+    升级后的旧库在这里按模型定义逐个检查并创建
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"Error creating index {index.name}: {e}")
+
 def get_config(key, default=None):
     try:
         setting = AppSetting.query.get(key)
@@ -234,7 +334,11 @@ def delete_node_by_uuid(uuid):
         print(f"Error deleting node {uuid}: {e}")
         return False
 
-def get_nodes_with_latest_traffic():
+def get_nodes_with_latest_traffic(strict=False):
+    """
+    [读] 节点 + 最新一条历史记录
+    strict=True 时查询异常直接抛出，供摘要缓存判断刷新是否失败
+    """
     try:
         subquery = db.session.query(
             HistoryData.uuid,
@@ -253,9 +357,51 @@ def get_nodes_with_latest_traffic():
         
         return query.all()
     except Exception as e:
+        if strict:
+            db.session.rollback()
+            raise
         print(f"Error fetching nodes with latest traffic: {e}")
         return []
 
+# 节点列表分页可用的排序字段
+NODE_SORT_COLUMNS = {
+    'weight': Node.weight,
+    'expiry': Node.expired_at,
+    'region': Node.region,
+    'name': Node.custom_name,
+    'traffic': NodeBilling.last_total
+}
+
+def query_nodes_page(page=1, per_page=24, sort='weight', order='asc', keyword=None, region=None, routing_type=None):
+    """
+    [读] 分页查询节点 (排序/过滤均落在带索引的列上)
+    返回 (总数, [Node, ...])
+    """
+    try:
+        query = Node.query.outerjoin(NodeBilling, Node.uuid == NodeBilling.uuid)
+
+        if keyword:
+            pattern = f"%{keyword}%"
+            query = query.filter(db.or_(Node.custom_name.ilike(pattern), Node.name.ilike(pattern)))
+        if region:
+            query = query.filter(Node.region == region)
+        if routing_type is not None:
+            query = query.filter(Node.routing_type == routing_type)
+
+        total = query.count()
+
+        column = NODE_SORT_COLUMNS.get(sort, Node.weight)
+        direction = column.desc() if order == 'desc' else column.asc()
+        # 空值统一排在最后，再用 uuid 保证分页稳定
+        query = query.order_by(column.is_(None), direction, Node.uuid.asc())
+
+        nodes = query.offset((page - 1) * per_page).limit(per_page).all()
+        return total, nodes
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error querying nodes page: {e}")
+        return 0, []
+
 def update_node_details(uuid, links_dict, routing_type, custom_name):
     try:
         node = Node.query.get(uuid)
@@ -272,6 +418,22 @@ def update_node_details(uuid, links_dict, routing_type, custom_name):
         print(f"Error updating node details {uuid}: {e}")
         return False
 
+def update_nodes_routing(routing_map):
+    """
+    [写] 在一个事务内批量修改节点的路由类型
+    routing_map: {uuid: routing_type}
+    """
+    try:
+        if routing_map:
+            for node in Node.query.filter(Node.uuid.in_(list(routing_map))).all():
+                node.routing_type = int(routing_map[node.uuid])
+            db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error updating nodes routing: {e}")
+        return False
+
 def get_total_consumed_traffic_summary(top_limit=5):
     try:
         total_nodes = Node.query.count()
@@ -392,6 +554,7 @@ def bulk_add_history(records_list):
         
         db.session.bulk_insert_mappings(HistoryData, records_list)
         db.session.commit()
+        return True
     
     except IntegrityError as e:
         # 专门捕获完整性错误 (IntegrityError)
@@ -416,23 +579,132 @@ def bulk_add_history(records_list):
                     db.session.bulk_insert_mappings(HistoryData, records_list)
                     db.session.commit()
                     print(">>> [DB Fix] 重试写入成功！")
-                    return
+                    return True
             except Exception as fix_e:
                 print(f">>> [DB Fix] 自动修复失败: {fix_e}")
                 # 修复失败则抛出原始异常，避免掩盖问题
         
         print(f"Error bulk adding history (IntegrityError): {e}")
+        return False
 
     except Exception as e:
         db.session.rollback()
         print(f"Error bulk adding history: {e}")
+        return False
+
+def get_history_bucket_peaks(uuids, start_time, bucket_seconds):
+    """
+    [读] 单次分组查询：按 (uuid, 时间桶) 取计数器总量的最小/最大值
+    时间桶 = (时间戳秒数 - start_time 秒数) // bucket_seconds
+    返回 [(uuid, bucket, min_total, max_total), ...]
+    """
+    try:
+        if not uuids:
+            return []
+        # 朴素时间统一按 UTC 换算为秒数，两侧口径一致即可
+        start_epoch = calendar.timegm(start_time.timetuple())
+        if 'postgresql' in db.engine.url.drivername:
+            epoch = func.extract('epoch', HistoryData.timestamp)
+        else:
+            epoch = cast(func.strftime('%s', HistoryData.timestamp), db.Integer)
+        bucket = cast((epoch - start_epoch) // bucket_seconds, db.Integer).label('bucket')
+        total = HistoryData.total_up + HistoryData.total_down
+
+        return db.session.query(
+            HistoryData.uuid, bucket, func.min(total), func.max(total)
+        ).filter(
+            HistoryData.uuid.in_(list(uuids)),
+            HistoryData.timestamp >= start_time
+        ).group_by(HistoryData.uuid, bucket).all()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error fetching history buckets: {e}")
+        return []
 
 def get_latest_history(uuid, limit=10):
     return HistoryData.query.filter_by(uuid=uuid)\
         .order_by(desc(HistoryData.timestamp))\
         .limit(limit).all()
 
-# --- 4. 用户相关操作 ---
+# --- 4. 账期流量相关操作 ---
+
+def get_node_billing_map():
+    """[读] 获取所有节点的账期统计，返回 {uuid: NodeBilling}"""
+    try:
+        return {b.uuid: b for b in NodeBilling.query.all()}
+    except Exception as e:
+        print(f"Error fetching node billing: {e}")
+        return {}
+
+def get_node_billing_rows(uuids):
+    try:
+        if not uuids:
+            return {}
+        rows = NodeBilling.query.filter(NodeBilling.uuid.in_(list(uuids))).all()
+        return {b.uuid: b for b in rows}
+    except Exception as e:
+        print(f"Error fetching node billing rows: {e}")
+        return {}
+
+def get_history_since(uuid, start_time):
+    """[读] 获取节点自某时间点起的计数器序列 (仅取必要列)"""
+    try:
+        return db.session.query(
+            HistoryData.timestamp, HistoryData.total_up, HistoryData.total_down
+        ).filter(
+            HistoryData.uuid == uuid,
+            HistoryData.timestamp >= start_time
+        ).order_by(HistoryData.timestamp.asc()).all()
+    except Exception as e:
+        print(f"Error fetching history since {start_time} for {uuid}: {e}")
+        return []
+
+def get_last_history_before(uuid, before_time):
+    """[读] 获取节点在某时间点之前的最后一条计数器 (账期起点前的最后一个样本)，没有返回 None"""
+    try:
+        return db.session.query(
+            HistoryData.timestamp, HistoryData.total_up, HistoryData.total_down
+        ).filter(
+            HistoryData.uuid == uuid,
+            HistoryData.timestamp < before_time
+        ).order_by(HistoryData.timestamp.desc()).first()
+    except Exception as e:
+        print(f"Error fetching history before {before_time} for {uuid}: {e}")
+        return None
+
+# --- 5. 订阅管理节点相关操作 ---
+
+def get_local_node_dicts():
+    """[读] 读取订阅管理节点表，返回 dict 列表"""
+    return [row.to_dict() for row in LocalNode.query.order_by(LocalNode.sort_index).all()]
+
+def save_local_node_changes(upserts, deleted_uuids):
+    """
+    [写] 在一个事务内按行写入订阅管理节点
+    upserts: [node_dict, ...]  deleted_uuids: [uuid, ...]
+    """
+    try:
+        if deleted_uuids:
+            LocalNode.query.filter(LocalNode.uuid.in_(list(deleted_uuids))).delete(synchronize_session=False)
+        if upserts:
+            existing = {
+                row.uuid: row for row in
+                LocalNode.query.filter(LocalNode.uuid.in_([n['uuid'] for n in upserts])).all()
+            }
+            for data in upserts:
+                row = existing.get(data['uuid'])
+                if row is None:
+                    row = LocalNode(uuid=data['uuid'])
+                    db.session.add(row)
+                row.apply_dict(data)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error saving local nodes: {e}")
+        return False
+
+# --- 6. 用户相关操作 ---
 
 def get_user_by_username(username):
     try:
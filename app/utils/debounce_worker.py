@@ -0,0 +1,107 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+from app.utils.scheduler import scheduler
+
+# 合并触发的后台任务
+# request() 只标记"需要重建"并返回一个代次号 (generation)，后台线程在
+# 静默 debounce 秒后 (最长不超过 max_delay 秒) 执行一次任务，覆盖此前
+# 所有请求。需要确认结果的调用方可以 wait(generation)。
+
+
+class DebouncedWorker:
+    def __init__(self, name, func, debounce=0.5, max_delay=3.0):
+        self.name = name
+        self._func = func
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._cond = threading.Condition()
+        self._thread = None
+        self._app = None
+        self._first_request_at = None
+        self._last_request_at = None
+        self.requested = 0
+        self.completed = 0
+        self.last_result = None
+        self.last_run_at = None
+
+    def request(self):
+        """标记需要重建，返回本次请求的代次号 (不阻塞)"""
+        app = current_app._get_current_object() if has_app_context() else getattr(scheduler, 'app', None)
+        with self._cond:
+            if app is not None:
+                self._app = app
+            now = time.monotonic()
+            if self._first_request_at is None:
+                self._first_request_at = now
+            self._last_request_at = now
+            self.requested += 1
+            generation = self.requested
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return generation
+
+    def wait(self, generation, timeout=10):
+        """等待指定代次完成，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.completed < generation:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def run_now(self, timeout=10):
+        """请求一次重建并等待完成，返回任务结果 (超时返回 None)"""
+        generation = self.request()
+        if self.wait(generation, timeout):
+            return self.last_result
+        return None
+
+    def status(self):
+        return {
+            'requested': self.requested,
+            'completed': self.completed,
+            'pending': self.requested > self.completed,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None
+        }
+
+    def _next_batch(self):
+        """等到请求静默 (或达到最长延迟) 后，返回本批覆盖到的代次号"""
+        with self._cond:
+            while self.requested <= self.completed:
+                self._cond.wait()
+            while True:
+                now = time.monotonic()
+                quiet_at = self._last_request_at + self._debounce
+                latest_at = self._first_request_at + self._max_delay
+                wake_at = min(quiet_at, latest_at)
+                if now >= wake_at:
+                    break
+                self._cond.wait(wake_at - now)
+            self._first_request_at = None
+            return self.requested, self._app
+
+    def _loop(self):
+        while True:
+            generation, app = self._next_batch()
+            try:
+                if app is not None:
+                    with app.app_context():
+                        result = self._func()
+                else:
+                    result = self._func()
+            except Exception as e:
+                result = e
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] [{self.name}] 后台任务执行失败: {e}")
+            with self._cond:
+                self.last_result = result
+                self.last_run_at = datetime.now()
+                self.completed = max(self.completed, generation)
+                self._cond.notify_all()
@@ -0,0 +1,59 @@
+import json
+import queue
+import threading
+
+# 进程内事件广播器
+# 每个订阅者 (例如一个 SSE 连接) 持有一个有界队列；发布时不阻塞，
+# 队列满说明客户端消费过慢，直接丢弃该订阅者，由浏览器自动重连。
+
+
+class EventBroadcaster:
+    def __init__(self, max_queue=50):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._max_queue = max_queue
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self._max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def is_subscribed(self, q):
+        with self._lock:
+            return q in self._subscribers
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event, data, event_id=None):
+        """向所有订阅者推送一条事件 (data 会被序列化为 JSON)"""
+        message = format_sse(event, data, event_id)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                self.unsubscribe(q)
+
+
+def format_sse(event, data, event_id=None):
+    """按 text/event-stream 格式编码一条消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+
+# 仪表盘实时推送
+dashboard_events = EventBroadcaster()
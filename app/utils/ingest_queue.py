@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+from app.utils.scheduler import scheduler
+
+# 进程内写入队列
+# submit() 只做入队并返回回执号 (ticket)，由单个后台线程按批取出，
+# 调用一次 apply_batch(items) 合并写入；并发请求之间不再互相覆盖，
+# 一批只产生一次后续处理。调用方可用 status(ticket) / wait(ticket) 确认结果。
+
+QUEUED = 'queued'
+APPLIED = 'applied'
+FAILED = 'failed'
+
+
+class IngestQueue:
+    def __init__(self, name, apply_batch, max_batch=200, linger=0.2, max_size=10000, max_tickets=5000):
+        """
+        apply_batch(items) 在 app 上下文内执行，返回与 items 一一对应的结果 (dict)
+        linger: 取到第一条后再等待多久以合并同时到达的请求
+        """
+        self.name = name
+        self._apply_batch = apply_batch
+        self._max_batch = max_batch
+        self._linger = linger
+        self._queue = queue.Queue(maxsize=max_size)
+        self._cond = threading.Condition()
+        self._tickets = OrderedDict()
+        self._max_tickets = max_tickets
+        self._thread = None
+        self._app = None
+        self.batches = 0
+        self.applied = 0
+        self.failed = 0
+        self.last_batch_at = None
+        self.last_batch_size = 0
+
+    def submit(self, item):
+        """入队并返回回执号 (不阻塞)；队列已满时抛出 queue.Full"""
+        app = current_app._get_current_object() if has_app_context() else getattr(scheduler, 'app', None)
+        ticket = uuid.uuid4().hex
+        with self._cond:
+            if app is not None:
+                self._app = app
+            self._queue.put_nowait((ticket, item))
+            self._tickets[ticket] = {'state': QUEUED, 'queued_at': datetime.now(), 'result': None}
+            while len(self._tickets) > self._max_tickets:
+                self._tickets.popitem(last=False)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+        return ticket
+
+    def status(self, ticket):
+        """回执状态，未知 (或已过期) 的回执返回 None"""
+        with self._cond:
+            record = self._tickets.get(ticket)
+            if record is None:
+                return None
+            return {
+                'state': record['state'],
+                'queued_at': record['queued_at'].isoformat(),
+                'applied_at': record['applied_at'].isoformat() if record.get('applied_at') else None,
+                'result': record['result']
+            }
+
+    def wait(self, ticket, timeout=10):
+        """等待回执处理完成，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                record = self._tickets.get(ticket)
+                if record is None or record['state'] != QUEUED:
+                    return record is not None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': self._queue.qsize(),
+                'batches': self.batches,
+                'applied': self.applied,
+                'failed': self.failed,
+                'last_batch_size': self.last_batch_size,
+                'last_batch_at': self.last_batch_at.isoformat() if self.last_batch_at else None
+            }
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._linger
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            items = [item for _, item in batch]
+            try:
+                app = self._app
+                if app is not None:
+                    with app.app_context():
+                        results = self._apply_batch(items)
+                else:
+                    results = self._apply_batch(items)
+                states = [(APPLIED, r) for r in results]
+            except Exception as e:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] [{self.name}] 批量写入失败: {e}")
+                states = [(FAILED, {'message': str(e)})] * len(batch)
+
+            now = datetime.now()
+            with self._cond:
+                for (ticket, _), (state, result) in zip(batch, states):
+                    record = self._tickets.get(ticket)
+                    if record is not None:
+                        record.update({'state': state, 'result': result, 'applied_at': now})
+                    if state == APPLIED:
+                        self.applied += 1
+                    else:
+                        self.failed += 1
+                self.batches += 1
+                self.last_batch_size = len(batch)
+                self.last_batch_at = now
+                self._cond.notify_all()
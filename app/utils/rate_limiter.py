@@ -0,0 +1,169 @@
+import functools
+import threading
+from datetime import datetime
+
+from flask import request, jsonify, make_response
+from flask_limiter import Limiter
+from limits import parse_many
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app.utils.setting_cache import setting_cache
+
+# 公开订阅接口的访问频率限制
+# - 计数保存在进程内存中 (memory://)，不访问数据库
+# - 每个接口同时受"按 token"与"按 IP"两组共享限额约束，超限返回 429 + Retry-After
+# - 限额格式为 flask-limiter 字符串，多个窗口用分号分隔，例如 "20/second;120/minute"，
+#   使用 moving-window (滑动窗口) 策略，每个窗口独立计数、同时生效：
+#   短窗口限制瞬时突发，长窗口限制持续速率。这只是对令牌桶的近似：
+#   长窗口额度用完后要等最早的请求滑出窗口才恢复，而不是按速率逐个补充
+# - 按 IP 的限额需容纳一次完整的客户端刷新：Clash 客户端会同时请求 /clash、
+#   0.yaml、1.yaml、direct.list、customize.list，同一出口 IP 后还可能有多台设备
+# - 限额从系统设置读取 (经 setting_cache 短时缓存)，修改设置后无需重启
+
+RATE_LIMIT_ENABLED_KEY = 'SUB_RATE_LIMIT_ENABLED'
+TOKEN_LIMIT_KEY = 'SUB_RATE_LIMIT_PER_TOKEN'
+IP_LIMIT_KEY = 'SUB_RATE_LIMIT_PER_IP'
+DEFAULT_TOKEN_LIMIT = '10/second;300/minute'
+DEFAULT_IP_LIMIT = '20/second;120/minute'
+# 镜像资源 (规则集 / geodata) 单独计数：客户端启动时会一次性下载模板引用的全部资源
+# (内置模板约 36 个)，限额按此规模设置，且不占用订阅接口的额度
+MIRROR_LIMIT_KEY = 'SUB_RATE_LIMIT_MIRROR'
+DEFAULT_MIRROR_LIMIT = '60/second;600/minute'
+MAX_TRACKED_CLIENTS = 500
+
+
+def client_ip():
+    """
+    客户端 IP：连接地址
+    配置了 TRUSTED_PROXY_COUNT 时由 ProxyFix 按可信代理层数从 X-Forwarded-For 还原，
+    不直接读取请求头，避免客户端伪造 X-Forwarded-For 绕过按 IP 限流
+    """
+    return request.remote_addr or 'unknown'
+
+
+def client_token():
+    """按 token 计数；未携带 token 的请求 (如脚本回调) 退化为按 IP 计数"""
+    token = request.args.get('token')
+    return f'token:{token}' if token else f'ip:{client_ip()}'
+
+
+_settings = setting_cache
+
+
+def token_limit():
+    return _settings.get(TOKEN_LIMIT_KEY, DEFAULT_TOKEN_LIMIT, parse_many)
+
+
+def ip_limit():
+    return _settings.get(IP_LIMIT_KEY, DEFAULT_IP_LIMIT, parse_many)
+
+
+def mirror_limit():
+    return _settings.get(MIRROR_LIMIT_KEY, DEFAULT_MIRROR_LIMIT, parse_many)
+
+
+def rate_limit_disabled():
+    return str(_settings.get(RATE_LIMIT_ENABLED_KEY, '1')).lower() not in ['1', 'true', 'yes', 'on']
+
+
+class ClientStats:
+    """按客户端 IP 统计公开接口的访问次数与被限流次数，供管理页面查看"""
+
+    def __init__(self, max_clients=MAX_TRACKED_CLIENTS):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._max_clients = max_clients
+
+    def record(self, limited=False):
+        key = client_ip()
+        now = datetime.now()
+        with self._lock:
+            item = self._clients.get(key)
+            if item is None:
+                if len(self._clients) >= self._max_clients:
+                    # 丢弃最久未访问的客户端
+                    oldest = min(self._clients, key=lambda k: self._clients[k]['last_seen'])
+                    del self._clients[oldest]
+                item = self._clients[key] = {'hits': 0, 'limited': 0}
+            item['hits'] += 1
+            if limited:
+                item['limited'] += 1
+            item['last_seen'] = now
+            item['last_path'] = request.path
+            item['user_agent'] = request.headers.get('User-Agent', '')[:120]
+
+    def snapshot(self):
+        with self._lock:
+            rows = [
+                {
+                    'client': key,
+                    'hits': item['hits'],
+                    'limited': item['limited'],
+                    'last_seen': item['last_seen'].strftime('%Y-%m-%d %H:%M:%S'),
+                    'last_path': item['last_path'],
+                    'user_agent': item['user_agent']
+                }
+                for key, item in self._clients.items()
+            ]
+        return sorted(rows, key=lambda r: r['hits'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._clients.clear()
+
+
+client_stats = ClientStats()
+
+
+def _on_breach(request_limit):
+    client_stats.record(limited=True)
+    return None
+
+
+# 全局限流器实例，由 app/__init__.py 调用 init_rate_limiter 绑定
+limiter = Limiter(
+    key_func=client_ip,
+    storage_uri='memory://',
+    strategy='moving-window',
+    headers_enabled=True,
+    on_breach=_on_breach
+)
+
+
+def _limited_endpoint(func, scope, per_token, per_ip):
+    @functools.wraps(func)
+    def counted(*args, **kwargs):
+        client_stats.record()
+        return func(*args, **kwargs)
+
+    limited = limiter.shared_limit(per_token, scope=f'{scope}-token', key_func=client_token,
+                                   exempt_when=rate_limit_disabled)(counted)
+    return limiter.shared_limit(per_ip, scope=f'{scope}-ip', key_func=client_ip,
+                                exempt_when=rate_limit_disabled)(limited)
+
+
+def public_endpoint(func):
+    """
+    公开接口装饰器 (放在 @bp.route 之下)：
+    按 token 与按 IP 两组共享限额，所有公开接口共用同一份计数
+    """
+    return _limited_endpoint(func, 'public', token_limit, ip_limit)
+
+
+def mirror_endpoint(func):
+    """镜像资源下载装饰器：独立的计数范围，按 token / IP 均使用 SUB_RATE_LIMIT_MIRROR"""
+    return _limited_endpoint(func, 'mirror', mirror_limit, mirror_limit)
+
+
+def init_rate_limiter(app):
+    proxy_count = app.config.get('TRUSTED_PROXY_COUNT') or 0
+    if proxy_count > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count)
+    limiter.init_app(app)
+
+    @app.errorhandler(429)
+    def _rate_limited(e):
+        return make_response(jsonify({
+            'status': 'error',
+            'message': f'请求过于频繁，请稍后再试 ({e.description})'
+        }), 429)
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from app.utils.db_manager import get_config
+
+# 系统设置的短时缓存
+# 公开接口 (订阅下载、限流判断) 每个请求都要读取若干开关，直接 get_config 会
+# 在产物缓存命中时仍访问数据库。这里按 SETTING_CACHE_SECONDS 缓存设置值，
+# 设置页面保存后调用 clear() 立即生效。
+
+SETTING_CACHE_SECONDS = 10
+
+
+class SettingCache:
+    """短时间缓存设置值，避免每个请求查询数据库"""
+
+    def __init__(self, ttl=SETTING_CACHE_SECONDS):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._ttl = ttl
+
+    def get(self, key, default, validate=None):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._values.get((key, default))
+            if cached and now - cached[0] < self._ttl:
+                return cached[1]
+        value = get_config(key, default)
+        if validate:
+            try:
+                validate(value)
+            except Exception as e:
+                print(f"设置 {key}={value!r} 无效 ({e})，使用默认值 {default}")
+                value = default
+        with self._lock:
+            self._values[(key, default)] = (now, value)
+        return value
+
+    def flag(self, key, default='0'):
+        """读取开关类设置 (1/true/yes/on 为开启)"""
+        return str(self.get(key, default)).lower() in ['1', 'true', 'yes', 'on']
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+# 全局单例
+setting_cache = SettingCache()
@@ -5,6 +5,10 @@ import sys  # 用于检测打包环境
 class Config:
     # 基础配置
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
+
+    # 前置反向代理的层数 (nginx / Caddy 等)，只信任这么多层追加的 X-Forwarded-For
+    # 0 表示直接对外提供服务，客户端 IP 取连接地址 (限流按此 IP 计数)
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT') or 0)
     
     # 获取项目根目录 (basedir)
     if getattr(sys, 'frozen', False):
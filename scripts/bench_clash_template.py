@@ -0,0 +1,50 @@
+"""
+Clash 模板渲染基准：完整渲染 (ruamel 往返) 与预编译骨架替换的耗时对比
+
+用法: python scripts/bench_clash_template.py [模板路径] [-n 次数]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.modules.subscription.clash_template import CompiledClashTemplate, render_template_full  # noqa: E402
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'modules',
+                                'subscription', 'nodes', 'clash_meta.yaml')
+BASE_URL = 'https://sub.example.com'
+TOKEN = 'tok_0123456789abcdef'
+
+
+def _bench(label, func, rounds):
+    func(0)  # 预热 (骨架在这里完成编译)
+    start = time.perf_counter()
+    for i in range(rounds):
+        func(i)
+    per_call = (time.perf_counter() - start) / rounds
+    print(f"{label:<10} {per_call * 1000:10.3f} ms/次")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Clash 模板渲染基准')
+    parser.add_argument('template', nargs='?', default=DEFAULT_TEMPLATE)
+    parser.add_argument('-n', '--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    compiled = CompiledClashTemplate()
+    if compiled.render(args.template, BASE_URL, TOKEN, 0) != render_template_full(args.template, BASE_URL, TOKEN, 0):
+        print('骨架输出与完整渲染不一致')
+        return 1
+
+    print(f"模板: {os.path.abspath(args.template)}，{args.rounds} 次")
+    full = _bench('完整渲染', lambda i: render_template_full(args.template, BASE_URL, TOKEN, i), args.rounds)
+    skeleton = _bench('骨架替换', lambda i: compiled.render(args.template, BASE_URL, TOKEN, i), args.rounds)
+    print(f"加速比     {full / skeleton:10.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
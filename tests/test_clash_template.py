@@ -0,0 +1,44 @@
+import os
+import shutil
+
+import pytest
+
+from app.modules.subscription.clash_template import (
+    CompiledClashTemplate, collect_remote_resources, render_template_full, _new_yaml
+)
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), '..', 'app', 'modules', 'subscription', 'nodes', 'clash_meta.yaml')
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    path = tmp_path / 'clash_meta.yaml'
+    shutil.copy(TEMPLATE, path)
+    return str(path)
+
+
+def _mirrors(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        urls = collect_remote_resources(_new_yaml().load(f))
+    return {url: f'm{i:02d}' for i, url in enumerate(urls)}
+
+
+@pytest.mark.parametrize('base_url', ['https://sub.example.com', 'http://[2001:db8::1]:8080/a-very-long/reverse-proxy/prefix'])
+@pytest.mark.parametrize('with_mirrors', [False, True])
+def test_skeleton_matches_full_render(template_path, base_url, with_mirrors):
+    mirrors = _mirrors(template_path) if with_mirrors else None
+    compiled = CompiledClashTemplate()
+    token, timestamp = 'tok_0123456789abcdef', 1700000000
+    expected = render_template_full(template_path, base_url, token, timestamp, mirrors)
+    assert compiled.render(template_path, base_url, token, timestamp, mirrors) == expected
+    # 第二次渲染复用骨架，不重新编译
+    assert compiled.render(template_path, base_url, token, timestamp + 1, mirrors) == \
+        render_template_full(template_path, base_url, token, timestamp + 1, mirrors)
+    assert compiled.compiles == 1
+
+
+def test_unsafe_value_falls_back_to_full_render(template_path):
+    compiled = CompiledClashTemplate()
+    base_url = 'https://example.com/#"quoted"'
+    assert compiled.render(template_path, base_url, 'tok', 1) == render_template_full(template_path, base_url, 'tok', 1)
+    assert compiled.compiles == 0
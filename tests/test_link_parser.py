@@ -0,0 +1,22 @@
+import base64
+
+from app.modules.subscription.link_parser import iter_lines_from_chunks, iter_nodes_from_chunks
+
+LINKS = [f'vless://uuid@h{i}.example.com:443?security=tls#n{i}' for i in range(3)]
+
+
+def _chunked(data, size=100):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_base64_content_is_decoded():
+    body = base64.b64encode('\n'.join(LINKS).encode())
+    assert [n['name'] for n in iter_nodes_from_chunks(_chunked(body))] == ['n0', 'n1', 'n2']
+
+
+def test_misdetected_base64_falls_back_to_plain_text():
+    # 开头 300 字节全是 Base64 字符，直到后面的链接才解码失败
+    body = ('A' * 300 + '\n' + '\n'.join(LINKS)).encode()
+    assert [n['name'] for n in iter_nodes_from_chunks(_chunked(body))] == ['n0', 'n1', 'n2']
+    lines = list(iter_lines_from_chunks(_chunked(body)))
+    assert [(no, node is not None) for no, _, node in lines] == [(1, False), (2, True), (3, True), (4, True)]
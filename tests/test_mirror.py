@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import Flask
+
+from app.modules.subscription.mirror import INDEX_FILE, MirrorStore, mirror_id
+
+
+class _Origin:
+    """本地 HTTP 源站：内容可替换，按 ETag 返回 304，记录收到的请求"""
+
+    def __init__(self):
+        self.body = b'rule-set v1\n'
+        self.requests = []
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                etag = '"%s"' % hashlib.md5(origin.body).hexdigest()
+                origin.requests.append(dict(self.headers))
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(origin.body)))
+                self.end_headers()
+                self.wfile.write(origin.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/rules/direct.yaml'
+
+
+@pytest.fixture
+def origin():
+    server = _Origin()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MirrorStore(lambda: str(tmp_path))
+
+
+def _read(store, mid):
+    path, meta = store.get(mid)
+    with open(path, 'rb') as f:
+        return f.read(), meta
+
+
+def _index(store):
+    with open(os.path.join(store._dir(), INDEX_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _leftovers(store):
+    return [name for name in os.listdir(store._dir()) if name.startswith('.download-') or name.endswith('.tmp')]
+
+
+def test_first_fetch_stores_file(store, origin):
+    mid = mirror_id(origin.url)
+    assert store.sync([origin.url]) == {'total': 1, 'fetched': 1, 'not_modified': 0, 'failed': 0}
+    body, meta = _read(store, mid)
+    assert body == origin.body
+    assert meta['sha1'] == hashlib.sha1(origin.body).hexdigest() and meta['size'] == len(origin.body)
+    assert store.version == 1
+    assert store.ready_map() == {origin.url: mid}
+    assert _index(store) == {mid: meta}
+    assert 'If-None-Match' not in origin.requests[0]
+
+
+def test_not_modified_keeps_file_and_version(store, origin):
+    mid = mirror_id(origin.url)
+    store.sync([origin.url])
+    _, before = _read(store, mid)
+    assert store.sync([origin.url])['not_modified'] == 1
+    assert origin.requests[-1]['If-None-Match'] == before['etag']
+    body, meta = _read(store, mid)
+    assert body == origin.body and meta['sha1'] == before['sha1'] and meta['state'] == 'not_modified'
+    assert store.version == 1
+    assert _index(store)[mid]['sha1'] == before['sha1']
+
+
+def test_changed_body_replaces_file_and_bumps_version(store, origin):
+    mid = mirror_id(origin.url)
+    store.sync([origin.url])
+    origin.body = b'rule-set v2 with more rules\n'
+    assert store.sync([origin.url])['fetched'] == 1
+    body, meta = _read(store, mid)
+    assert body == origin.body and meta['sha1'] == hashlib.sha1(origin.body).hexdigest()
+    assert store.version == 2
+    assert _index(store) == {mid: meta}
+    assert _leftovers(store) == []
+
+
+def test_failed_fetch_keeps_previous_file(store, origin):
+    mid = mirror_id(origin.url)
+    store.sync([origin.url])
+    origin.body = b'x' * 1024
+    assert store.sync([origin.url], max_bytes=100)['failed'] == 1
+    body, meta = _read(store, mid)
+    assert body == b'rule-set v1\n' and meta['state'] == 'error'
+    assert store.version == 1
+    assert _leftovers(store) == []
+
+
+def test_dropped_url_removes_file(store, origin):
+    mid = mirror_id(origin.url)
+    store.sync([origin.url])
+    store.sync([])
+    assert store.get(mid) is None and _index(store) == {}
+    assert not os.path.exists(os.path.join(store._dir(), mid))
+    assert store.version == 2
+
+
+def test_mirror_endpoint_etag(store, origin, monkeypatch):
+    from app.modules.subscription import routes
+    from app.utils.rate_limiter import init_rate_limiter
+    from app.utils.setting_cache import setting_cache
+
+    settings = {'api_token': 'tok', 'SUB_RATE_LIMIT_ENABLED': '0'}
+    monkeypatch.setattr(setting_cache, 'get', lambda key, default, validate=None: settings.get(key, default))
+    monkeypatch.setattr(routes, 'mirror_store', store)
+    app = Flask(__name__)
+    init_rate_limiter(app)
+    app.register_blueprint(routes.bp)
+    client = app.test_client()
+
+    store.sync([origin.url])
+    mid = mirror_id(origin.url)
+    assert client.get(f'/subscription/mirror/{mid}').status_code == 403
+    assert client.get('/subscription/mirror/missing?token=tok').status_code == 404
+
+    res = client.get(f'/subscription/mirror/{mid}?token=tok')
+    assert res.status_code == 200 and res.data == origin.body
+    etag = res.headers['ETag']
+    assert etag == f'"{hashlib.sha1(origin.body).hexdigest()}"'
+    res = client.get(f'/subscription/mirror/{mid}?token=tok', headers={'If-None-Match': etag})
+    assert res.status_code == 304 and res.data == b''
+
+    origin.body = b'rule-set v2\n'
+    store.sync([origin.url])
+    res = client.get(f'/subscription/mirror/{mid}?token=tok', headers={'If-None-Match': etag})
+    assert res.status_code == 200 and res.data == origin.body and res.headers['ETag'] != etag
@@ -0,0 +1,89 @@
+import pytest
+
+from app.modules.subscription import node_registry as registry_module
+from app.modules.subscription.node_registry import NodeRegistry
+
+
+def _node(uuid, name=None, sort_index=0):
+    return {'uuid': uuid, 'name': name or uuid, 'origin': 'local', 'links': {'ss': f'ss://{uuid}'},
+            'routing_type': 1, 'is_fixed': False, 'sort_index': sort_index}
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """启动时节点表中已有 a、b，且没有 DB 节点 (启动后无变化，停留在 version 0)"""
+    monkeypatch.setattr(registry_module, 'get_local_node_dicts', lambda: [_node('a', sort_index=1), _node('b', sort_index=2)])
+    monkeypatch.setattr(registry_module, 'get_all_nodes', lambda: [])
+    monkeypatch.setattr(registry_module, 'save_local_node_changes', lambda upserts, deleted: True)
+    monkeypatch.setattr(registry_module, 'get_config', lambda key, default=None: 1)
+    reg = NodeRegistry(lambda: '/nonexistent/local_nodes.json')
+    assert reg.current_version() == 0
+    return reg
+
+
+def test_remove_after_no_change_startup(registry):
+    registry.remove('a')
+    version, delta = registry.changes_since(0)
+    assert version == 1
+    assert delta == {'added': [], 'changed': [], 'removed': ['a']}
+
+
+def test_add_after_no_change_startup(registry):
+    registry.add(_node('c', sort_index=3))
+    _, delta = registry.changes_since(0)
+    assert [n['uuid'] for n in delta['added']] == ['c']
+    assert delta['changed'] == [] and delta['removed'] == []
+
+
+def test_change_after_no_change_startup(registry):
+    registry.update('b', name='renamed')
+    _, delta = registry.changes_since(0)
+    assert delta['added'] == [] and delta['removed'] == []
+    assert [(n['uuid'], n['name']) for n in delta['changed']] == [('b', 'renamed')]
+
+
+def test_failed_edit_is_discarded(registry):
+    with pytest.raises(RuntimeError):
+        with registry.edit() as nodes:
+            del nodes['a']
+            raise RuntimeError('boom')
+    assert registry.current_version() == 0
+    assert registry.get('a') is not None
+    assert registry.changes_since(0) == (0, {'added': [], 'changed': [], 'removed': []})
+
+
+def test_edit_copies_and_fingerprints_only_touched(registry, monkeypatch):
+    untouched = registry._nodes['b']
+    fingerprinted = []
+    real_fingerprint = registry_module._fingerprint
+    monkeypatch.setattr(registry_module, '_fingerprint', lambda node: fingerprinted.append(node['uuid']) or real_fingerprint(node))
+    with registry.edit() as nodes:
+        assert [u for u, _ in nodes.peek_items()] == ['a', 'b']
+        nodes['a']['name'] = 'renamed'
+    assert fingerprinted == ['a']
+    assert registry._nodes['b'] is untouched
+    _, delta = registry.changes_since(0)
+    assert [n['uuid'] for n in delta['changed']] == ['a']
+
+
+def test_flush_writes_only_unsaved_nodes(registry, monkeypatch):
+    saved = []
+    monkeypatch.setattr(registry_module, 'save_local_node_changes', lambda upserts, deleted: saved.append(([n['uuid'] for n in upserts], deleted)) or True)
+    registry.update('a', name='renamed')
+    registry.remove('b')
+    assert registry.flush()
+    assert saved == [(['a'], ['b'])]
+    assert registry.flush()
+    assert len(saved) == 1
+
+
+def test_failed_flush_keeps_unsaved_nodes(registry, monkeypatch):
+    assert registry.flush()
+    monkeypatch.setattr(registry, '_schedule_retry', lambda: None)
+    monkeypatch.setattr(registry_module, 'save_local_node_changes', lambda upserts, deleted: False)
+    registry.update('a', name='renamed')
+    assert not registry.flush()
+    saved = []
+    monkeypatch.setattr(registry_module, 'save_local_node_changes', lambda upserts, deleted: saved.append([n['uuid'] for n in upserts]) or True)
+    assert registry.flush()
+    assert saved == [['a']]
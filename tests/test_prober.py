@@ -0,0 +1,163 @@
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+
+import pytest
+
+from app.modules.subscription.prober import FAIL_THRESHOLD, NodeProber, apply_probe_policy
+
+
+def _serve(listener, handler):
+    def _loop():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handler, args=(conn,), daemon=True).start()
+    threading.Thread(target=_loop, daemon=True).start()
+
+
+def _listen():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    return listener
+
+
+def _drain(conn):
+    with conn:
+        try:
+            while conn.recv(1024):
+                pass
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def open_port():
+    listener = _listen()
+    _serve(listener, _drain)
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = _listen()
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def tls_port(tmp_path):
+    if not shutil.which('openssl'):
+        pytest.skip('openssl 不可用，无法生成自签名证书')
+    cert, key = tmp_path / 'cert.pem', tmp_path / 'key.pem'
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', str(key), '-out', str(cert)], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert), str(key))
+    handshakes = []
+
+    def _handle(conn):
+        try:
+            tls_conn = context.wrap_socket(conn, server_side=True)
+        except (OSError, ssl.SSLError):
+            conn.close()
+            return
+        handshakes.append(tls_conn.version())
+        _drain(tls_conn)
+
+    listener = _listen()
+    _serve(listener, _handle)
+    yield listener.getsockname()[1], handshakes
+    listener.close()
+
+
+def _entry(name, port, p_type='vless', **extra):
+    proxy = dict({'name': name, 'type': p_type, 'server': '127.0.0.1', 'port': port}, **extra)
+    return {'proxy': proxy, 'share_link': f'{p_type}://{name}'}
+
+
+def test_open_port_records_rtt(open_port):
+    prober = NodeProber(timeout=2)
+    entry = _entry('open', open_port)
+    summary = prober.run([entry])
+    assert summary['reachable'] == 1 and summary['unreachable'] == 0
+    assert prober.latency(entry['share_link']) is not None
+    [record] = prober.history(entry['share_link'])
+    assert record['ok'] and record['rtt'] is not None and record['tls_rtt'] is None
+
+
+def test_closed_port_unreachable_after_threshold(closed_port):
+    prober = NodeProber(timeout=2)
+    entry = _entry('closed', closed_port)
+    for _ in range(FAIL_THRESHOLD - 1):
+        prober.run([entry])
+        assert not prober.is_unreachable(entry['share_link'])
+    prober.run([entry])
+    assert prober.is_unreachable(entry['share_link'])
+    assert prober.latency(entry['share_link']) is None
+    assert all(not r['ok'] and r['error'] for r in prober.history(entry['share_link']))
+
+
+def test_tls_handshake_with_self_signed_server(tls_port):
+    port, handshakes = tls_port
+    prober = NodeProber(timeout=3)
+    entry = _entry('tls', port, p_type='trojan', sni='localhost')
+    prober.run([entry])
+    [record] = prober.history(entry['share_link'])
+    assert record['ok'], record['error']
+    assert record['tls_rtt'] is not None and record['tls_rtt'] >= record['rtt']
+    assert prober.latency(entry['share_link']) == record['tls_rtt']
+    assert handshakes
+
+
+def test_tls_probe_fails_against_plain_listener(open_port):
+    prober = NodeProber(timeout=1)
+    entry = _entry('plain', open_port, p_type='trojan')
+    prober.run([entry])
+    [record] = prober.history(entry['share_link'])
+    assert not record['ok'] and record['rtt'] is not None
+
+
+def test_policy_sorts_and_excludes(open_port, closed_port):
+    prober = NodeProber(timeout=2)
+    alive = _entry('alive', open_port)
+    dead = _entry('dead', closed_port)
+    udp = _entry('udp', closed_port, p_type='hysteria2')
+    entries = [dead, udp, alive]
+    for _ in range(FAIL_THRESHOLD):
+        prober.run(entries)
+    assert prober.last_summary['skipped'] == 1
+    # 未知延迟 (UDP 跳过 / 不可达) 排在最后，保持原有顺序
+    assert apply_probe_policy(entries, prober, sort_by_latency=True) == [alive, dead, udp]
+    assert apply_probe_policy(entries, prober, exclude_dead=True) == [udp, alive]
+    assert apply_probe_policy(entries, prober, exclude_dead=True, sort_by_latency=True) == [alive, udp]
+
+
+def test_generated_yaml_follows_probe_policy(monkeypatch, open_port, closed_port):
+    from app.modules.subscription import routes
+
+    prober = NodeProber(timeout=2)
+    entries = [dict(_entry(name, port), routing_type=1) for name, port in
+               (('dead', closed_port), ('alive', open_port))]
+    for _ in range(FAIL_THRESHOLD):
+        prober.run(entries)
+    monkeypatch.setattr(routes, 'node_prober', prober)
+    monkeypatch.setattr(routes.node_registry, 'memo', lambda key, builder: entries)
+
+    def _rendered(exclude_dead, sort_by_latency):
+        monkeypatch.setattr(routes, 'probe_policy', lambda: (exclude_dead, sort_by_latency))
+        proxies_map, _ = routes.build_proxies_map(routes.output_entries())
+        return [p['name'] for p in proxies_map[1]], routes.dump_proxies_yaml(proxies_map[1])
+
+    assert _rendered(False, False)[0] == ['dead', 'alive']
+    names, text = _rendered(False, True)
+    assert names == ['alive', 'dead'] and text.index('alive') < text.index('dead')
+    names, text = _rendered(True, False)
+    assert names == ['alive'] and 'dead' not in text
@@ -0,0 +1,21 @@
+from app.modules.subscription.rule_compiler import KIND_DOMAIN, compile_rules
+
+
+def test_idn_domains_are_punycoded():
+    compiled = compile_rules('DOMAIN-SUFFIX,中国\n例子.测试\nDOMAIN,Bücher.example.\nDOMAIN-KEYWORD,中文\n')
+    assert compiled.errors == []
+    assert compiled.suffixes == {'xn--fiqs8s', 'xn--fsqu00a.xn--0zwm56d'}
+    assert compiled.domains == {'xn--bcher-kva.example'}
+    assert compiled.keywords == {'中文'}
+    assert '+.xn--fiqs8s' in compiled.render(KIND_DOMAIN)
+
+
+def test_idn_suffix_covers_punycode_entry():
+    compiled = compile_rules('DOMAIN-SUFFIX,中国\nDOMAIN,www.xn--fiqs8s\n')
+    assert compiled.domains == set() and compiled.stats['covered'] == 1
+
+
+def test_invalid_domains_are_reported():
+    compiled = compile_rules('DOMAIN,bad..中文\nDOMAIN-SUFFIX,exa mple.com\n')
+    assert [(e['line'], e['message']) for e in compiled.errors] == [(1, '域名格式无效'), (2, '域名格式无效')]
+    assert compiled.stats['invalid'] == 2 and compiled.stats['output'] == 0
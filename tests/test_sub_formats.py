@@ -0,0 +1,40 @@
+from app.modules.subscription.link_parser import _parse_ss
+from app.modules.subscription.sub_formats import proxy_to_singbox_outbound, singbox_outbound_to_proxy
+
+
+def _ss_proxy(plugin, opts):
+    return {'name': 'ss-node', 'type': 'ss', 'server': 'ss.example.com', 'port': 8388,
+            'cipher': 'aes-128-gcm', 'password': 'secret', 'plugin': plugin, 'plugin-opts': opts}
+
+
+def test_obfs_ss_round_trip():
+    proxy = _ss_proxy('obfs', {'mode': 'tls', 'host': 'cdn.example.com'})
+    outbound = proxy_to_singbox_outbound(proxy)
+    assert outbound['plugin'] == 'obfs-local'
+    assert outbound['plugin_opts'] == 'obfs=tls;obfs-host=cdn.example.com'
+    back = singbox_outbound_to_proxy(outbound)
+    assert (back['plugin'], back['plugin-opts']) == (proxy['plugin'], proxy['plugin-opts'])
+    assert proxy_to_singbox_outbound(back) == outbound
+
+
+def test_v2ray_plugin_round_trip():
+    proxy = _ss_proxy('v2ray-plugin', {'mode': 'websocket', 'tls': True, 'host': 'ws.example.com', 'path': '/a;b'})
+    outbound = proxy_to_singbox_outbound(proxy)
+    assert outbound['plugin_opts'] == r'mode=websocket;tls;host=ws.example.com;path=/a\;b'
+    back = singbox_outbound_to_proxy(outbound)
+    assert (back['plugin'], back['plugin-opts']) == (proxy['plugin'], proxy['plugin-opts'])
+
+
+def test_unknown_plugin_options_kept_verbatim():
+    outbound = {'type': 'shadowsocks', 'tag': 'x', 'server': 'h', 'server_port': 1, 'method': 'none',
+                'password': '', 'plugin': 'kcptun', 'plugin_opts': 'crypt=none;mtu=1350'}
+    proxy = singbox_outbound_to_proxy(outbound)
+    assert proxy['plugin-opts'] == {'options': 'crypt=none;mtu=1350'}
+    assert proxy_to_singbox_outbound(proxy)['plugin_opts'] == 'crypt=none;mtu=1350'
+
+
+def test_sip002_plugin_parameter():
+    link = 'ss://YWVzLTEyOC1nY206c2VjcmV0@ss.example.com:8388'
+    proxy = _parse_ss(link, 'ss-node', {'plugin': ['obfs-local;obfs=http;obfs-host=cdn.example.com']})
+    assert proxy['plugin'] == 'obfs'
+    assert proxy['plugin-opts'] == {'mode': 'http', 'host': 'cdn.example.com'}